@@ -1,189 +1,262 @@
 # To install flask, run `pip install flask`
-from flask import Flask, request, flash, make_response, render_template, redirect, url_for
+from flask import Blueprint, Flask, abort, flash, jsonify, make_response, render_template, redirect, request, url_for
 from werkzeug.exceptions import HTTPException
 
-from book_management import add_book, search_books, get_book_details
-from user_management import add_user, search_users, get_user_details, get_user_with_credentials
-from follower_management import add_follower_pair, remove_follower_pair, follower_pair_exists
-from rating_management import get_recent_book_ratings, get_recent_user_ratings, get_recent_followed_user_ratings, \
-    get_book_rating_for_user, add_rating, remove_rating
-
-from utils import should_be_signed_in, should_be_signed_in_as_admin, should_be_signed_out, \
-    get_query_values, get_form_values, get_account_creation_error, get_book_creation_error, get_rating_creation_error
-from config import FLASK_SECRET, FLASK_DEBUG
-
-app = Flask(__name__)
-app.secret_key = FLASK_SECRET
-
-
-@app.get('/')
+from book_management import add_book, search_books, get_book_details, get_book_page
+from user_management import add_user, search_users, get_user_with_credentials, get_users_details, get_user_page, \
+    start_user_stats_reconciler
+from follower_management import add_follower_pair, remove_follower_pair
+from graph_management import get_suggested_user_ids, warm_follower_graph, get_follower_graph_stats
+from rating_management import get_recent_followed_user_ratings, get_book_rating_for_user, add_rating, remove_rating, \
+    get_buffered_rating, schedule_buffered_rating_flush
+from recommendation_management import get_recommended_books
+
+from session_management import SESSION_COOKIE_NAME, create_session, delete_session
+from utils import should_be_signed_in, should_be_signed_in_as_admin, should_be_signed_out, should_be_revalidated, \
+    get_current_user_id, get_query_values, get_form_values, get_next_page_url, get_account_creation_error, \
+    get_book_creation_error, get_rating_creation_error, get_username_taken_error, get_isbn_taken_error
+from pagination import InvalidPageToken
+from async_management import fan_out
+from db_management import init_db, get_db_pool_stats, get_db_replica_stats
+from metrics_management import init_metrics, get_query_metrics
+from cache_management import get_cache_stats
+from fragment_cache import init_fragment_cache, get_fragment_cache_stats
+from membership_management import warm_membership_filters, get_membership_filter_stats
+from version_management import BOOK, USER
+from config import FLASK_SECRET, FLASK_DEBUG, SESSION_MAX_AGE, FOLLOW_SUGGESTION_COUNT
+
+routes = Blueprint('instabook', __name__)
+
+
+@routes.get('/')
 @should_be_signed_in
 def view_feed():
-    current_user_id = int(request.cookies.get('user_id'))
-    recent_follower_ratings = get_recent_followed_user_ratings(current_user_id)
-    return render_template('feed.html', ratings=recent_follower_ratings)
+    current_user_id = get_current_user_id()
+    recent_follower_ratings, next_page_token = get_recent_followed_user_ratings(current_user_id, get_query_values('page'))
+    suggested_users = get_users_details(get_suggested_user_ids(current_user_id, FOLLOW_SUGGESTION_COUNT))
+    return render_template('feed.html', ratings=recent_follower_ratings, suggested_users=suggested_users, next_page_url=get_next_page_url(next_page_token))
 
 
-@app.get('/signup')
+@routes.get('/signup')
 @should_be_signed_out
 def view_signup():
     return render_template('signup.html')
 
 
-@app.post('/signup')
+@routes.post('/signup')
 @should_be_signed_out
 def submit_signup():
     username, display_name, pin = get_form_values('username', 'display_name', 'pin')
     if error := get_account_creation_error(username, display_name, pin):
         flash(error)
-        return redirect(url_for(view_signup.__name__))
-    add_user(username, display_name, pin)
-    return redirect(url_for(view_signin.__name__))
+        return redirect(url_for(f'.{view_signup.__name__}'))
+    if add_user(username, display_name, pin) is None:   # Taken by a request that passed the same checks at the same time
+        flash(get_username_taken_error(username))
+        return redirect(url_for(f'.{view_signup.__name__}'))
+    return redirect(url_for(f'.{view_signin.__name__}'))
 
 
-@app.get('/signin')
+@routes.get('/signin')
 @should_be_signed_out
 def view_signin():
     return render_template('signin.html')
 
 
-@app.post('/signin')
+@routes.post('/signin')
 @should_be_signed_out
 def submit_signin():
     username, pin = get_form_values('username', 'pin')
-    response = make_response(redirect(url_for(view_signin.__name__)))
-    if (user_id := get_user_with_credentials(username, pin)) is None:
+    response = make_response(redirect(url_for(f'.{view_signin.__name__}')))
+    if (user := get_user_with_credentials(username, pin)) is None:
         flash('Invalid details, please try again')
     else:
-        response.set_cookie('user_id', str(user_id), max_age=3600)
+        session_token = create_session(user['id'])
+        response.set_cookie(SESSION_COOKIE_NAME, session_token, max_age=SESSION_MAX_AGE, httponly=True, samesite='Lax')
     return response
 
 
-@app.post('/signout')
+@routes.post('/signout')
 @should_be_signed_in
 def submit_signout():
-    response = make_response(redirect(url_for(view_signin.__name__)))
-    response.delete_cookie('user_id')
+    delete_session(request.cookies.get(SESSION_COOKIE_NAME))
+    response = make_response(redirect(url_for(f'.{view_signin.__name__}')))
+    response.delete_cookie(SESSION_COOKIE_NAME)
     return response
 
 
-@app.get('/books/search')
+@routes.get('/books/search')
 @should_be_signed_in
 def find_book():
-    title = get_query_values('title') or ''
-    matching_books = search_books(title) if title else None
-    return render_template('search_books.html', title=title, books=matching_books)
+    title, page_token = get_query_values('title', 'page')
+    title = title or ''
+    matching_books, next_page_token = search_books(title, page_token) if title else (None, None)
+    return render_template('search_books.html', title=title, books=matching_books, next_page_url=get_next_page_url(next_page_token))
 
 
-@app.get('/books/<int:book_id>')
+@routes.get('/books/<int:book_id>')
 @should_be_signed_in
+@should_be_revalidated(BOOK, 'book_id', get_buffered_rating)
 def view_book(book_id):
-    current_user_id = int(request.cookies.get('user_id'))
-    book_details = get_book_details(book_id)
-    book_ratings = get_recent_book_ratings(book_id)
-    current_user_rating = get_book_rating_for_user(book_id, current_user_id)
+    current_user_id = get_current_user_id()
+    book_page, recommended_books = fan_out((get_book_page, book_id, current_user_id, get_query_values('page')), (get_recommended_books, book_id))
+    if book_page is None:
+        abort(404)
+    current_user_rating = book_page['current_user_rating']
     current_user_score = current_user_rating['score'] if current_user_rating is not None else None
-    return render_template('view_book.html', current_user_id=current_user_id, current_user_score=current_user_score, book_details=book_details, book_ratings=book_ratings)
+    return render_template('view_book.html', current_user_id=current_user_id, current_user_score=current_user_score, book_details=book_page['book_details'], book_ratings=book_page['book_ratings'], recommended_books=recommended_books, next_page_url=get_next_page_url(book_page['next_page_token']))
 
 
-@app.get('/books/<int:book_id>/rate')
+@routes.get('/books/<int:book_id>/rate')
 @should_be_signed_in
 def view_rate_book(book_id):
-    current_user_id = int(request.cookies.get('user_id'))
-    book_details = get_book_details(book_id)
-    current_rating = get_book_rating_for_user(book_id, current_user_id)
+    current_user_id = get_current_user_id()
+    book_details, current_rating = fan_out((get_book_details, book_id), (get_book_rating_for_user, book_id, current_user_id))
     current_score, current_review = (current_rating['score'], current_rating['review']) if current_rating else ('', '')
     return render_template('rate_book.html', book_details=book_details, current_score=current_score, current_review=current_review)
 
 
-@app.post('/books/<int:book_id>/rate')
+@routes.post('/books/<int:book_id>/rate')
 @should_be_signed_in
 def submit_rate_book(book_id):
-    current_user_id = int(request.cookies.get('user_id'))
+    current_user_id = get_current_user_id()
     score, review = get_form_values('score', 'review')
     if error := get_rating_creation_error(score, review):
         flash(error)
-        return redirect(url_for(view_rate_book.__name__))
-    remove_rating(current_user_id, book_id)  # Remove any existing rating for the current user
-    add_rating(current_user_id, book_id, score, review)  # Add the new rating
-    return redirect(url_for(view_book.__name__, book_id=book_id))
+        return redirect(url_for(f'.{view_rate_book.__name__}', book_id=book_id))
+    add_rating(current_user_id, book_id, score, review)  # Replaces any existing rating for the current user
+    return redirect(url_for(f'.{view_book.__name__}', book_id=book_id))
 
 
-@app.post('/books/<int:book_id>/unrate')
+@routes.post('/books/<int:book_id>/unrate')
 @should_be_signed_in
 def submit_unrate_book(book_id):
-    current_user_id = int(request.cookies.get('user_id'))
+    current_user_id = get_current_user_id()
     remove_rating(current_user_id, book_id)
-    return redirect(url_for(view_book.__name__, book_id=book_id))
+    return redirect(url_for(f'.{view_book.__name__}', book_id=book_id))
 
 
-@app.get('/books/add')
+@routes.get('/books/add')
 @should_be_signed_in_as_admin
 def view_add_book():
     return render_template('add_book.html')
 
 
-@app.post('/books/add')
+@routes.post('/books/add')
 @should_be_signed_in_as_admin
 def submit_add_book():
     title, author, isbn = get_form_values('title', 'author', 'isbn')
     if error := get_book_creation_error(title, author, isbn):
         flash(error)
-        return redirect(url_for(view_add_book.__name__))
-    new_book_id = add_book(title, author, isbn)
-    return redirect(url_for(view_book.__name__, book_id=new_book_id))
+        return redirect(url_for(f'.{view_add_book.__name__}'))
+    if (new_book_id := add_book(title, author, isbn)) is None:
+        flash(get_isbn_taken_error(isbn))
+        return redirect(url_for(f'.{view_add_book.__name__}'))
+    return redirect(url_for(f'.{view_book.__name__}', book_id=new_book_id))
 
 
-@app.get('/users/search')
+@routes.get('/users/search')
 @should_be_signed_in
 def find_user():
-    current_user_id = int(request.cookies.get('user_id'))
-    name = get_query_values('name') or ''
-    matching_users = search_users(name) if name else None
-    return render_template('search_users.html', current_user_id=current_user_id, name=name, users=matching_users)
+    current_user_id = get_current_user_id()
+    name, page_token = get_query_values('name', 'page')
+    name = name or ''
+    matching_users, next_page_token = search_users(name, page_token) if name else (None, None)
+    return render_template('search_users.html', current_user_id=current_user_id, name=name, users=matching_users, next_page_url=get_next_page_url(next_page_token))
 
 
-@app.get('/users/<int:user_id>')
+@routes.get('/users/<int:user_id>')
 @should_be_signed_in
+@should_be_revalidated(USER, 'user_id')
 def view_user(user_id):
-    current_user_id = int(request.cookies.get('user_id'))
+    current_user_id = get_current_user_id()
     is_current_user = (user_id == current_user_id)
-    current_user_follows_user = follower_pair_exists(current_user_id, user_id)
-    user_details = get_user_details(user_id)
-    user_ratings = get_recent_user_ratings(user_id)
-    return render_template('view_user.html', is_current_user=is_current_user, current_user_follows_user=current_user_follows_user, user_details=user_details, user_ratings=user_ratings)
+    if (user_page := get_user_page(user_id, current_user_id, get_query_values('page'))) is None:
+        abort(404)
+    return render_template('view_user.html', is_current_user=is_current_user, current_user_follows_user=user_page['current_user_follows_user'], user_details=user_page['user_details'], user_stats=user_page['user_stats'], user_ratings=user_page['user_ratings'], next_page_url=get_next_page_url(user_page['next_page_token']))
 
 
-@app.get('/users/me')
+@routes.get('/users/me')
 @should_be_signed_in
 def view_self():
-    current_user_id = int(request.cookies.get('user_id'))
-    return redirect(url_for(view_user.__name__, user_id=current_user_id))
+    current_user_id = get_current_user_id()
+    return redirect(url_for(f'.{view_user.__name__}', user_id=current_user_id))
 
 
-@app.post('/users/<int:user_id>/follow')
+@routes.post('/users/<int:user_id>/follow')
 @should_be_signed_in
 def follow_user(user_id):
-    current_user_id = int(request.cookies.get('user_id'))
+    current_user_id = get_current_user_id()
     add_follower_pair(current_user_id, user_id)
-    return redirect(url_for(view_user.__name__, user_id=user_id))
+    return redirect(url_for(f'.{view_user.__name__}', user_id=user_id))
 
 
-@app.post('/users/<int:user_id>/unfollow')
+@routes.post('/users/<int:user_id>/unfollow')
 @should_be_signed_in
 def unfollow_user(user_id):
-    current_user_id = int(request.cookies.get('user_id'))
+    current_user_id = get_current_user_id()
     remove_follower_pair(current_user_id, user_id)
-    return redirect(url_for(view_user.__name__, user_id=user_id))
+    return redirect(url_for(f'.{view_user.__name__}', user_id=user_id))
+
 
+@routes.get('/metrics')
+@should_be_signed_in_as_admin
+def view_metrics():
+    return jsonify(queries=get_query_metrics(), db_pool=get_db_pool_stats(), db_replicas=get_db_replica_stats(), cache=get_cache_stats(), fragment_cache=get_fragment_cache_stats(), membership_filters=get_membership_filter_stats(), follower_graph=get_follower_graph_stats())
 
-@app.errorhandler(HTTPException)
+
+@routes.app_errorhandler(InvalidPageToken)
+def show_page_token_error(error):
+    return render_template('error.html', error_code=400, error_message='That page link is not valid.'), 400
+
+
+@routes.app_errorhandler(HTTPException)
 def show_http_error(error):
     if error.code == 404:
         message = 'We couldn\'t find what you were looking for.'
     else:
         message = 'Something went wrong'
-    return render_template('error.html', error_code=error.code, error_message=message)
-
-
-app.run(debug=FLASK_DEBUG)
+    return render_template('error.html', error_code=error.code, error_message=message), error.code
+
+
+def create_app(config=None):
+    """
+    Creates the Instabook app. Nothing is read from the database until the app handles its first request,
+    or :func:`warm_app` is called.
+
+    :param config: Flask settings to apply on top of the defaults, such as <code>{'TESTING': True}</code>
+    :type config: dict or None
+    :rtype: flask.Flask
+    """
+    app = Flask(__name__)
+    app.secret_key = FLASK_SECRET
+    app.config.update(config or {})
+    init_metrics(app)
+    init_db(app)
+    init_fragment_cache(app)
+    app.register_blueprint(routes)
+    return app
+
+
+def warm_app(app):
+    """
+    Loads what the first requests would otherwise wait for: the membership filters, the follower graph and the
+    compiled templates. Called before forking workers, so that they share it instead of each loading their own.
+
+    *(Tables involved: users u, books b, followers f)*
+
+    :param app: the app, from :func:`create_app`
+    :type app: flask.Flask
+    :rtype: None
+    """
+    warm_membership_filters()
+    warm_follower_graph()
+    for template_name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(template_name)
+
+
+if __name__ == '__main__':
+    app = create_app()
+    warm_app(app)
+    schedule_buffered_rating_flush()    # Picks up ratings logged before a crash
+    start_user_stats_reconciler()
+    app.run(debug=FLASK_DEBUG)
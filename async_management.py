@@ -0,0 +1,56 @@
+"""
+Runs independent database reads at once, so that a page waits for its slowest query rather than all of them.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+from db_management import PoolBusyError, bind_fail_when_busy, bind_read_from_primary, should_read_from_primary
+from metrics_management import bind_query_stats, get_request_query_stats
+from config import DB_FAN_OUT_WORKERS
+
+_executor = None
+
+
+def get_executor():
+    """Gets the thread pool calls are fanned out to. Its threads are only started once it is first used."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(DB_FAN_OUT_WORKERS, thread_name_prefix='db-fan-out')
+    return _executor
+
+
+def _forget_executor():
+    global _executor
+    _executor = None    # Its threads were not copied into the forked process
+
+
+os.register_at_fork(after_in_child=_forget_executor)
+
+
+def fan_out(*calls):
+    """
+    Runs several blocking reads at once, and waits for all of them.
+
+    The first runs in the calling thread, on the request's own connection. The rest run on the thread pool, each with
+    a connection of its own, unless the pool has none free: since the request already holds one, they run after the
+    first in the calling thread instead of waiting for another. Only reads should be fanned out, as the other threads
+    do not see writes the request has not committed yet.
+
+    :param calls: <code>(func, *args)</code> tuples, such as <code>(get_book_details, book_id)</code>
+    :type calls: tuple
+    :return: their results, in the same order
+    :rtype: list
+    :raises Exception: the first exception any of the reads raised
+    """
+    (first_func, *first_args), *other_calls = calls
+    query_stats, read_from_primary = get_request_query_stats(), should_read_from_primary()
+    futures = [get_executor().submit(bind_read_from_primary(bind_query_stats(bind_fail_when_busy(func), query_stats),
+                                                            read_from_primary), *args)
+               for func, *args in other_calls]
+    results = [first_func(*first_args)]
+    for (func, *args), future in zip(other_calls, futures):
+        try:
+            results.append(future.result())
+        except PoolBusyError:
+            results.append(func(*args))
+    return results
@@ -0,0 +1,185 @@
+"""
+Benchmarks every route of the app against the configured database.
+
+Load a realistic dataset first, for example with ``python generate_data.py --ratings 1000000``.
+Run ``python benchmark_routes.py --help`` for the available options.
+"""
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from http.cookies import SimpleCookie
+from random import Random
+from statistics import quantiles
+from time import perf_counter
+from urllib.parse import urlencode, urlsplit
+import json
+import sys
+
+from benchmark_search import WORDS
+from db_management import get_db_connection
+from session_management import SESSION_COOKIE_NAME
+
+# The method, path and form of a request to each route, picked at random from the dataset
+ROUTES = {
+    'feed': lambda random, data: ('GET', '/', None),
+    'search_books': lambda random, data: ('GET', '/books/search?' + urlencode({'title': random.choice(WORDS)}), None),
+    'search_users': lambda random, data: ('GET', '/users/search?' + urlencode({'name': random.choice(data['names'])}), None),
+    'view_book': lambda random, data: ('GET', f'/books/{random.randint(1, data["max_book_id"])}', None),
+    'view_user': lambda random, data: ('GET', f'/users/{random.randint(1, data["max_user_id"])}', None),
+    'rate_book': lambda random, data: ('POST', f'/books/{random.randint(1, data["max_book_id"])}/rate',
+                                       {'score': random.randint(1, 5), 'review': random.choice(WORDS)}),
+    'follow_user': lambda random, data: ('POST', f'/users/{random.randint(1, data["max_user_id"])}/follow', {}),
+}
+
+
+class TestClientSession:
+    """Sends requests to the app in this process, through Flask's test client."""
+
+    def __init__(self, base_url):
+        from app import create_app
+        self._client = create_app().test_client()
+
+    def sign_in(self, username, pin):
+        self.request('POST', '/signin', {'username': username, 'pin': pin})
+        return self._client.get_cookie(SESSION_COOKIE_NAME) is not None
+
+    def request(self, method, path, form):
+        response = self._client.open(path, method=method, data=form)
+        response.close()
+        return response.status_code, int(response.headers.get('X-Query-Count', 0))
+
+
+class HttpSession:
+    """Sends requests to a running server over a kept-alive HTTP connection, carrying its session cookie."""
+
+    def __init__(self, base_url):
+        url = urlsplit(base_url)
+        self._connection = HTTPConnection(url.hostname, url.port or 80)
+        self._cookie = ''
+
+    def sign_in(self, username, pin):
+        self.request('POST', '/signin', {'username': username, 'pin': pin})
+        return bool(self._cookie)
+
+    def request(self, method, path, form):
+        headers = {'Cookie': self._cookie}
+        body = None
+        if form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        self._connection.request(method, path, body, headers)
+        response = self._connection.getresponse()
+        response.read()
+        cookie = SimpleCookie(response.headers.get('Set-Cookie', ''))
+        if SESSION_COOKIE_NAME in cookie:
+            self._cookie = f'{SESSION_COOKIE_NAME}={cookie[SESSION_COOKIE_NAME].value}'
+        return response.status, int(response.headers.get('X-Query-Count', 0))
+
+
+def load_dataset(worker_count):
+    with get_db_connection() as connection:
+        with connection.cursor(dictionary=True) as cursor:
+            cursor.execute("""SELECT u.username, u.pin, u.display_name
+                                FROM users AS u
+                            ORDER BY u.id
+                               LIMIT %s""", [worker_count])
+            accounts = cursor.fetchall()
+            cursor.execute("""SELECT (SELECT MAX(u.id) FROM users AS u) AS max_user_id,
+                                     (SELECT MAX(b.id) FROM books AS b) AS max_book_id""")
+            data = cursor.fetchone()
+    if len(accounts) < worker_count or data['max_book_id'] is None:
+        raise SystemExit(f'The database needs at least {worker_count} users and one book. Run generate_data.py first.')
+    data['names'] = [account['display_name'].split()[0] for account in accounts]
+    return accounts, data
+
+
+def run_route(route, sessions, data, request_count, seed):
+    def work(worker_index):
+        random = Random(f'{seed}:{route}:{worker_index}')
+        session = sessions[worker_index]
+        results = []
+        for _ in range(request_count // len(sessions) + (worker_index < request_count % len(sessions))):
+            method, path, form = ROUTES[route](random, data)
+            start = perf_counter()
+            status, query_count = session.request(method, path, form)
+            results.append(((perf_counter() - start) * 1000, query_count, status >= 400))
+        return results
+
+    start = perf_counter()
+    with ThreadPoolExecutor(len(sessions)) as executor:
+        results = [result for worker_results in executor.map(work, range(len(sessions))) for result in worker_results]
+    elapsed = perf_counter() - start
+    latencies = [latency for latency, _, _ in results]
+    percentiles = quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    return {
+        'requests': len(results),
+        'requests_per_second': len(results) / elapsed,
+        'p50_ms': percentiles[49],
+        'p95_ms': percentiles[94],
+        'p99_ms': percentiles[98],
+        'queries_per_request': sum(query_count for _, query_count, _ in results) / len(results),
+        'errors': sum(error for _, _, error in results),
+    }
+
+
+def find_regressions(results, baseline, tolerance):
+    regressions = []
+    for route, result in results.items():
+        if route not in baseline:
+            continue
+        before = baseline[route]
+        if result['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(f'{route}: p95 went from {before["p95_ms"]:.2f} ms to {result["p95_ms"]:.2f} ms')
+        if result['requests_per_second'] < before['requests_per_second'] / (1 + tolerance):
+            regressions.append(f'{route}: throughput went from {before["requests_per_second"]:.1f} '
+                               f'to {result["requests_per_second"]:.1f} requests/s')
+        if result['queries_per_request'] > before['queries_per_request'] + 0.05:  # Query counts should not drift at all
+            regressions.append(f'{route}: queries per request went from {before["queries_per_request"]:.2f} '
+                               f'to {result["queries_per_request"]:.2f}')
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--target', choices=['client', 'http'], default='client',
+                        help="send requests through Flask's test client, or over HTTP to --url")
+    parser.add_argument('--url', default='http://localhost:5000', help='the running server to benchmark with --target http')
+    parser.add_argument('--routes', nargs='+', choices=list(ROUTES), default=list(ROUTES), help='the routes to benchmark')
+    parser.add_argument('--requests', type=int, default=500, help='number of requests sent to each route')
+    parser.add_argument('--concurrency', type=int, default=4, help='number of workers sending requests at once')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the ids and search terms requested')
+    parser.add_argument('--baseline', help='fail if results are worse than the ones saved in this file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='how much slower than the baseline is allowed, as a fraction')
+    parser.add_argument('--save-baseline', help='save the results to this file, to compare later runs against')
+    args = parser.parse_args()
+
+    accounts, data = load_dataset(args.concurrency)
+    session_class = HttpSession if args.target == 'http' else TestClientSession
+    sessions = [session_class(args.url) for _ in range(args.concurrency)]
+    for session, account in zip(sessions, accounts):
+        if not session.sign_in(account['username'], account['pin']):
+            raise SystemExit(f'Could not sign in as {account["username"]}')
+
+    results = {}
+    print(f'{"route":<14} {"requests":>8} {"req/s":>9} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"queries":>8} {"errors":>7}')
+    for route in args.routes:
+        result = results[route] = run_route(route, sessions, data, args.requests, args.seed)
+        print(f'{route:<14} {result["requests"]:>8} {result["requests_per_second"]:>9.1f} {result["p50_ms"]:>9.2f} '
+              f'{result["p95_ms"]:>9.2f} {result["p99_ms"]:>9.2f} {result["queries_per_request"]:>8.2f} {result["errors"]:>7}')
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        print(f'Saved the results to {args.save_baseline}')
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = find_regressions(results, json.load(baseline_file), args.tolerance)
+        if regressions:
+            print('Regressions against the baseline:', *regressions, sep='\n    ')
+            return 1
+        print('No regressions against the baseline')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
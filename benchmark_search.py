@@ -0,0 +1,99 @@
+"""
+Compares the indexed book search with the old ``LIKE '%...%'`` title scan.
+
+Run ``python benchmark_search.py --help`` for the available options.
+"""
+# To install mysql.connector, run `pip install mysql-connector-python`
+from argparse import ArgumentParser
+from random import Random
+from statistics import median, quantiles
+from time import perf_counter
+import re
+
+from mysql.connector import connect
+
+from search_management import tokenize, get_search_matches_query
+from config import DB_HOST, DB_USER, DB_PASS, PAGE_SIZE
+
+WORDS = ['the', 'of', 'and', 'a', 'dragon', 'night', 'house', 'garden', 'secret', 'war', 'river', 'stone', 'king',
+         'queen', 'shadow', 'winter', 'summer', 'city', 'sea', 'fire', 'glass', 'silver', 'golden', 'last', 'lost',
+         'little', 'wild', 'dark', 'bright', 'song', 'story', 'letters', 'wizard', 'dishwasher', 'ferret', 'chairs',
+         'bracelets', 'pedicures', 'rocks', 'library', 'mountain', 'forest', 'island', 'journey', 'empire', 'orchard']
+AUTHORS = ['Jane Austen', 'J. K. Rowling', 'C. S. Lewis', 'Beatrix Potter', 'George R. R. Martin', 'Ursula Le Guin',
+           'Toni Morrison', 'Chinua Achebe', 'Haruki Murakami', 'Octavia Butler', 'Italo Calvino', 'Zadie Smith']
+SEARCH_TERMS = ['dragon', 'dish', 'the king', 'golden orchard', 'wizard of the', 'ferret', 'murakami', 'zzz', 's', 't s']
+
+OLD_SEARCH_SQL = """SELECT b.id,
+                           b.title,
+                           b.author
+                      FROM books AS b
+                     WHERE b.title LIKE CONCAT('%', %s, '%')"""
+
+
+def create_tables(cursor, database):
+    with open('sql_scripts/schema.sql') as schema_file:
+        schema = schema_file.read()
+    cursor.execute(f'CREATE DATABASE IF NOT EXISTS {database}')
+    cursor.execute(f'USE {database}')
+    for table in ('books', 'book_search_tokens'):
+        cursor.execute(re.search(rf'CREATE TABLE IF NOT EXISTS {table} \(.*?\n\);', schema, re.DOTALL).group())
+
+
+def load_books(connection, book_count, seed, batch_size=10000):
+    random = Random(seed)
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT COUNT(*) FROM books')
+        first_id = cursor.fetchone()[0] + 1
+        for batch_start in range(first_id, book_count + 1, batch_size):
+            books, tokens = [], []
+            for book_id in range(batch_start, min(batch_start + batch_size, book_count + 1)):
+                title = ' '.join(random.choices(WORDS, k=random.randint(2, 6))).capitalize()
+                author = random.choice(AUTHORS)
+                books.append((book_id, title, author))
+                tokens += [(token, book_id) for token in dict.fromkeys(tokenize(title) + tokenize(author))]
+            cursor.executemany('INSERT INTO books (id, title, author) VALUES (%s, %s, %s)', books)
+            cursor.executemany('INSERT INTO book_search_tokens (token, book_id) VALUES (%s, %s)', tokens)
+            connection.commit()
+            print(f'\rLoaded {books[-1][0]:,} of {book_count:,} books', end='', flush=True)
+    print()
+
+
+def time_query(cursor, sql, params, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = perf_counter()
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+        timings.append((perf_counter() - start) * 1000)
+    return timings, len(rows)
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--books', type=int, default=1_000_000, help='number of synthetic books to load')
+    parser.add_argument('--database', default='instabook_search_benchmark', help='scratch database to load them into')
+    parser.add_argument('--repeats', type=int, default=20, help='number of times each query is timed')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the synthetic titles')
+    args = parser.parse_args()
+
+    with connect(host=DB_HOST, user=DB_USER, password=DB_PASS) as connection:
+        with connection.cursor() as cursor:
+            create_tables(cursor, args.database)
+        load_books(connection, args.books, args.seed)
+
+        print(f'{"search":<16} {"query":<6} {"rows":>6} {"median ms":>10} {"p95 ms":>10}')
+        with connection.cursor() as cursor:
+            for term in SEARCH_TERMS:
+                matches_sql, params = get_search_matches_query(connection, 'books', term, None, PAGE_SIZE)
+                indexed_sql = f"""SELECT b.id, b.title, b.author
+                                    FROM ({matches_sql}) AS m
+                                    JOIN books AS b
+                                      ON b.id = m.id"""
+                for label, sql, query_params in (('LIKE', OLD_SEARCH_SQL, [term]), ('index', indexed_sql, params)):
+                    timings, row_count = time_query(cursor, sql, query_params, args.repeats)
+                    p95 = quantiles(timings, n=20)[-1] if len(timings) > 1 else timings[0]
+                    print(f'{term!r:<16} {label:<6} {row_count:>6} {median(timings):>10.2f} {p95:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
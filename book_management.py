@@ -1,11 +1,17 @@
-from db_management import get_db_connection
+from db_management import READ, Error, get_db_connection, is_duplicate_key_error
+from cache_management import cached, invalidate
+from membership_management import might_contain, record_false_positive, remember
+from pagination import decode_page_token, get_page, get_recency_condition
+from rating_management import get_buffered_rating
+from search_management import index_book, get_search_matches_query
+from config import PAGE_SIZE
 
 
 def add_book(title, author, isbn):
     """
-    Adds a new book to the database.
+    Adds a new book to the database and to the search index.
 
-    *(Tables involved: books b)*
+    *(Tables involved: books b, book_search_tokens t)*
 
     :param title: the title of the book to add
     :type title: str
@@ -13,19 +19,33 @@ def add_book(title, author, isbn):
     :type author: str
     :param isbn: the isbn of the book to add
     :type isbn: str
-    :return: the id of the newly added book
-    :rtype: int
+    :return: the id of the newly added book, or <code>None</code> if the isbn was taken in the meantime
+    :rtype: int or None
     """
     with get_db_connection() as connection:
         with connection.cursor(dictionary=True) as cursor:
-            # Temporary code
-            new_book_id = 1
+            try:
+                cursor.execute("""INSERT
+                                    INTO books (title, author, isbn)
+                                  VALUES (%s, %s, %s)""", [title, author or None, isbn or None])
+            except Error as error:
+                if not is_duplicate_key_error(error):
+                    raise
+                remember('isbns', isbn)
+                return None
+            new_book_id = cursor.lastrowid
+            if isbn:
+                remember('isbns', isbn)
+            index_book(cursor, new_book_id, title, author)
+            connection.commit()
+            invalidate('book_details', new_book_id)
             return new_book_id
 
 
 def book_exists(isbn):
     """
-    Finds whether a book with a particular isbn already exists in the database.
+    Finds whether a book with a particular isbn already exists in the database. Isbns that are definitely free
+    are answered from an in-memory filter without a query.
 
     *(Tables involved: books b)*
 
@@ -34,52 +54,72 @@ def book_exists(isbn):
     :return: <code>True</code> if a book with the isbn is taken, or <code>False</code> otherwise
     :rtype: bool
     """
+    if not might_contain('isbns', isbn):
+        return False
     with get_db_connection() as connection:
         with connection.cursor(dictionary=True) as cursor:
-            # Temporary code
-            book = None
+            cursor.execute("""SELECT b.id
+                                FROM books AS b
+                               WHERE b.isbn = %s""", [isbn])
+            book = cursor.fetchone()
+            if book is None:
+                record_false_positive('isbns')
             return False if book is None else True
 
 
-def search_books(title):
+def search_books(query, page_token=None, page_size=PAGE_SIZE):
     """
-    Finds all books whose titles are like a particular title.
+    Finds a page of the books whose title or author best match a search query, best matches first.
 
-    *(Tables involved: books b, book_ratings r)*
+    *(Tables involved: books b, book_rating_stats s, book_search_tokens t)*
 
-    :param title: the title to search for
-    :type title: str
+    :param query: the words to search for
+    :type query: str
+    :param page_token: the token of the page to get, or <code>None</code> for the first page
+    :type page_token: str or None
+    :param page_size: the maximum number of books on a page
+    :type page_size: int
     :return: a list of dictionaries of the form
-        <code>{'id': b.id, 'title': b.title, 'author': b.author, 'score': AVG(r.score) AS score}</code>
-        representing books
-    :rtype: list[dict]
+        <code>{'id': b.id, 'title': b.title, 'author': b.author, 'score': s.score_sum / s.rating_count AS score, 'rating_count': s.rating_count}</code>
+        representing books, and the token of the next page, or <code>None</code> if there are no more books
+    :rtype: tuple[list[dict], str or None]
+    :raises pagination.InvalidPageToken: if the page token is malformed
     """
-    with get_db_connection() as connection:
+    after = decode_page_token(page_token, 3)
+    with get_db_connection(READ) as connection:
+        if (matches := get_search_matches_query(connection, 'books', query, after, page_size + 1)) is None:
+            return [], None
+        matches_sql, params = matches
         with connection.cursor(dictionary=True) as cursor:
-            cursor.execute("""SELECT b.id,
-                                     b.title,
-                                     b.author,
-                                     ROUND(AVG(r.score), 1) AS score
-                                FROM books AS b
-                                JOIN book_ratings AS r
-                                  ON b.id = r.book_id
-                               WHERE b.title LIKE CONCAT('%', %s, '%')
-                            GROUP BY r.book_id;""", [title])
+            cursor.execute(f"""SELECT b.id,
+                                      b.title,
+                                      b.author,
+                                      ROUND(s.score_sum / NULLIF(s.rating_count, 0), 1) AS score,
+                                      COALESCE(s.rating_count, 0) AS rating_count,
+                                      m.matched_terms,
+                                      m.exact_terms
+                                 FROM ({matches_sql}) AS m
+                                 JOIN books AS b
+                                   ON b.id = m.id
+                            LEFT JOIN book_rating_stats AS s
+                                   ON b.id = s.book_id
+                             ORDER BY m.matched_terms DESC, m.exact_terms DESC, b.id""", params)
             books = cursor.fetchall()
-            return books
+            return get_page(books, page_size, ['matched_terms', 'exact_terms', 'id'])
 
 
+@cached('book_details')
 def get_book_details(book_id):
     """
-    Gets details of a specific book.
+    Gets details of a specific book. Results are cached for <code>CACHE_TTL</code> seconds.
 
-    *(Tables involved: books b, book_ratings r)*
+    *(Tables involved: books b, book_rating_stats s)*
 
     :param book_id: the id of the book to get details for
     :type book_id: int
     :return: a dictionary of the form
-        <code>{'id': b.id, 'title': b.title, 'author': b.author, 'score': AVG(r.score) AS score}</code>
-        representing a book
+        <code>{'id': b.id, 'title': b.title, 'author': b.author, 'score': s.score_sum / s.rating_count AS score, 'rating_count': s.rating_count}</code>
+        representing a book, where the score is <code>None</code> if the book has no ratings
     :rtype: dict
     """
     with get_db_connection() as connection:
@@ -87,11 +127,95 @@ def get_book_details(book_id):
             cursor.execute("""SELECT b.id,
                                      b.title,
                                      b.author,
-                                     ROUND(AVG(r.score), 1) AS score
+                                     ROUND(s.score_sum / NULLIF(s.rating_count, 0), 1) AS score,
+                                     COALESCE(s.rating_count, 0) AS rating_count
                                 FROM books AS b
-                                JOIN book_ratings AS r
-                                  ON b.id = r.book_id
-                               WHERE b.id = %s
-                            GROUP BY r.book_id""", [book_id])
+                           LEFT JOIN book_rating_stats AS s
+                                  ON b.id = s.book_id
+                               WHERE b.id = %s""", [book_id])
             book = cursor.fetchone()
             return book
+
+
+def get_book_page(book_id, current_user_id, page_token=None, page_size=PAGE_SIZE):
+    """
+    Gets everything the page of a specific book shows, in a single query: the book's details,
+    the current user's rating for it, and a page of its most recent ratings.
+
+    *(Tables involved: books b, book_rating_stats s, book_ratings r, users u)*
+
+    :param book_id: the id of the book to get the page for
+    :type book_id: int
+    :param current_user_id: the id of the user viewing the page
+    :type current_user_id: int
+    :param page_token: the token of the page of ratings to get, or <code>None</code> for the first page
+    :type page_token: str or None
+    :param page_size: the maximum number of ratings on a page
+    :type page_size: int
+    :return: a dictionary of the form
+        <code>{'book_details': {...}, 'current_user_rating': {'score': ..., 'review': ...}, 'book_ratings': [...], 'next_page_token': ...}</code>
+        in the same shapes as <code>get_book_details</code>, <code>get_book_rating_for_user</code> and
+        <code>get_recent_book_ratings</code>, or <code>None</code> if the book does not exist
+    :rtype: dict or None
+    :raises pagination.InvalidPageToken: if the page token is malformed
+    """
+    after, after_params = get_recency_condition(decode_page_token(page_token, 2), 'r.rated_at', 'r.user_id')
+    is_buffered, buffered_rating = get_buffered_rating(current_user_id, book_id)
+    with get_db_connection(READ) as connection:
+        with connection.cursor(dictionary=True) as cursor:
+            cursor.execute(f"""SELECT b.id,
+                                      b.title,
+                                      b.author,
+                                      ROUND(s.score_sum / NULLIF(s.rating_count, 0), 1) AS score,
+                                      COALESCE(s.rating_count, 0) AS rating_count,
+                                      mine.score AS current_user_score,
+                                      mine.review AS current_user_review,
+                                      x.user_id AS rating_user_id,
+                                      x.username AS rating_username,
+                                      x.display_name AS rating_display_name,
+                                      x.score AS rating_score,
+                                      x.review AS rating_review,
+                                      x.rated_at AS rating_rated_at
+                                 FROM books AS b
+                            LEFT JOIN book_rating_stats AS s
+                                   ON s.book_id = b.id
+                            LEFT JOIN book_ratings AS mine
+                                   ON mine.book_id = b.id
+                                  AND mine.user_id = %s
+                            LEFT JOIN (SELECT r.user_id,
+                                              u.username,
+                                              u.display_name,
+                                              r.score,
+                                              r.review,
+                                              r.rated_at
+                                         FROM book_ratings AS r
+                                         JOIN users AS u
+                                           ON u.id = r.user_id
+                                        WHERE r.book_id = %s
+                                          AND {after}
+                                     ORDER BY r.rated_at DESC, r.user_id DESC
+                                        LIMIT %s) AS x
+                                   ON TRUE
+                                WHERE b.id = %s
+                             ORDER BY x.rated_at DESC, x.user_id DESC""",
+                           [current_user_id, book_id, *after_params, page_size + 1, book_id])
+            rows = cursor.fetchall()
+    if not rows:
+        return None
+    first_row = rows[0]
+    book_ratings, next_page_token = get_page(
+        [{'user_id': row['rating_user_id'], 'username': row['rating_username'], 'display_name': row['rating_display_name'],
+          'score': row['rating_score'], 'review': row['rating_review'], 'rated_at': row['rating_rated_at']}
+         for row in rows if row['rating_user_id'] is not None],
+        page_size, ['rated_at', 'user_id'])
+    current_user_rating = None
+    if is_buffered:
+        current_user_rating = buffered_rating  # Not written to the database yet, but the user should see it already
+    elif first_row['current_user_score'] is not None:
+        current_user_rating = {'score': first_row['current_user_score'], 'review': first_row['current_user_review']}
+    return {
+        'book_details': {column: first_row[column] for column in ('id', 'title', 'author', 'score', 'rating_count')},
+        'current_user_rating': current_user_rating,
+        'book_ratings': book_ratings,
+        'next_page_token': next_page_token,
+    }
@@ -0,0 +1,166 @@
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+from time import monotonic
+import pickle
+
+from db_management import call_after_commit
+from config import CACHE_BACKEND, CACHE_MAX_SIZE, CACHE_TTL, CACHE_REDIS_URL
+
+_MISSING = object()
+
+
+class LocalCacheBackend:
+    """An in-process cache that evicts the least recently used entry once it holds ``max_size`` entries."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            value, expires_at = entry
+            if expires_at <= monotonic():
+                del self._entries[key]
+                return _MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def size(self):
+        return len(self._entries)
+
+
+class RedisCacheBackend:
+    """A cache shared by every worker process, kept in Redis. Redis itself handles expiry and eviction."""
+
+    def __init__(self, url, prefix='instabook:'):
+        # To install redis, run `pip install redis`
+        from redis import Redis
+        self._redis = Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self._redis.get(self.prefix + key)
+        return _MISSING if value is None else pickle.loads(value)
+
+    def set(self, key, value, ttl):
+        self._redis.set(self.prefix + key, pickle.dumps(value), ex=max(1, round(ttl)))
+
+    def delete(self, key):
+        self._redis.delete(self.prefix + key)
+
+    def clear(self):
+        for key in self._redis.scan_iter(self.prefix + '*'):
+            self._redis.delete(key)
+
+    def size(self):
+        return sum(1 for _ in self._redis.scan_iter(self.prefix + '*'))
+
+
+_backend = None
+_stats = {}
+_stats_lock = Lock()
+
+
+def get_cache_backend():
+    global _backend
+    if _backend is None:
+        _backend = RedisCacheBackend(CACHE_REDIS_URL) if CACHE_BACKEND == 'redis' else LocalCacheBackend(CACHE_MAX_SIZE)
+    return _backend
+
+
+def set_cache_backend(backend):
+    """
+    Replaces the cache backend, for example with one shared between worker processes.
+
+    :param backend: an object with <code>get(key)</code>, <code>set(key, value, ttl)</code>,
+        <code>delete(key)</code>, <code>clear()</code> and <code>size()</code> methods
+    :rtype: None
+    """
+    global _backend
+    _backend = backend
+
+
+def cached(namespace, ttl=CACHE_TTL):
+    """
+    Makes a lookup function read through the cache, keyed by its arguments.
+
+    :param namespace: the name the function's entries are grouped and invalidated under
+    :type namespace: str
+    :param ttl: the number of seconds an entry is kept for
+    :type ttl: float
+    """
+    def decorate(func):
+        @wraps(func)
+        def cached_func(*args):
+            key = _get_key(namespace, args)
+            value = get_cache_backend().get(key)
+            _count(namespace, 'hits' if value is not _MISSING else 'misses')
+            if value is _MISSING:
+                value = func(*args)
+                get_cache_backend().set(key, value, ttl)
+            return value
+        return cached_func
+    return decorate
+
+
+def invalidate(namespace, *args):
+    """
+    Drops the cached result of a lookup, both straight away and once the current transaction is committed,
+    so that a concurrent read cannot put back a result from before the write.
+
+    :param namespace: the namespace of the cached function
+    :type namespace: str
+    :param args: the arguments the function was called with
+    :rtype: None
+    """
+    key = _get_key(namespace, args)
+    get_cache_backend().delete(key)
+    call_after_commit(lambda: get_cache_backend().delete(key))
+    _count(namespace, 'invalidations')
+
+
+def get_cache_stats():
+    """
+    Gets the hit, miss and invalidation counts of each cached function in this process.
+
+    :return: a dictionary of the form
+        <code>{'backend': ..., 'size': ..., 'namespaces': {namespace: {'hits': ..., 'misses': ..., 'invalidations': ..., 'hit_rate': ...}}}</code>
+    :rtype: dict
+    """
+    with _stats_lock:
+        namespaces = {namespace: dict(counts) for namespace, counts in _stats.items()}
+    for counts in namespaces.values():
+        lookups = counts['hits'] + counts['misses']
+        counts['hit_rate'] = counts['hits'] / lookups if lookups else None
+    backend = get_cache_backend()
+    return {'backend': type(backend).__name__, 'size': backend.size(), 'namespaces': namespaces}
+
+
+def _get_key(namespace, args):
+    return f'{namespace}:{":".join(map(str, args))}'
+
+
+def _count(namespace, counter):
+    with _stats_lock:
+        counts = _stats.setdefault(namespace, {'hits': 0, 'misses': 0, 'invalidations': 0})
+        counts[counter] += 1
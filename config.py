@@ -1,7 +1,68 @@
+DB_BACKEND = 'mysql'            # 'mysql', or 'sqlite' to keep the database in a local file instead
+DB_SQLITE_PATH = 'instabook.sqlite3'    # Only used when DB_BACKEND is 'sqlite'
 DB_NAME = 'instabook'
 DB_HOST = 'localhost'
 DB_USER = 'instabook_admin'     # Change this value according to your own setup
 DB_PASS = 'admin'               # Change this value according to your own setup
 
 FLASK_SECRET = 'flask_secret'   # Generate a random string to use for your Flask secret key
-FLASK_DEBUG = True              # Change this to True for local development
+FLASK_DEBUG = False             # Change this to True for local development
+
+SERVER_BIND = '127.0.0.1:8000'  # Address serve.py listens on
+SERVER_WORKERS = 4              # Worker processes serve.py forks, each with its own connection pools
+SERVER_THREADS = 4              # Requests each worker handles at the same time
+STARTUP_BUDGET = 1              # Seconds importing and creating the app may take, checked by `maintenance.py check-startup`
+WARM_UP_BUDGET = 30             # Seconds warming the app before the workers fork may take, checked by the same command
+
+DB_POOL_SIZE = 5                # Number of idle connections kept open for reuse
+DB_POOL_MAX_OVERFLOW = 10       # Extra connections that may be opened when the pool is busy
+DB_POOL_TIMEOUT = 10            # Seconds to wait for a free connection before giving up
+DB_POOL_RECYCLE = 3600          # Seconds after which a connection is closed and replaced
+DB_POOL_IDLE_TIMEOUT = 300      # Seconds a connection may sit unused before it is closed
+DB_POOL_PRE_PING = True         # Check that a connection is still alive before handing it out
+DB_FAN_OUT_WORKERS = 8          # Threads that run a page's independent lookups at the same time, each on its own connection
+DB_REPLICAS = []                # Read replicas, each a dict of the connection settings that differ from the primary's, such as {'host': 'replica1'}
+DB_REPLICA_MAX_LAG = 2          # Seconds a replica may fall behind the primary before reads stop going to it
+DB_REPLICA_CHECK_INTERVAL = 1   # Seconds between measurements of the replicas' lag
+DB_REPLICA_STICKY_WINDOW = 5    # Seconds a user's reads keep going to the primary after they write, to see their own writes
+
+DB_SLOW_QUERY_THRESHOLD = 0.1   # Seconds a statement may take before it is written to the slow query log
+DB_SLOW_QUERY_LOG = 'slow_queries.log'  # File the slow query log is written to, or None to turn it off
+REQUEST_LOG = True              # Log each request's timing and query totals to stderr as a line of JSON
+QUERY_PLAN_LARGE_TABLE_ROWS = 10000     # Tables with this many rows must not be read in full by a page's queries
+
+PAGE_SIZE = 10                  # Number of results shown per page of search results and ratings
+
+RATING_WRITE_BEHIND = False     # Log ratings to a local file and write them to the database in batches, for rating spikes
+RATING_WRITE_BEHIND_LOG = 'rating_writes.log'   # Only used when RATING_WRITE_BEHIND is True; shared by the processes of one server
+RATING_WRITE_BEHIND_DELAY = 1   # Seconds ratings are collected for before they are written
+RATING_WRITE_BEHIND_BATCH_SIZE = 500    # Buffered ratings written per transaction
+
+TIMELINE_LENGTH = 200           # Number of recent ratings kept in each user's precomputed feed
+TIMELINE_FANOUT_LIMIT = 1000    # Users with more followers than this have their ratings read on demand instead
+
+SESSION_MAX_AGE = 3600          # Seconds a sign-in lasts
+SESSION_IDENTITY_TTL = 300      # Seconds a session and the signed in user's details are cached before they are looked up again
+SESSION_ROLE_TTL = 5            # Seconds a user's admin role is cached, so other workers notice a revoked role within this long
+
+CACHE_BACKEND = 'local'         # 'local' for a cache per process, or 'redis' for one shared by all processes
+CACHE_MAX_SIZE = 10000          # Maximum number of entries in a local cache
+CACHE_TTL = 60                  # Seconds a cached book lookup is kept for
+CACHE_REDIS_URL = 'redis://localhost:6379/0'    # Only used when CACHE_BACKEND is 'redis'
+FRAGMENT_CACHE_MAX_SIZE = 20000 # Maximum number of rendered template fragments kept per process
+FRAGMENT_CACHE_TTL = 3600       # Seconds a rendered fragment is kept for, so versions nobody shows any more expire
+
+RECOMMENDATION_COUNT = 5        # Books shown under "Readers also liked"
+RECOMMENDATION_NEIGHBOURS = 20  # Most similar books stored per book, so that some can drop out without a rebuild
+RECOMMENDATION_MIN_SCORE = 4    # Lowest score that counts as liking a book
+RECOMMENDATION_MIN_CO_LIKES = 2 # Readers two books need in common before they count as similar
+
+FOLLOWER_GRAPH_REFRESH = 300    # Seconds before the in-process follower graph is reloaded to pick up other processes' follows
+FOLLOWER_GRAPH_MAX_DELTA = 10000    # Follows and unfollows buffered before they are merged into the graph's arrays
+FOLLOWER_GRAPH_SUGGESTION_FANOUT = 100  # Followed users asked for "who to follow" suggestions
+FOLLOW_SUGGESTION_COUNT = 5     # Users suggested on the feed
+USER_STATS_RECONCILE_INTERVAL = 3600    # Seconds between background recounts of users' follower, following and rating counts
+
+MEMBERSHIP_FILTER_FALSE_POSITIVE_RATE = 0.01    # Share of free usernames and isbns that still need a database check
+MEMBERSHIP_FILTER_HEADROOM = 2  # Filters are sized for this many times the current number of users and books
+MEMBERSHIP_FILTER_REFRESH = 300 # Seconds before a filter is rebuilt to pick up values taken by other processes
@@ -1,13 +1,708 @@
+# To install flask, run `pip install flask`
 # To install mysql.connector, run `pip install mysql-connector-python`
-from mysql.connector import connect
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime
+from math import ceil
+from threading import Condition, Lock, Thread
+from time import monotonic, perf_counter, time
+import logging
+import os
 
-from config import DB_HOST, DB_USER, DB_PASS, DB_NAME
+from flask import g, has_app_context, has_request_context, request
 
+from metrics_management import get_request_query_stats, record_query
+from config import DB_BACKEND, DB_SQLITE_PATH, DB_HOST, DB_USER, DB_PASS, DB_NAME, \
+    DB_POOL_SIZE, DB_POOL_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_IDLE_TIMEOUT, DB_POOL_PRE_PING, \
+    DB_REPLICAS, DB_REPLICA_MAX_LAG, DB_REPLICA_CHECK_INTERVAL, DB_REPLICA_STICKY_WINDOW
 
-def get_db_connection():
-    connection = connect(
-        host=DB_HOST,
-        user=DB_USER,
-        password=DB_PASS,
-        database=DB_NAME)
-    return connection
+if DB_BACKEND == 'sqlite':
+    from sqlite_backend import connect, Error, IntegrityError
+    _CONNECT_ARGS = {'database': DB_SQLITE_PATH}
+else:
+    from mysql.connector import connect, Error, IntegrityError
+    _CONNECT_ARGS = {'host': DB_HOST, 'user': DB_USER, 'password': DB_PASS, 'database': DB_NAME}
+
+READ = 'read'
+WRITE = 'write'
+PRIMARY_STICKY_COOKIE_NAME = 'read_from_primary_until'
+
+_logger = logging.getLogger('instabook.replicas')
+_borrowed_read_from_primary = ContextVar('borrowed_read_from_primary', default=False)
+_borrowed_wait_for_connection = ContextVar('borrowed_wait_for_connection', default=True)
+
+
+_MYSQL_DUPLICATE_KEY = 1062
+
+
+def is_duplicate_key_error(error):
+    """
+    Finds whether a statement failed because it would have repeated a value of a unique column.
+
+    :param error: the error the statement raised
+    :type error: Error
+    :rtype: bool
+    """
+    if DB_BACKEND == 'sqlite':
+        return isinstance(error, IntegrityError) and str(error).startswith('UNIQUE constraint failed')
+    return isinstance(error, IntegrityError) and error.errno == _MYSQL_DUPLICATE_KEY
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection could be checked out of the pool in time."""
+
+
+class PoolBusyError(Exception):
+    """Raised instead of waiting when every connection the pool may open is checked out."""
+
+
+class _PoolEntry:
+    __slots__ = ('connection', 'created_at', 'last_used_at')
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.created_at = self.last_used_at = monotonic()
+
+
+class PooledConnection:
+    """
+    A connection checked out of a :class:`ConnectionPool`.
+
+    Behaves like a regular ``mysql.connector`` connection, except that closing it (or leaving its
+    ``with`` block) hands it back to the pool instead of tearing down the socket, and that its cursors
+    are timed.
+    """
+
+    def __init__(self, pool, entry):
+        self._pool = pool
+        self._entry = entry
+        self.query_stats = None
+        self.has_pending_writes = False
+        self.after_commit_callbacks = []
+
+    def __getattr__(self, name):
+        return getattr(self._get_connection(), name)
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._get_connection().cursor(*args, **kwargs), self.query_stats)
+
+    def _get_connection(self):
+        if self._entry is None:
+            raise Error('Connection has already been returned to the pool')
+        return self._entry.connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def commit(self):
+        self._get_connection().commit()
+        callbacks, self.after_commit_callbacks = self.after_commit_callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def close(self):
+        self.after_commit_callbacks = []  # Whatever was not committed yet is rolled back
+        if self._entry is not None:
+            entry, self._entry = self._entry, None
+            self._pool.release(entry)
+
+
+class InstrumentedCursor:
+    """A cursor that times the statements it executes, for the request stats and the slow query log."""
+
+    def __init__(self, cursor, query_stats):
+        self._cursor = cursor
+        self._query_stats = query_stats
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._cursor.close()
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        start = perf_counter()
+        try:
+            return self._cursor.execute(operation, params, *args, **kwargs)
+        finally:
+            record_query(operation, perf_counter() - start, self._query_stats, params)
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        start = perf_counter()
+        try:
+            return self._cursor.executemany(operation, seq_params, *args, **kwargs)
+        finally:
+            record_query(operation, perf_counter() - start, self._query_stats)
+
+
+class RequestConnection:
+    """
+    The connection shared by every database call made while handling one Flask request.
+
+    Leaving its ``with`` block keeps it open, and ``commit()`` only records that the request wrote
+    something, so that all of the request's writes are committed together once the request is done.
+    The statements executed through it are tallied in ``query_stats``.
+    """
+
+    def __init__(self, connection):
+        self._connection = connection
+        self.has_pending_writes = False
+        self.after_commit_callbacks = []
+        self.query_stats = connection.query_stats = get_request_query_stats()
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def close(self):
+        pass
+
+    def commit(self):
+        self.has_pending_writes = True
+
+
+class ConnectionPool:
+    """
+    A thread-safe pool of database connections.
+
+    Keeps up to ``size`` idle connections around, and opens up to ``max_overflow`` extra connections
+    when demand exceeds that. Connections are health-checked on checkout, and replaced once they are
+    older than ``recycle`` seconds or have sat idle for longer than ``idle_timeout`` seconds.
+    """
+
+    def __init__(self, connect_args, size, max_overflow, timeout, recycle, idle_timeout, pre_ping):
+        self.connect_args = connect_args
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.idle_timeout = idle_timeout
+        self.pre_ping = pre_ping
+        self._idle = deque()
+        self._open_count = 0
+        self._condition = Condition()
+        self._counters = dict.fromkeys(('checkouts', 'connects', 'recycled', 'failed_pings', 'waits', 'timeouts',
+                                       'busy'), 0)
+
+    def acquire(self, wait=True):
+        deadline = monotonic() + self.timeout if wait else None
+        while True:
+            entry = self._checkout(deadline)
+            if entry is None:
+                entry = self._open()
+            elif not self._is_healthy(entry):
+                self._discard(entry)
+                continue
+            with self._condition:
+                self._counters['checkouts'] += 1
+            return PooledConnection(self, entry)
+
+    def release(self, entry):
+        try:
+            if entry.connection.in_transaction:
+                entry.connection.rollback()  # Anything not explicitly committed is discarded
+        except Error:
+            self._discard(entry)
+            return
+        entry.last_used_at = monotonic()
+        with self._condition:
+            if len(self._idle) < self.size:
+                self._idle.append(entry)
+                self._condition.notify()
+                return
+        self._discard(entry)  # Overflow connections are closed as soon as they are handed back
+
+    def dispose(self):
+        """Closes every idle connection. Checked-out connections are closed when they are released."""
+        with self._condition:
+            entries, self._idle = list(self._idle), deque()
+        for entry in entries:
+            self._discard(entry)
+
+    def stats(self):
+        with self._condition:
+            idle = len(self._idle)
+            return {
+                'size': self.size,
+                'max_overflow': self.max_overflow,
+                'open': self._open_count,
+                'idle': idle,
+                'checked_out': self._open_count - idle,
+                'overflow': max(0, self._open_count - self.size),
+                **self._counters,
+            }
+
+    def _checkout(self, deadline):
+        """
+        Pops a usable idle entry, or reserves a slot for a new connection by returning ``None``.
+        Without a deadline, it raises :class:`PoolBusyError` rather than wait for one to be released.
+        """
+        expired = []
+        with self._condition:
+            try:
+                while True:
+                    while self._idle:
+                        entry = self._idle.pop()  # Most recently used first, so the rest can go idle
+                        if self._is_expired(entry):
+                            expired.append(entry)
+                            continue
+                        return entry
+                    if self._open_count - len(expired) < self.size + self.max_overflow:
+                        self._open_count += 1
+                        return None
+                    if deadline is None:
+                        self._counters['busy'] += 1
+                        raise PoolBusyError('Every database connection is checked out')
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        self._counters['timeouts'] += 1
+                        raise PoolTimeoutError(f'No database connection became available within {self.timeout}s')
+                    self._counters['waits'] += 1
+                    self._condition.wait(remaining)
+            finally:
+                self._counters['recycled'] += len(expired)
+                self._open_count -= len(expired)
+                for entry in expired:
+                    _close_quietly(entry.connection)
+
+    def _open(self):
+        try:
+            entry = _PoolEntry(connect(**self.connect_args))
+        except BaseException:
+            with self._condition:
+                self._open_count -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._counters['connects'] += 1
+        return entry
+
+    def _is_expired(self, entry):
+        now = monotonic()
+        return now - entry.created_at > self.recycle or now - entry.last_used_at > self.idle_timeout
+
+    def _is_healthy(self, entry):
+        if not self.pre_ping:
+            return True
+        try:
+            entry.connection.ping(reconnect=False)
+            return True
+        except Error:
+            with self._condition:
+                self._counters['failed_pings'] += 1
+            return False
+
+    def _discard(self, entry):
+        _close_quietly(entry.connection)
+        with self._condition:
+            self._open_count -= 1
+            self._condition.notify()
+
+
+class _Replica:
+    __slots__ = ('pool', 'lag', 'in_rotation', 'error', 'removals')
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.lag = None
+        self.in_rotation = False
+        self.error = None
+        self.removals = 0
+
+
+class ReplicaSet:
+    """
+    The read replicas, each with its own :class:`ConnectionPool`, and which of them reads may go to.
+
+    Lag is measured with a heartbeat: each check compares the replicas' copy of the timestamp in
+    ``replication_heartbeat`` with the primary's, then writes a new one to the primary, so it is known to within
+    ``check_interval`` seconds. A replica only joins the rotation once a check finds it at most ``max_lag`` seconds
+    behind, and leaves it while it is further behind or cannot be reached. Checks run on a background thread, started
+    by the first read that finds the last check out of date, and reads go to the primary while the last check is too
+    old to rely on.
+    """
+
+    def __init__(self, primary_pool, replica_pools, max_lag, check_interval):
+        self.primary_pool = primary_pool
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._replicas = [_Replica(pool) for pool in replica_pools]
+        self._next_index = 0
+        self._checked_at = None
+        self._is_checking = False
+        self._lock = Lock()
+
+    def acquire(self, wait=True):
+        """Checks a connection out of the next replica in rotation, or returns ``None`` if none is in rotation."""
+        self._schedule_check()
+        while True:
+            with self._lock:
+                if self._checked_at is None or monotonic() - self._checked_at > self.check_interval + self.max_lag:
+                    return None     # Unchecked for too long for the last check to vouch for any replica
+                in_rotation = [replica for replica in self._replicas if replica.in_rotation]
+                if not in_rotation:
+                    return None
+                replica = in_rotation[self._next_index % len(in_rotation)]
+                self._next_index += 1
+            try:
+                return replica.pool.acquire(wait)
+            except (Error, PoolTimeoutError) as error:
+                self._update(replica, None, error)     # Until the next check finds it reachable again
+
+    def check(self):
+        """
+        Measures how far behind the primary each replica is, and puts it in or out of rotation accordingly.
+
+        *(Tables involved: replication_heartbeat)*
+
+        :return: the replicas, as from :meth:`stats`
+        :rtype: list[dict]
+        """
+        with self.primary_pool.acquire() as connection:
+            with connection.cursor() as cursor:
+                primary_beat_at = _read_heartbeat(cursor)
+                for replica in self._replicas:
+                    try:
+                        with replica.pool.acquire() as replica_connection:
+                            with replica_connection.cursor() as replica_cursor:
+                                replica_beat_at = _read_heartbeat(replica_cursor)
+                    except (Error, PoolTimeoutError) as error:
+                        self._update(replica, None, error)
+                        continue
+                    if primary_beat_at is None or replica_beat_at is None:
+                        self._update(replica, None, 'no heartbeat yet')
+                    else:
+                        self._update(replica, max(0.0, (primary_beat_at - replica_beat_at).total_seconds()), None)
+                cursor.execute("""INSERT
+                                    INTO replication_heartbeat (id, beat_at)
+                                  VALUES (1, CURRENT_TIMESTAMP(6))
+                                      ON DUPLICATE KEY UPDATE beat_at = VALUES(beat_at)""")
+                connection.commit()
+        with self._lock:
+            self._checked_at = monotonic()
+        return self.stats()
+
+    def stats(self):
+        with self._lock:
+            return [{
+                'replica': _describe(replica.pool.connect_args),
+                'in_rotation': replica.in_rotation,
+                'lag_seconds': replica.lag,
+                'error': replica.error,
+                'removals': replica.removals,
+                'pool': replica.pool.stats(),
+            } for replica in self._replicas]
+
+    def _update(self, replica, lag, error):
+        in_rotation = error is None and lag <= self.max_lag
+        with self._lock:
+            if replica.in_rotation and not in_rotation:
+                replica.removals += 1
+                _logger.warning('Replica %s left the rotation: %s', _describe(replica.pool.connect_args),
+                                error or f'{lag:.3f}s behind')
+            replica.lag, replica.error, replica.in_rotation = lag, str(error) if error else None, in_rotation
+
+    def _schedule_check(self):
+        with self._lock:
+            if self._is_checking or (self._checked_at is not None and monotonic() - self._checked_at < self.check_interval):
+                return
+            self._is_checking = True
+        Thread(target=self._check_in_background, name='db-replica-check', daemon=True).start()
+
+    def _check_in_background(self):
+        try:
+            self.check()
+        except Exception:
+            _logger.exception('Could not measure the replicas\' lag, retrying later')
+            with self._lock:
+                self._checked_at = monotonic()
+        finally:
+            with self._lock:
+                self._is_checking = False
+
+
+def _read_heartbeat(cursor):
+    cursor.execute("""SELECT h.beat_at
+                        FROM replication_heartbeat AS h
+                       WHERE h.id = 1""")
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return datetime.fromisoformat(row[0]) if isinstance(row[0], str) else row[0]
+
+
+def _describe(connect_args):
+    if 'host' not in connect_args:
+        return connect_args['database']
+    return f'{connect_args["host"]}:{connect_args.get("port", 3306)}/{connect_args["database"]}'
+
+
+def _close_quietly(connection):
+    try:
+        connection.close()
+    except Error:
+        pass
+
+
+_pool = None
+_replica_set = None
+_pool_lock = Lock()
+
+
+def get_db_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = _create_pool(_CONNECT_ARGS)
+        return _pool
+
+
+def get_replica_set():
+    """
+    Gets the read replicas listed in <code>DB_REPLICAS</code>.
+
+    :return: the replicas, or <code>None</code> if there are none
+    :rtype: ReplicaSet or None
+    """
+    global _replica_set
+    if not DB_REPLICAS:
+        return None
+    primary_pool = get_db_pool()
+    with _pool_lock:
+        if _replica_set is None:
+            _replica_set = ReplicaSet(
+                primary_pool=primary_pool,
+                replica_pools=[_create_pool({**_CONNECT_ARGS, **replica}) for replica in DB_REPLICAS],
+                max_lag=DB_REPLICA_MAX_LAG,
+                check_interval=DB_REPLICA_CHECK_INTERVAL)
+        return _replica_set
+
+
+def dispose_db_pools():
+    """
+    Closes the idle connections of the primary's and the replicas' pools. Called before the process forks, so that
+    workers do not inherit connections that their parent may still use.
+
+    :rtype: None
+    """
+    for pool in [_pool] + ([replica.pool for replica in _replica_set._replicas] if _replica_set is not None else []):
+        if pool is not None:
+            pool.dispose()
+
+
+def _forget_db_pools():
+    """Starts a forked worker with pools of its own, since the connections it inherited are its parent's."""
+    global _pool, _replica_set, _pool_lock
+    _pool = _replica_set = None
+    _pool_lock = Lock()
+
+
+os.register_at_fork(before=dispose_db_pools, after_in_child=_forget_db_pools)
+
+
+def _create_pool(connect_args):
+    return ConnectionPool(
+        connect_args=connect_args,
+        size=DB_POOL_SIZE,
+        max_overflow=DB_POOL_MAX_OVERFLOW,
+        timeout=DB_POOL_TIMEOUT,
+        recycle=DB_POOL_RECYCLE,
+        idle_timeout=DB_POOL_IDLE_TIMEOUT,
+        pre_ping=DB_POOL_PRE_PING)
+
+
+def get_db_connection(intent=WRITE):
+    """
+    Gets a connection to the database.
+
+    Inside a Flask request this is the request's shared :class:`RequestConnection`, so every
+    management function called while handling the request works in a single transaction.
+    Anywhere else, including threads a request fans its reads out to, it is a fresh connection
+    checked out of the pool.
+
+    Reads may go to one of the <code>DB_REPLICAS</code> instead, which can be up to <code>DB_REPLICA_MAX_LAG</code>
+    seconds behind. They still go to the primary whenever :func:`should_read_from_primary` says so, or no replica
+    is in rotation. Inside a request, every read that goes to a replica shares one connection to it.
+
+    :param intent: <code>READ</code> for a read whose result is shown rather than acted on or cached, or
+        <code>WRITE</code> for anything else
+    :type intent: str
+    :rtype: RequestConnection or PooledConnection
+    """
+    replica_set = get_replica_set() if intent == READ and not should_read_from_primary() else None
+    if not has_app_context():
+        wait = _borrowed_wait_for_connection.get()
+        connection = replica_set.acquire(wait) if replica_set is not None else None
+        if connection is None:
+            connection = get_db_pool().acquire(wait)
+        connection.query_stats = get_request_query_stats()  # Set when a request handed this call to another thread
+        return connection
+    if replica_set is not None:
+        if 'db_read_connection' not in g:
+            replica_connection = replica_set.acquire()
+            g.db_read_connection = RequestConnection(replica_connection) if replica_connection is not None else None
+        if g.db_read_connection is not None:
+            return g.db_read_connection
+    if 'db_connection' not in g:
+        g.db_connection = RequestConnection(get_db_pool().acquire())
+    return g.db_connection
+
+
+def should_read_from_primary():
+    """
+    Finds whether reads must go to the primary rather than a replica, so that users always see their own writes.
+
+    They must when there are no replicas, outside GET and HEAD requests, while the request has writes waiting to be
+    committed, and for <code>DB_REPLICA_STICKY_WINDOW</code> seconds after the signed in user's last write, which
+    is recorded in a cookie. Threads a request hands its reads to follow the request, through
+    :func:`bind_read_from_primary`.
+
+    :rtype: bool
+    """
+    if not DB_REPLICAS:
+        return True
+    if not has_app_context():
+        return _borrowed_read_from_primary.get()
+    connection = g.get('db_connection')
+    if g.get('db_has_written') or (connection is not None and connection.has_pending_writes):
+        return True
+    if not has_request_context():
+        return False
+    if request.method not in ('GET', 'HEAD'):
+        return True
+    try:
+        return float(request.cookies.get(PRIMARY_STICKY_COOKIE_NAME, 0)) > time()
+    except ValueError:
+        return False
+
+
+def bind_read_from_primary(func, read_from_primary):
+    """
+    Makes a function read from where the request that calls it on another thread would.
+
+    :param func: the function to bind
+    :type func: callable
+    :param read_from_primary: what :func:`should_read_from_primary` says in the request
+    :type read_from_primary: bool
+    :rtype: callable
+    """
+    def bound_func(*args, **kwargs):
+        token = _borrowed_read_from_primary.set(read_from_primary)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _borrowed_read_from_primary.reset(token)
+    return bound_func
+
+
+def bind_fail_when_busy(func):
+    """
+    Makes a function raise :class:`PoolBusyError` rather than wait when it cannot check a connection out at once,
+    for a call a request hands to another thread while it holds a connection of its own.
+
+    :param func: the function to bind
+    :type func: callable
+    :rtype: callable
+    """
+    def bound_func(*args, **kwargs):
+        token = _borrowed_wait_for_connection.set(False)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _borrowed_wait_for_connection.reset(token)
+    return bound_func
+
+
+def stick_reads_to_primary():
+    """
+    Sends the signed in user's reads to the primary for the next <code>DB_REPLICA_STICKY_WINDOW</code> seconds,
+    for a write that does not go through the request's connection, such as one logged to be written later.
+    Writes committed through it do this by themselves.
+
+    :rtype: None
+    """
+    if has_app_context():
+        g.db_has_written = True
+
+
+def call_after_commit(callback, connection=None):
+    """
+    Calls a function once the writes made so far have been committed.
+
+    While the connection has a transaction open, or writes waiting to be committed, the call is put off until it is
+    committed, and dropped if it is rolled back instead. Otherwise it happens now. Inside a Flask request, that is
+    the request's connection.
+
+    :param callback: the function to call, without arguments
+    :type callback: callable
+    :param connection: the connection the writes were made with, for writes that may be made outside a request
+    :type connection: PooledConnection or RequestConnection or None
+    :rtype: None
+    """
+    if connection is None and has_app_context():
+        connection = g.get('db_connection')
+    if connection is not None and (connection.has_pending_writes or connection.in_transaction):
+        connection.after_commit_callbacks.append(callback)
+    else:
+        callback()
+
+
+def commit_request_db_connection(response):
+    connection = g.get('db_connection')
+    if connection is not None and connection.has_pending_writes:
+        connection._connection.commit()  # Committed before the response goes out, so failures still surface as errors
+        connection.has_pending_writes = False
+        g.db_has_written = True
+        callbacks, connection.after_commit_callbacks = connection.after_commit_callbacks, []
+        for callback in callbacks:
+            callback()
+    elif connection is not None:
+        connection.after_commit_callbacks = []   # Their writes were never committed, and are rolled back
+    if DB_REPLICAS and g.get('db_has_written'):
+        response.set_cookie(PRIMARY_STICKY_COOKIE_NAME, str(time() + DB_REPLICA_STICKY_WINDOW),
+                            max_age=ceil(DB_REPLICA_STICKY_WINDOW), httponly=True, samesite='Lax')
+    return response
+
+
+def close_request_db_connection(exception=None):
+    connection = g.pop('db_connection', None)
+    if connection is not None:
+        connection._connection.close()  # Rolls back any writes that were not committed
+    read_connection = g.pop('db_read_connection', None)
+    if read_connection is not None:
+        read_connection._connection.close()
+
+
+def init_db(app):
+    """
+    Binds a request-scoped database connection to a Flask app.
+
+    :param app: the app to set up
+    :type app: flask.Flask
+    :rtype: None
+    """
+    app.after_request(commit_request_db_connection)
+    app.teardown_appcontext(close_request_db_connection)
+
+
+def get_db_pool_stats():
+    return get_db_pool().stats()
+
+
+def get_db_replica_stats():
+    replica_set = get_replica_set()
+    return replica_set.stats() if replica_set is not None else []
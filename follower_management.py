@@ -1,11 +1,15 @@
 from db_management import get_db_connection
+from graph_management import record_follower_change
+from timeline_management import backfill_followed_user, prune_followed_user
+from user_management import update_user_stats
+from version_management import USER, bump_version
 
 
 def add_follower_pair(follower_user_id, followed_user_id):
     """
-    Adds a new follower for a specific user.
+    Adds a new follower for a specific user, and copies the followed user's recent ratings into the follower's timeline.
 
-    *(Tables involved: followers f)*
+    *(Tables involved: followers f, book_ratings r, timeline_entries t, user_stats c, entity_versions v)*
 
     :param follower_user_id: the user id of the new follower
     :type follower_user_id: int
@@ -15,15 +19,24 @@ def add_follower_pair(follower_user_id, followed_user_id):
     """
     with get_db_connection() as connection:
         with connection.cursor(dictionary=True) as cursor:
-            # Temporary code
-            pass
+            cursor.execute("""INSERT IGNORE
+                                INTO followers (follower_user_id, followed_user_id)
+                              VALUES (%s, %s)""", [follower_user_id, followed_user_id])
+            if cursor.rowcount == 1:
+                update_user_stats(connection, follower_user_id, following_delta=1)
+                update_user_stats(connection, followed_user_id, follower_delta=1)
+                backfill_followed_user(connection, follower_user_id, followed_user_id)
+                record_follower_change(connection, follower_user_id, followed_user_id, True)
+                bump_version(connection, USER, follower_user_id)
+                bump_version(connection, USER, followed_user_id)
+            connection.commit()
 
 
 def remove_follower_pair(follower_user_id, followed_user_id):
     """
-    Removes a follower for a specific user.
+    Removes a follower for a specific user, and the followed user's ratings from the former follower's timeline.
 
-    *(Tables involved: followers f)*
+    *(Tables involved: followers f, timeline_entries t, user_stats c, entity_versions v)*
 
     :param follower_user_id: the user id of the former follower
     :type follower_user_id: int
@@ -33,8 +46,18 @@ def remove_follower_pair(follower_user_id, followed_user_id):
     """
     with get_db_connection() as connection:
         with connection.cursor(dictionary=True) as cursor:
-            # Temporary code
-            pass
+            cursor.execute("""DELETE
+                                FROM followers
+                               WHERE follower_user_id = %s
+                                 AND followed_user_id = %s""", [follower_user_id, followed_user_id])
+            if cursor.rowcount == 1:
+                prune_followed_user(connection, follower_user_id, followed_user_id)
+                record_follower_change(connection, follower_user_id, followed_user_id, False)
+                update_user_stats(connection, follower_user_id, following_delta=-1)
+                update_user_stats(connection, followed_user_id, follower_delta=-1)
+                bump_version(connection, USER, follower_user_id)
+                bump_version(connection, USER, followed_user_id)
+            connection.commit()
 
 
 def follower_pair_exists(follower_user_id, followed_user_id):
@@ -52,6 +75,9 @@ def follower_pair_exists(follower_user_id, followed_user_id):
     """
     with get_db_connection() as connection:
         with connection.cursor(dictionary=True) as cursor:
-            # Temporary code
-            follower_pair = None
+            cursor.execute("""SELECT f.follower_user_id
+                                FROM followers AS f
+                               WHERE f.follower_user_id = %s
+                                 AND f.followed_user_id = %s""", [follower_user_id, followed_user_id])
+            follower_pair = cursor.fetchone()
             return True if follower_pair is not None else False
@@ -0,0 +1,75 @@
+"""
+Caches rendered template fragments under keys that include the version of the data they show, so entries never
+need invalidating. Wrap a fragment in ``{% cache 'name', id, version %}...{% endcache %}``.
+"""
+# To install flask, run `pip install flask`
+from threading import Lock
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from cache_management import LocalCacheBackend
+from config import FRAGMENT_CACHE_MAX_SIZE, FRAGMENT_CACHE_TTL
+
+_store = LocalCacheBackend(FRAGMENT_CACHE_MAX_SIZE)
+_stats = {}
+_stats_lock = Lock()
+
+
+class FragmentCacheExtension(Extension):
+    """Adds the <code>{% cache name, *key %}...{% endcache %}</code> tag to a Jinja environment."""
+
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render_fragment', [nodes.List(key)]), [], [], body).set_lineno(lineno)
+
+    def _render_fragment(self, key, caller):
+        name = key[0]
+        store_key = ':'.join(map(str, key))
+        fragment = _store.get(store_key)
+        is_hit = isinstance(fragment, str)  # Anything else is the backend's marker for a missing entry
+        _count(name, 'hits' if is_hit else 'misses')
+        if not is_hit:
+            fragment = str(caller())
+            _store.set(store_key, fragment, FRAGMENT_CACHE_TTL)
+        return Markup(fragment)
+
+
+def init_fragment_cache(app):
+    """
+    Enables the <code>cache</code> tag in a Flask app's templates.
+
+    :param app: the app to set up
+    :type app: flask.Flask
+    :rtype: None
+    """
+    app.jinja_env.add_extension(FragmentCacheExtension)
+
+
+def get_fragment_cache_stats():
+    """
+    Gets the hit and miss counts of each cached fragment in this process.
+
+    :return: a dictionary of the form
+        <code>{'size': ..., 'max_size': ..., 'fragments': {name: {'hits': ..., 'misses': ..., 'hit_rate': ...}}}</code>
+    :rtype: dict
+    """
+    with _stats_lock:
+        fragments = {name: dict(counts) for name, counts in _stats.items()}
+    for counts in fragments.values():
+        renders = counts['hits'] + counts['misses']
+        counts['hit_rate'] = counts['hits'] / renders if renders else None
+    return {'size': _store.size(), 'max_size': _store.max_size, 'fragments': fragments}
+
+
+def _count(name, counter):
+    with _stats_lock:
+        counts = _stats.setdefault(name, {'hits': 0, 'misses': 0})
+        counts[counter] += 1
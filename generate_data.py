@@ -0,0 +1,221 @@
+"""
+Generates a synthetic Instabook dataset of any size, from thousands to tens of millions of ratings.
+
+Run ``python generate_data.py --help`` for the available options.
+"""
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+from itertools import accumulate
+from math import gcd
+from random import Random
+from time import perf_counter
+import os
+
+from benchmark_search import WORDS, AUTHORS
+from db_management import get_db_connection
+from config import DB_NAME
+
+FIRST_NAMES = ['Emily', 'Emma', 'Youri', 'Omotola', 'Kim', 'Patricia', 'Raneen', 'Anu', 'Mary', 'Ruth', 'Sam', 'Alex',
+               'Jordan', 'Priya', 'Chen', 'Fatima', 'Lucas', 'Noah', 'Amara', 'Kenji', 'Sofia', 'Mateo', 'Zara', 'Ola']
+LAST_NAMES = ['F', 'M', 'S', 'G', 'P', 'I', 'Smith', 'Okafor', 'Tanaka', 'Garcia', 'Nguyen', 'Kowalski', 'Ahmed']
+SCORE_WEIGHTS = [5, 10, 20, 35, 30]     # How often each score from 1 to 5 is given
+RATED_SINCE = datetime(2023, 1, 1)      # Fixed rather than relative to today, so the data is reproducible
+RATED_OVER_DAYS = 730
+
+TABLE_COLUMNS = {
+    'users': ('id', 'username', 'display_name', 'is_admin', 'pin'),
+    'books': ('id', 'title', 'author', 'isbn'),
+    'followers': ('follower_user_id', 'followed_user_id'),
+    'book_ratings': ('user_id', 'book_id', 'score', 'review', 'rated_at'),
+}
+
+
+class PowerLaw:
+    """Picks ids from 1 to <code>count</code> with Zipf-distributed popularity, the popular ids spread across the range."""
+
+    def __init__(self, count, exponent, random):
+        self.count = count
+        self._cum_weights = list(accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+        self._step = next(step for step in range(random.randrange(count // 2 + 1, count + 2), 2 * count + 2)
+                          if gcd(step, count) == 1)  # Spreads popular ranks over the ids without storing a permutation
+        self._random = random
+
+    def sample(self, k):
+        """Picks <code>k</code> distinct ids, or as many as there are if that is fewer."""
+        ids = set()
+        while len(ids) < min(k, self.count):
+            ranks = self._random.choices(range(self.count), cum_weights=self._cum_weights, k=k - len(ids))
+            ids.update(rank * self._step % self.count + 1 for rank in ranks)
+        return sorted(ids)
+
+
+def get_activity(random, mean, cap):
+    """Draws a heavy-tailed count with the given mean, so that most draws are small and a few are very large."""
+    return min(cap, max(1, round(random.paretovariate(1.5) * mean / 3)))  # A Pareto(1.5) draw averages 3
+
+
+def generate_users(user_count, random):
+    for user_id in range(1, user_count + 1):
+        first_name = random.choice(FIRST_NAMES)
+        display_name = f'{first_name} {random.choice(LAST_NAMES)}'
+        yield user_id, f'{first_name.lower()}{user_id}', display_name, user_id == 1, f'{random.randrange(10000):04d}'
+
+
+def generate_books(book_count, random):
+    for book_id in range(1, book_count + 1):
+        title = ' '.join(random.choices(WORDS, k=random.randint(2, 6))).capitalize()
+        author = random.choice(AUTHORS) if random.random() < 0.95 else None
+        isbn = f'978{book_id:010d}' if random.random() < 0.9 else None
+        yield book_id, title, author, isbn
+
+
+def generate_followers(user_count, follows_per_user, random):
+    popularity = PowerLaw(user_count, 1.1, random)
+    for follower_user_id in range(1, user_count + 1):
+        follow_count = get_activity(random, follows_per_user, max(1, (user_count - 1) // 2))
+        for followed_user_id in popularity.sample(follow_count + 1):
+            if followed_user_id != follower_user_id and follow_count:
+                follow_count -= 1
+                yield follower_user_id, followed_user_id
+
+
+def generate_ratings(user_count, book_count, rating_count, random):
+    popularity = PowerLaw(book_count, 1.0, random)
+    ratings_per_user = rating_count / user_count
+    for user_id in range(1, user_count + 1):
+        for book_id in popularity.sample(get_activity(random, ratings_per_user, max(1, book_count // 2))):
+            score = random.choices(range(1, 6), weights=SCORE_WEIGHTS)[0]
+            review = ' '.join(random.choices(WORDS, k=random.randint(3, 12))).capitalize() if random.random() < 0.3 else None
+            rated_at = RATED_SINCE + timedelta(microseconds=random.randrange(RATED_OVER_DAYS * 86_400_000_000))
+            yield user_id, book_id, score, review, rated_at
+
+
+class DatabaseWriter:
+    def __init__(self, connection, batch_size):
+        self._connection = connection
+        self._batch_size = batch_size
+
+    def check_empty(self, tables):
+        with self._connection.cursor() as cursor:
+            for table in tables:
+                cursor.execute(f'SELECT EXISTS (SELECT * FROM {table})')
+                if cursor.fetchone()[0]:
+                    raise SystemExit(f'The {table} table is not empty. Load into a fresh database created from schema.sql.')
+
+    def write(self, table, rows):
+        columns = TABLE_COLUMNS[table]
+        sql = f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join(["%s"] * len(columns))})'
+        batch = []
+        with self._connection.cursor() as cursor:
+            for row in rows:
+                batch.append(row)
+                if len(batch) == self._batch_size:
+                    cursor.executemany(sql, batch)
+                    self._connection.commit()
+                    batch = []
+                    yield self._batch_size
+            if batch:
+                cursor.executemany(sql, batch)
+                self._connection.commit()
+                yield len(batch)
+
+    def finish(self):
+        pass
+
+
+class FileWriter:
+    """Writes each table to a tab-separated file in the format <code>LOAD DATA</code> reads by default."""
+
+    def __init__(self, directory, database, batch_size):
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._database = database
+        self._batch_size = batch_size
+        self._tables = []
+
+    def check_empty(self, tables):
+        pass
+
+    def write(self, table, rows):
+        self._tables.append(table)
+        with open(os.path.join(self._directory, f'{table}.tsv'), 'w', encoding='utf-8', newline='\n') as table_file:
+            written_count = 0
+            for row in rows:
+                table_file.write('\t'.join(map(_to_tsv_value, row)) + '\n')
+                written_count += 1
+                if written_count == self._batch_size:
+                    yield written_count
+                    written_count = 0
+            yield written_count
+
+    def finish(self):
+        with open(os.path.join(self._directory, 'load_data.sql'), 'w') as script_file:
+            script_file.write(f'-- Run with `mysql --local-infile=1 < load_data.sql`\nUSE {self._database};\n')
+            for table in self._tables:
+                path = os.path.abspath(os.path.join(self._directory, f'{table}.tsv')).replace('\\', '/')
+                script_file.write(f"LOAD DATA LOCAL INFILE '{path}' INTO TABLE {table} "
+                                  f"CHARACTER SET utf8mb4 ({', '.join(TABLE_COLUMNS[table])});\n")
+
+
+def _to_tsv_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, datetime):
+        return value.isoformat(' ')
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--ratings', type=int, default=10_000, help='approximate number of ratings to generate')
+    parser.add_argument('--users', type=int, help='number of users, by default one per 20 ratings')
+    parser.add_argument('--books', type=int, help='number of books, by default one per 50 ratings')
+    parser.add_argument('--follows-per-user', type=float, default=20, help='average number of users each user follows')
+    parser.add_argument('--seed', type=int, default=0, help='seed for everything generated')
+    parser.add_argument('--output-dir', help='write tab-separated files and a LOAD DATA script here instead of inserting')
+    parser.add_argument('--database', default=DB_NAME, help='the database the LOAD DATA script loads into')
+    parser.add_argument('--batch-size', type=int, default=10_000, help='rows inserted per transaction')
+    args = parser.parse_args()
+
+    user_count = args.users or max(2, args.ratings // 20)
+    book_count = args.books or max(1, args.ratings // 50)
+    tables = {
+        'users': generate_users(user_count, Random(f'{args.seed}:users')),
+        'books': generate_books(book_count, Random(f'{args.seed}:books')),
+        'followers': generate_followers(user_count, args.follows_per_user, Random(f'{args.seed}:followers')),
+        'book_ratings': generate_ratings(user_count, book_count, args.ratings, Random(f'{args.seed}:ratings')),
+    }
+
+    connection = None
+    if args.output_dir:
+        writer = FileWriter(args.output_dir, args.database, args.batch_size)
+    else:
+        connection = get_db_connection()
+        writer = DatabaseWriter(connection, args.batch_size)
+    try:
+        writer.check_empty(tables)
+        for table, rows in tables.items():
+            start, row_count = perf_counter(), 0
+            for written_count in writer.write(table, rows):
+                row_count += written_count
+                rows_per_second = row_count / (perf_counter() - start)
+                print(f'\r{table}: {row_count:,} row(s) ({rows_per_second:,.0f} rows/s)', end='', flush=True)
+            print()
+        writer.finish()
+    finally:
+        if connection is not None:
+            connection.close()
+
+    if args.output_dir:
+        print(f'Load the files with `mysql --local-infile=1 < {os.path.join(args.output_dir, "load_data.sql")}`, then run:')
+    else:
+        print('Now run:')
+    for maintenance_command in ('rebuild-rating-stats', 'rebuild-search-index', 'rebuild-timelines',
+                                'rebuild-recommendations', 'reconcile-user-stats'):
+        print(f'    python maintenance.py {maintenance_command}')
+
+
+if __name__ == '__main__':
+    main()
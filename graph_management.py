@@ -0,0 +1,407 @@
+"""
+An in-process copy of the follower graph in compressed sparse row form, for graph queries too slow to run against
+``followers``. It can be up to ``FOLLOWER_GRAPH_REFRESH`` seconds behind the database, so use
+:func:`follower_management.follower_pair_exists` where a stale answer would be wrong.
+"""
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from itertools import accumulate, islice
+from threading import Lock, Thread
+from time import monotonic
+import logging
+import os
+
+from db_management import get_db_connection, call_after_commit
+from config import FOLLOWER_GRAPH_REFRESH, FOLLOWER_GRAPH_MAX_DELTA, FOLLOWER_GRAPH_SUGGESTION_FANOUT
+
+
+class CsrAdjacency:
+    """
+    The edges leaving each node of a graph whose nodes are numbered from 0, in compressed sparse row form.
+
+    The targets of node <code>n</code> are <code>targets[offsets[n]:offsets[n + 1]]</code>, in ascending order.
+    """
+
+    __slots__ = ('offsets', 'targets')
+
+    def __init__(self, offsets, targets):
+        self.offsets = offsets
+        self.targets = targets
+
+    @classmethod
+    def from_sorted_batches(cls, batches):
+        """
+        Builds the adjacency from batches of <code>(source, target)</code> pairs sorted by source, then by target.
+        Each batch is added to the arrays in bulk, and the offsets are built from the degrees once all are read.
+
+        :param batches: the edges
+        :type batches: iterable[list[tuple[int, int]]]
+        :rtype: CsrAdjacency
+        """
+        degrees, targets = Counter(), array('i')
+        for batch in batches:
+            sources, batch_targets = zip(*batch)
+            degrees.update(sources)
+            targets.extend(batch_targets)
+        node_count = max(degrees) + 1 if degrees else 0
+        offsets = array('q', accumulate((degrees[node] for node in range(node_count)), initial=0))
+        return cls(offsets, targets)
+
+    @property
+    def node_count(self):
+        return len(self.offsets) - 1
+
+    def degree(self, node):
+        if node >= self.node_count:
+            return 0
+        return self.offsets[node + 1] - self.offsets[node]
+
+    def neighbours(self, node):
+        if node >= self.node_count:
+            return array('i')
+        return self.targets[self.offsets[node]:self.offsets[node + 1]]
+
+    def contains(self, node, target):
+        if node >= self.node_count:
+            return False
+        start, end = self.offsets[node], self.offsets[node + 1]
+        position = bisect_left(self.targets, target, start, end)
+        return position < end and self.targets[position] == target
+
+    def merged(self, changes):
+        """
+        Builds a new adjacency with some edges added or removed. Nodes without changes are copied over in runs.
+
+        :param changes: for each changed node, whether each changed target is now an edge
+        :type changes: dict[int, dict[int, bool]]
+        :rtype: CsrAdjacency
+        """
+        offsets, targets = array('q', [0]), array('i')
+        copied_up_to = 0
+        for node in sorted(changes):
+            self._copy_run(copied_up_to, node, offsets, targets)
+            node_targets = set(self.neighbours(node))
+            for target, is_edge in changes[node].items():
+                if is_edge:
+                    node_targets.add(target)
+                else:
+                    node_targets.discard(target)
+            targets.extend(sorted(node_targets))
+            offsets.append(len(targets))
+            copied_up_to = node + 1
+        self._copy_run(copied_up_to, max(copied_up_to, self.node_count), offsets, targets)
+        return CsrAdjacency(offsets, targets)
+
+    def _copy_run(self, first_node, end_node, offsets, targets):
+        """Appends the unchanged nodes from <code>first_node</code> up to <code>end_node</code>."""
+        copied_end = min(end_node, self.node_count)
+        if first_node < copied_end:
+            shift = len(targets) - self.offsets[first_node]
+            targets.extend(self.targets[self.offsets[first_node]:self.offsets[copied_end]])
+            offsets.extend(offset + shift for offset in islice(self.offsets, first_node + 1, copied_end + 1))
+        offsets.extend([len(targets)] * max(0, end_node - max(first_node, copied_end)))  # Nodes past the old arrays
+
+    def size_in_bytes(self):
+        return self.offsets.itemsize * len(self.offsets) + self.targets.itemsize * len(self.targets)
+
+
+_followed = CsrAdjacency(array('q', [0]), array('i'))     # Follower user id -> followed user ids
+_followers = CsrAdjacency(array('q', [0]), array('i'))    # Followed user id -> follower user ids
+_delta = {}                 # (follower user id, followed user id) -> whether the follow now exists
+_delta_by_follower = {}
+_delta_by_followed = {}
+_changed_while_loading = None
+_loaded_at = None
+_counts = {'loads': 0, 'compactions': 0}
+_rebuild_pending = False
+_retry_at = 0
+_lock = Lock()
+_rebuild_lock = Lock()
+_logger = logging.getLogger('instabook.follower_graph')
+_RETRY_DELAY = 10   # Seconds before a reload that failed is tried again
+
+
+def follows(follower_user_id, followed_user_id):
+    """
+    Finds whether a user follows another, from the in-process graph.
+
+    :param follower_user_id: the user id of the follower to check
+    :type follower_user_id: int
+    :param followed_user_id: the user id of the followed user to check
+    :type followed_user_id: int
+    :rtype: bool
+    """
+    _ensure_fresh()
+    with _lock:
+        is_edge = _delta.get((follower_user_id, followed_user_id))
+        followed = _followed
+    return is_edge if is_edge is not None else followed.contains(follower_user_id, followed_user_id)
+
+
+def get_following_count(user_id):
+    """
+    Counts the users a user follows, from the in-process graph.
+
+    :param user_id: the id of the user
+    :type user_id: int
+    :rtype: int
+    """
+    _ensure_fresh()
+    return _get_degree(user_id, outgoing=True)
+
+
+def get_follower_count(user_id):
+    """
+    Counts the followers of a user, from the in-process graph.
+
+    :param user_id: the id of the user
+    :type user_id: int
+    :rtype: int
+    """
+    _ensure_fresh()
+    return _get_degree(user_id, outgoing=False)
+
+
+def get_followed_user_ids(user_id):
+    _ensure_fresh()
+    return _get_neighbours(user_id, outgoing=True)
+
+
+def get_follower_user_ids(user_id):
+    _ensure_fresh()
+    return _get_neighbours(user_id, outgoing=False)
+
+
+def get_suggested_user_ids(user_id, limit):
+    """
+    Finds the users followed by most of the users a user follows, who the user does not follow yet.
+
+    Only the first <code>FOLLOWER_GRAPH_SUGGESTION_FANOUT</code> followed users are asked, so that users who follow
+    thousands of others get suggestions as quickly as everyone else.
+
+    :param user_id: the id of the user to suggest users to
+    :type user_id: int
+    :param limit: the maximum number of users to suggest
+    :type limit: int
+    :return: the ids of the suggested users, most followed first
+    :rtype: list[int]
+    """
+    followed_user_ids = get_followed_user_ids(user_id)
+    followed_by_followed = Counter()
+    for followed_user_id in followed_user_ids[:FOLLOWER_GRAPH_SUGGESTION_FANOUT]:
+        followed_by_followed.update(get_followed_user_ids(followed_user_id))
+    for excluded_user_id in [user_id, *followed_user_ids]:
+        followed_by_followed.pop(excluded_user_id, None)
+    return [suggested_user_id for suggested_user_id, _ in followed_by_followed.most_common(limit)]
+
+
+def record_follower_change(connection, follower_user_id, followed_user_id, is_following):
+    """
+    Applies a follow or unfollow to the in-process graph once the transaction that made it is committed.
+
+    :param connection: the connection the follow or unfollow was written with
+    :param follower_user_id: the user id of the follower
+    :type follower_user_id: int
+    :param followed_user_id: the user id of the followed user
+    :type followed_user_id: int
+    :param is_following: <code>True</code> for a follow, <code>False</code> for an unfollow
+    :type is_following: bool
+    :rtype: None
+    """
+    call_after_commit(lambda: _apply_change(follower_user_id, followed_user_id, is_following), connection)
+
+
+def warm_follower_graph():
+    """
+    Loads the graph from the database. Called at startup, since until then the graph is loaded in the background
+    and has no edges.
+
+    :rtype: None
+    """
+    load_follower_graph()
+
+
+def load_follower_graph(batch_size=10000):
+    """
+    Replaces the graph with a fresh copy of <code>followers</code>.
+
+    *(Tables involved: followers f)*
+
+    :param batch_size: the number of edges read from the database at a time
+    :type batch_size: int
+    :rtype: None
+    """
+    with _rebuild_lock:
+        _load(batch_size)
+
+
+def compact_follower_graph():
+    """
+    Merges the buffered follows and unfollows into new arrays, without reading the database.
+
+    :rtype: None
+    """
+    global _followed, _followers
+    with _rebuild_lock:
+        with _lock:
+            followed, followers = _followed, _followers
+            follower_changes = {node: dict(changes) for node, changes in _delta_by_follower.items()}
+        followed_changes = {}
+        for follower_user_id, changes in follower_changes.items():
+            for followed_user_id, is_following in changes.items():
+                followed_changes.setdefault(followed_user_id, {})[follower_user_id] = is_following
+        followed, followers = followed.merged(follower_changes), followers.merged(followed_changes)
+        with _lock:
+            _followed, _followers = followed, followers
+            for follower_user_id, changes in follower_changes.items():
+                for followed_user_id, is_following in changes.items():
+                    if _delta.get((follower_user_id, followed_user_id)) == is_following:
+                        _discard_change(follower_user_id, followed_user_id)  # Unless it changed again meanwhile
+            _counts['compactions'] += 1
+
+
+def get_follower_graph_stats():
+    """
+    Gets the size of the in-process graph and how often it was reloaded and compacted.
+
+    :return: a dictionary of the form <code>{'users': ..., 'edges': ..., 'buffered_changes': ..., 'bytes': ...,
+        'bytes_per_edge': ..., 'age_seconds': ..., 'loads': ..., 'compactions': ...}</code>
+    :rtype: dict
+    """
+    with _lock:
+        edge_count = len(_followed.targets)
+        size_in_bytes = _followed.size_in_bytes() + _followers.size_in_bytes()
+        return {
+            'users': max(_followed.node_count, _followers.node_count),
+            'edges': edge_count,
+            'buffered_changes': len(_delta),
+            'bytes': size_in_bytes,
+            'bytes_per_edge': size_in_bytes / edge_count if edge_count else None,
+            'age_seconds': monotonic() - _loaded_at if _loaded_at is not None else None,
+            **_counts,
+        }
+
+
+def _fetch_in_batches(cursor, batch_size):
+    while rows := cursor.fetchmany(batch_size):
+        yield rows
+
+
+def _load(batch_size=10000):
+    global _followed, _followers, _changed_while_loading, _loaded_at
+    with _lock:
+        _changed_while_loading = []
+    started_at = monotonic()
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("""SELECT f.follower_user_id,
+                                     f.followed_user_id
+                                FROM followers AS f
+                            ORDER BY f.follower_user_id, f.followed_user_id""")
+            followed = CsrAdjacency.from_sorted_batches(_fetch_in_batches(cursor, batch_size))
+            cursor.execute("""SELECT f.followed_user_id,
+                                     f.follower_user_id
+                                FROM followers AS f
+                            ORDER BY f.followed_user_id, f.follower_user_id""")
+            followers = CsrAdjacency.from_sorted_batches(_fetch_in_batches(cursor, batch_size))
+    with _lock:
+        _followed, _followers = followed, followers
+        _delta.clear()
+        _delta_by_follower.clear()
+        _delta_by_followed.clear()
+        changes, _changed_while_loading = _changed_while_loading, None
+        for change in changes:  # They may have been committed after the scan began
+            _buffer_change(*change)
+        _loaded_at = started_at
+        _counts['loads'] += 1
+
+
+def _ensure_fresh():
+    """Starts reloading or merging the graph in the background once it is due, without waiting for it."""
+    if _loaded_at is None or monotonic() - _loaded_at > FOLLOWER_GRAPH_REFRESH:
+        if monotonic() >= _retry_at:
+            _schedule_rebuild(load_follower_graph)
+    elif len(_delta) >= FOLLOWER_GRAPH_MAX_DELTA:
+        _schedule_rebuild(compact_follower_graph)
+
+
+def _schedule_rebuild(rebuild):
+    global _rebuild_pending
+    with _lock:
+        if _rebuild_pending:
+            return
+        _rebuild_pending = True
+    Thread(target=_rebuild_in_background, args=(rebuild,), name='follower-graph', daemon=True).start()
+
+
+def _rebuild_in_background(rebuild):
+    global _rebuild_pending, _retry_at
+    try:
+        rebuild()
+    except Exception:
+        _logger.exception('Could not rebuild the follower graph, retrying in %ss', _RETRY_DELAY)
+        _retry_at = monotonic() + _RETRY_DELAY
+    finally:
+        with _lock:
+            _rebuild_pending = False
+
+
+def _reset_after_fork():
+    global _rebuild_pending, _lock, _rebuild_lock
+    _rebuild_pending, _lock, _rebuild_lock = False, Lock(), Lock()  # A rebuild thread was not copied into the forked process
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _apply_change(follower_user_id, followed_user_id, is_following):
+    with _lock:
+        _buffer_change(follower_user_id, followed_user_id, is_following)
+        if _changed_while_loading is not None:
+            _changed_while_loading.append((follower_user_id, followed_user_id, is_following))
+
+
+def _buffer_change(follower_user_id, followed_user_id, is_following):
+    _delta[follower_user_id, followed_user_id] = is_following
+    _delta_by_follower.setdefault(follower_user_id, {})[followed_user_id] = is_following
+    _delta_by_followed.setdefault(followed_user_id, {})[follower_user_id] = is_following
+
+
+def _discard_change(follower_user_id, followed_user_id):
+    del _delta[follower_user_id, followed_user_id]
+    for delta, node, target in ((_delta_by_follower, follower_user_id, followed_user_id),
+                                (_delta_by_followed, followed_user_id, follower_user_id)):
+        del delta[node][target]
+        if not delta[node]:
+            del delta[node]
+
+
+def _get_adjacency(node, outgoing):
+    """Gets the current arrays in one direction, and a copy of a node's buffered changes in that direction."""
+    with _lock:
+        if outgoing:
+            return _followed, dict(_delta_by_follower.get(node, {}))
+        return _followers, dict(_delta_by_followed.get(node, {}))
+
+
+def _get_degree(node, outgoing):
+    adjacency, changes = _get_adjacency(node, outgoing)
+    degree = adjacency.degree(node)
+    for target, is_edge in changes.items():
+        degree += is_edge - adjacency.contains(node, target)
+    return degree
+
+
+def _get_neighbours(node, outgoing):
+    adjacency, changes = _get_adjacency(node, outgoing)
+    neighbours = adjacency.neighbours(node)
+    if not changes:
+        return neighbours
+    merged = set(neighbours)
+    for target, is_edge in changes.items():
+        if is_edge:
+            merged.add(target)
+        else:
+            merged.discard(target)
+    return array('i', sorted(merged))
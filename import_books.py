@@ -0,0 +1,155 @@
+"""
+Imports a book catalog from a CSV or JSONL file, resuming from a checkpoint if it was interrupted.
+
+Run ``python import_books.py --help`` for the available options.
+"""
+from argparse import ArgumentParser
+from itertools import islice
+from time import perf_counter
+import csv
+import json
+import os
+
+from db_management import get_db_connection
+from search_management import index_books
+from utils import get_book_format_error
+
+
+def read_rows(path, file_format):
+    """Yields each row of a catalog file as a dictionary, or an error message if it cannot be parsed."""
+    with open(path, newline='', encoding='utf-8') as catalog_file:
+        if file_format == 'csv':
+            yield from csv.DictReader(catalog_file)
+            return
+        for line in catalog_file:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield row if isinstance(row, dict) else 'Row is not a JSON object'
+
+
+def clean_row(row):
+    title, author, isbn = ((str(row.get(column) or '')).strip() for column in ('title', 'author', 'isbn'))
+    return title, author or None, isbn or None
+
+
+def get_taken_isbns(cursor, isbns):
+    if not isbns:
+        return set()
+    cursor.execute(f"""SELECT b.isbn
+                         FROM books AS b
+                        WHERE b.isbn IN ({', '.join(['%s'] * len(isbns))})""", list(isbns))
+    return {isbn.lower() for (isbn,) in cursor.fetchall()}
+
+
+def insert_books(cursor, books):
+    """Inserts books in as few statements as possible and returns their <code>(id, title, author)</code> tuples."""
+    with_isbn = [book for book in books if book[2] is not None]
+    without_isbn = [book for book in books if book[2] is None]
+    inserted = []
+    if with_isbn:
+        cursor.executemany("""INSERT
+                                INTO books (title, author, isbn)
+                              VALUES (%s, %s, %s)""", with_isbn)  # Sent as a single multi-row INSERT
+        cursor.execute(f"""SELECT b.id, b.title, b.author
+                             FROM books AS b
+                            WHERE b.isbn IN ({', '.join(['%s'] * len(with_isbn))})""", [isbn for _, _, isbn in with_isbn])
+        inserted += cursor.fetchall()
+    for title, author, isbn in without_isbn:  # Nothing but the insert id tells these apart afterwards
+        cursor.execute("""INSERT
+                            INTO books (title, author, isbn)
+                          VALUES (%s, %s, %s)""", [title, author, isbn])
+        inserted.append((cursor.lastrowid, title, author))
+    return inserted
+
+
+def load_checkpoint(checkpoint_path, catalog_path):
+    if not os.path.exists(checkpoint_path):
+        return {'catalog': os.path.abspath(catalog_path), 'rows_read': 0, 'imported': 0, 'rejected': 0}
+    with open(checkpoint_path) as checkpoint_file:
+        checkpoint = json.load(checkpoint_file)
+    if checkpoint['catalog'] != os.path.abspath(catalog_path):
+        raise SystemExit(f'{checkpoint_path} belongs to an import of {checkpoint["catalog"]}. '
+                         f'Delete it or pass a different --checkpoint to start a new import.')
+    return checkpoint
+
+
+def save_checkpoint(checkpoint_path, checkpoint):
+    with open(checkpoint_path + '.tmp', 'w') as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.replace(checkpoint_path + '.tmp', checkpoint_path)  # Never leaves a half written checkpoint behind
+
+
+def import_books(rows, connection, checkpoint, checkpoint_path, rejects_file, batch_size):
+    rejects_writer = csv.writer(rejects_file)
+    start = perf_counter()
+    started_at_row = checkpoint['rows_read']
+    rows = islice(rows, started_at_row, None)
+    with connection.cursor() as cursor:
+        while batch := list(islice(rows, batch_size)):
+            books, isbns, rejects = [], {}, []
+            for row_number, row in enumerate(batch, checkpoint['rows_read'] + 1):
+                if isinstance(row, str):
+                    rejects.append((row_number, row))
+                    continue
+                title, author, isbn = clean_row(row)
+                if error := get_book_format_error(title, author, isbn):
+                    rejects.append((row_number, error))
+                elif isbn and isbn.lower() in isbns:
+                    rejects.append((row_number, f'ISBN {isbn} appears earlier in the file'))
+                else:
+                    if isbn:
+                        isbns[isbn.lower()] = row_number
+                    books.append((title, author, isbn))
+            taken_isbns = get_taken_isbns(cursor, list(isbns))
+            for isbn in taken_isbns:
+                rejects.append((isbns[isbn], f'A book with ISBN {isbn} already exists in the database'))
+            books = [book for book in books if book[2] is None or book[2].lower() not in taken_isbns]
+            index_books(cursor, insert_books(cursor, books))
+            connection.commit()
+
+            for row_number, reason in sorted(rejects):
+                rejects_writer.writerow([row_number, reason])
+            rejects_file.flush()
+            checkpoint['rows_read'] += len(batch)
+            checkpoint['imported'] += len(books)
+            checkpoint['rejected'] += len(rejects)
+            save_checkpoint(checkpoint_path, checkpoint)
+            rows_per_second = (checkpoint['rows_read'] - started_at_row) / (perf_counter() - start)
+            print(f'\rRead {checkpoint["rows_read"]:,} row(s): {checkpoint["imported"]:,} imported, '
+                  f'{checkpoint["rejected"]:,} rejected ({rows_per_second:,.0f} rows/s)', end='', flush=True)
+    print()
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('catalog', help='the CSV or JSONL file to import')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help='the file format, by default guessed from its extension')
+    parser.add_argument('--batch-size', type=int, default=1000, help='rows checked and inserted per transaction')
+    parser.add_argument('--checkpoint', help='where progress is saved, by default next to the catalog')
+    parser.add_argument('--rejects', help='CSV file the rejected rows are listed in, by default next to the catalog')
+    args = parser.parse_args()
+
+    file_format = args.format or ('jsonl' if args.catalog.endswith(('.jsonl', '.ndjson')) else 'csv')
+    checkpoint_path = args.checkpoint or args.catalog + '.checkpoint'
+    rejects_path = args.rejects or args.catalog + '.rejects.csv'
+    checkpoint = load_checkpoint(checkpoint_path, args.catalog)
+    if checkpoint['rows_read']:
+        print(f'Resuming after row {checkpoint["rows_read"]:,}')
+
+    with open(rejects_path, 'a' if checkpoint['rows_read'] else 'w', newline='') as rejects_file:
+        if not checkpoint['rows_read']:
+            csv.writer(rejects_file).writerow(['row', 'reason'])
+        with get_db_connection() as connection:
+            import_books(read_rows(args.catalog, file_format), connection, checkpoint, checkpoint_path, rejects_file,
+                         args.batch_size)
+
+    os.remove(checkpoint_path)
+    print(f'Imported {checkpoint["imported"]:,} book(s)')
+    if checkpoint['rejected']:
+        print(f'Rejected {checkpoint["rejected"]:,} row(s), listed in {rejects_path}')
+
+
+if __name__ == '__main__':
+    main()
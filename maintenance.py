@@ -0,0 +1,268 @@
+"""
+Maintenance commands for the Instabook database.
+
+Run ``python maintenance.py --help`` to list the available commands.
+"""
+from argparse import ArgumentParser
+import json
+import subprocess
+import sys
+import time
+
+from config import DB_BACKEND, DB_SQLITE_PATH, STARTUP_BUDGET, WARM_UP_BUDGET
+
+from db_management import get_replica_set
+from migration_management import MigrationError, baseline_migrations, get_migration_status, migrate
+from membership_management import warm_membership_filters, get_membership_filter_stats
+from query_plan_management import find_full_scans
+from rating_management import flush_buffered_ratings, has_unwritten_buffered_ratings, rebuild_book_rating_stats, \
+    verify_book_rating_stats
+from recommendation_management import rebuild_book_neighbours, refresh_stale_neighbours
+from search_management import rebuild_search_index
+from timeline_management import rebuild_timelines, trim_timelines
+from user_management import reconcile_user_stats, set_user_admin
+from version_management import expire_all_versions
+
+COMMANDS = {}
+
+# Run in a fresh interpreter by check-startup, so that importing the app's modules is timed too
+_STARTUP_TIMER = """
+import json
+from time import perf_counter
+started_at = perf_counter()
+from app import create_app, warm_app
+from db_management import get_db_pool_stats
+app = create_app()
+created_at = perf_counter()
+connection_count = get_db_pool_stats()['connects']
+warm_app(app)
+print(json.dumps({'startup_seconds': created_at - started_at, 'startup_connections': connection_count,
+                  'warm_up_seconds': perf_counter() - created_at}))
+"""
+
+
+def command(name, help_text, *arguments):
+    """
+    Registers a function as a maintenance command.
+
+    :param name: the name the command is run by
+    :type name: str
+    :param help_text: a one-line description of the command
+    :type help_text: str
+    :param arguments: <code>(flags, options)</code> pairs passed on to <code>ArgumentParser.add_argument</code>
+    :type arguments: tuple[list[str], dict]
+    """
+    def register(func):
+        COMMANDS[name] = (func, help_text, arguments)
+        return func
+    return register
+
+
+@command('migrate', 'apply the pending migrations in sql_scripts/migrations, or undo the ones after --to',
+         (['--to'], {'type': int, 'metavar': 'VERSION', 'help': 'the version to end up at, 0 to undo every migration'}),
+         (['--baseline'], {'type': int, 'metavar': 'VERSION',
+                           'help': 'only record the migrations up to VERSION as applied, for a database that has them'}))
+def run_migrations(args):
+    try:
+        if args.baseline is not None:
+            recorded = baseline_migrations(args.baseline)
+            print(f'Recorded {len(recorded)} migration(s) as applied')
+            return
+        steps = migrate(args.to)
+    except MigrationError as error:
+        print(error)
+        return 1
+    for direction, migration in steps:
+        print(f'{"Applied" if direction == "up" else "Undid"} {migration.version:04d}_{migration.name}')
+    if not steps:
+        print('The database is up to date')
+
+
+@command('migration-status', 'list the migrations in sql_scripts/migrations and when each was applied')
+def show_migration_status(args):
+    for migration in get_migration_status():
+        print(f'{migration["version"]:04d}_{migration["name"]}: {migration["applied_at"] or "pending"}')
+
+
+@command('check-replicas', 'measure how far behind the primary each of DB_REPLICAS is, and fail if any is out of rotation')
+def check_replicas(args):
+    replica_set = get_replica_set()
+    if replica_set is None:
+        print('DB_REPLICAS lists no replicas')
+        return 0
+    replicas = replica_set.check()
+    for replica in replicas:
+        lag = f'{replica["lag_seconds"]:.3f}s behind' if replica['lag_seconds'] is not None else replica['error']
+        print(f'{replica["replica"]}: {"in" if replica["in_rotation"] else "OUT OF"} rotation, {lag}')
+    return 0 if all(replica['in_rotation'] for replica in replicas) else 1
+
+
+@command('check-startup', 'time importing, creating and warming the app in fresh processes, and fail if it takes longer '
+                          'than STARTUP_BUDGET or WARM_UP_BUDGET, or if creating it connects to the database',
+         (['--runs'], {'type': int, 'default': 3, 'help': 'number of processes to time, keeping the fastest of each step'}))
+def check_startup(args):
+    runs = []
+    for _ in range(args.runs):
+        result = subprocess.run([sys.executable, '-c', _STARTUP_TIMER], capture_output=True, text=True)
+        if result.returncode != 0:
+            print(result.stderr, file=sys.stderr)
+            return 1
+        runs.append(json.loads(result.stdout.splitlines()[-1]))
+    startup_seconds = min(run['startup_seconds'] for run in runs)
+    warm_up_seconds = min(run['warm_up_seconds'] for run in runs)
+    connection_count = max(run['startup_connections'] for run in runs)
+    print(f'Importing and creating the app took {startup_seconds:.3f}s of its {STARTUP_BUDGET}s budget, '
+          f'and opened {connection_count} database connection(s)')
+    print(f'Warming it took {warm_up_seconds:.3f}s of its {WARM_UP_BUDGET}s budget')
+    return 0 if startup_seconds <= STARTUP_BUDGET and warm_up_seconds <= WARM_UP_BUDGET and connection_count == 0 else 1
+
+
+@command('check-query-plans', 'explain the queries behind the pages, and fail if any reads a large table in full')
+def check_query_plans(args):
+    full_scans, statement_count = find_full_scans()
+    print(f'Explained {statement_count} statement(s)')
+    if not full_scans:
+        print('None of them reads a table of QUERY_PLAN_LARGE_TABLE_ROWS rows or more in full')
+        return 0
+    for full_scan in full_scans:
+        print(f'{full_scan["table"]} ({full_scan["table_rows"]:,} rows) is read in full by: {full_scan["statement"]}')
+        print(f'    {full_scan["plan"]}')
+    return 1
+
+
+@command('rebuild-rating-stats', 'recompute the per-book rating aggregates from book_ratings')
+def rebuild_rating_stats(args):
+    book_count = rebuild_book_rating_stats()
+    print(f'Rebuilt rating aggregates for {book_count} book(s)')
+
+
+@command('verify-rating-stats', 'check the per-book rating aggregates against book_ratings')
+def verify_rating_stats(args):
+    stale_book_ids = verify_book_rating_stats()
+    if not stale_book_ids:
+        print('Rating aggregates are up to date')
+        return 0
+    print(f'Rating aggregates are stale for {len(stale_book_ids)} book(s): {", ".join(map(str, stale_book_ids))}')
+    print('Run `python maintenance.py rebuild-rating-stats` to fix them')
+    return 1
+
+
+@command('flush-ratings', 'write the ratings waiting in RATING_WRITE_BEHIND_LOG to the database')
+def flush_ratings(args):
+    flushed_count = flush_buffered_ratings()
+    if flushed_count is None:
+        print('Another process is flushing the ratings, try again once it is done')
+        return 1
+    print(f'Wrote {flushed_count} buffered rating(s)')
+    if has_unwritten_buffered_ratings():
+        print('Some ratings could not be written and were kept in the log, see the log for why')
+        return 1
+
+
+@command('rebuild-search-index', 'recreate the book and user search index',
+         (['--batch-size'], {'type': int, 'default': 1000, 'help': 'rows indexed per transaction'}))
+def rebuild_search(args):
+    indexed = rebuild_search_index(args.batch_size)
+    print(f'Indexed {indexed["books"]} book(s) and {indexed["users"]} user(s)')
+
+
+@command('trim-timelines', 'cut overgrown feed timelines back to TIMELINE_LENGTH entries',
+         (['--batch-size'], {'type': int, 'default': 1000, 'help': 'timelines trimmed per transaction'}))
+def trim_feed_timelines(args):
+    trimmed_count = trim_timelines(args.batch_size)
+    print(f'Trimmed {trimmed_count} timeline(s)')
+
+
+@command('rebuild-timelines', 'recreate every feed timeline from followers and book_ratings',
+         (['--batch-size'], {'type': int, 'default': 1000, 'help': 'timelines rebuilt per transaction'}))
+def rebuild_feed_timelines(args):
+    rebuilt_count = rebuild_timelines(args.batch_size)
+    print(f'Rebuilt {rebuilt_count} timeline(s)')
+
+
+@command('rebuild-recommendations', 'recompute the "readers also liked" neighbours of every book from book_ratings',
+         (['--batch-size'], {'type': int, 'default': 1000, 'help': 'books computed per transaction'}))
+def rebuild_recommendations(args):
+    book_count = rebuild_book_neighbours(args.batch_size)
+    print(f'Found neighbours for {book_count} book(s)')
+
+
+@command('refresh-recommendations', 'recompute the neighbours of books whose ratings changed since they were last computed',
+         (['--batch-size'], {'type': int, 'default': 100, 'help': 'books refreshed per transaction'}))
+def refresh_recommendations(args):
+    refreshed_count = refresh_stale_neighbours(args.batch_size)
+    print(f'Refreshed the neighbours of {refreshed_count} book(s)')
+
+
+@command('reconcile-user-stats', 'fix the stored follower, following and rating counts of users that drifted',
+         (['--batch-size'], {'type': int, 'default': 1000, 'help': 'users checked per transaction'}),
+         (['--every'], {'type': int, 'metavar': 'SECONDS', 'help': 'keep running in the background, once per interval'}))
+def reconcile_stats(args):
+    while True:
+        fixed_user_ids = reconcile_user_stats(args.batch_size)
+        if fixed_user_ids:
+            print(f'Fixed the counts of {len(fixed_user_ids)} user(s)')
+        else:
+            print('User counts are up to date')
+        if args.every is None:
+            return
+        sys.stdout.flush()
+        time.sleep(args.every)
+
+
+@command('set-admin', 'grant a user admin rights, or revoke them with --revoke',
+         (['user_id'], {'type': int, 'help': 'the id of the user'}),
+         (['--revoke'], {'action': 'store_true', 'help': 'revoke admin rights instead of granting them'}))
+def set_admin(args):
+    if not set_user_admin(args.user_id, not args.revoke):
+        print(f'There is no user with id {args.user_id}')
+        return 1
+    print(f'User {args.user_id} is {"no longer" if args.revoke else "now"} an admin')
+    print('Running servers pick the change up within SESSION_ROLE_TTL seconds')
+
+
+@command('expire-pages', 'make browsers fetch every book and user page again, such as after changing the templates')
+def expire_pages(args):
+    expire_all_versions()
+    print('Every page will be sent in full on its next request')
+
+
+@command('check-membership-filters', 'build the username and isbn filters and show their size and false positive rate')
+def check_membership_filters(args):
+    warm_membership_filters()
+    for name, stats in get_membership_filter_stats().items():
+        print(f'{name}: {stats["items"]:,} value(s) in {stats["bits"] // 8:,} bytes with {stats["hashes"]} hash(es), '
+              f'estimated false positive rate {stats["estimated_false_positive_rate"]:.4%}')
+    print('Running servers rebuild their filters every MEMBERSHIP_FILTER_REFRESH seconds')
+
+
+@command('create-sqlite-database', 'create the SQLite database from schema.sql, for DB_BACKEND = \'sqlite\'',
+         (['--sample-data'], {'action': 'store_true', 'help': 'also load sample_data.sql'}))
+def create_sqlite_database(args):
+    from sqlite_backend import connect, run_script
+    scripts = ['sql_scripts/schema.sql'] + (['sql_scripts/sample_data.sql'] if args.sample_data else [])
+    with connect(DB_SQLITE_PATH) as connection:
+        for path in scripts:
+            with open(path) as script_file:
+                statement_count = run_script(connection, script_file.read())
+            print(f'Ran {statement_count} statement(s) from {path} against {DB_SQLITE_PATH}')
+    if args.sample_data:
+        print('Run `python maintenance.py rebuild-search-index` to index the sample data')
+    if DB_BACKEND != 'sqlite':
+        print("Set DB_BACKEND = 'sqlite' in config.py for the app to use it")
+
+
+def main(argv=None):
+    parser = ArgumentParser(description='Instabook maintenance commands')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for name, (func, help_text, arguments) in COMMANDS.items():
+        subparser = subparsers.add_parser(name, help=help_text)
+        for flags, options in arguments:
+            subparser.add_argument(*flags, **options)
+        subparser.set_defaults(run=func)
+    args = parser.parse_args(argv)
+    return args.run(args) or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,219 @@
+from hashlib import blake2b
+from math import ceil, exp, log
+from threading import Lock, Thread
+from time import monotonic
+import logging
+import os
+
+from db_management import get_db_connection
+from config import MEMBERSHIP_FILTER_FALSE_POSITIVE_RATE, MEMBERSHIP_FILTER_HEADROOM, MEMBERSHIP_FILTER_REFRESH
+
+# The column each filter is built from. Values are lowercased, as MySQL compares them case-insensitively.
+_FILTER_SOURCES = {
+    'usernames': ('users', 'username'),
+    'isbns': ('books', 'isbn'),
+}
+
+
+class BloomFilter:
+    """
+    A set that can answer "definitely not in the set" or "probably in the set", using a fixed number of bits
+    no matter how long its values are.
+    """
+
+    def __init__(self, capacity, false_positive_rate):
+        self.capacity = max(1, capacity)
+        self.bit_count = max(8, ceil(-self.capacity * log(false_positive_rate) / log(2) ** 2))
+        self.hash_count = max(1, round(self.bit_count / self.capacity * log(2)))
+        self.item_count = 0
+        self._bits = bytearray(ceil(self.bit_count / 8))
+
+    def add(self, value):
+        for position in self._get_positions(value):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.item_count += 1
+
+    def __contains__(self, value):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._get_positions(value))
+
+    def get_false_positive_rate(self):
+        """Estimates the chance that a value which was never added is reported as probably in the set."""
+        return (1 - exp(-self.hash_count * self.item_count / self.bit_count)) ** self.hash_count
+
+    def _get_positions(self, value):
+        digest = blake2b(value.encode(), digest_size=16).digest()
+        first_hash, second_hash = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(first_hash + i * second_hash) % self.bit_count for i in range(self.hash_count)]
+
+
+_filters = {}
+_built_at = {}
+_taken_while_rebuilding = {}
+_counts = {name: {'checks': 0, 'skipped_queries': 0, 'false_positives': 0} for name in _FILTER_SOURCES}
+_rebuilds_pending = set()
+_retry_at = dict.fromkeys(_FILTER_SOURCES, 0)
+_lock = Lock()
+_rebuild_locks = {name: Lock() for name in _FILTER_SOURCES}
+_logger = logging.getLogger('instabook.membership_filters')
+_RETRY_DELAY = 10   # Seconds before a rebuild that failed is tried again
+
+
+def might_contain(name, value):
+    """
+    Finds whether a value may already be taken, without touching the database when it is definitely not.
+    Until the filter is first built, every value may be taken.
+
+    :param name: the name of the filter, <code>'usernames'</code> or <code>'isbns'</code>
+    :type name: str
+    :param value: the username or isbn to look for
+    :type value: str
+    :return: <code>False</code> if the value is definitely not taken, or <code>True</code> if it may be
+    :rtype: bool
+    """
+    bloom_filter = _get_filter(name)
+    contained = bloom_filter is None or value.lower() in bloom_filter
+    with _lock:
+        _counts[name]['checks'] += 1
+        if not contained:
+            _counts[name]['skipped_queries'] += 1
+    return contained
+
+
+def record_false_positive(name):
+    """
+    Records that the database did not have a value the filter said it may have, for the measured false positive rate.
+
+    :param name: the name of the filter
+    :type name: str
+    :rtype: None
+    """
+    with _lock:
+        _counts[name]['false_positives'] += 1
+
+
+def remember(name, value):
+    """
+    Adds a newly taken value to a filter, so that it is never reported as definitely not taken.
+
+    :param name: the name of the filter
+    :type name: str
+    :param value: the username or isbn that was taken
+    :type value: str
+    :rtype: None
+    """
+    with _lock:
+        if name in _filters:
+            _filters[name].add(value.lower())
+        if name in _taken_while_rebuilding:
+            _taken_while_rebuilding[name].append(value.lower())
+
+
+def warm_membership_filters():
+    """
+    Builds every filter from the database. Called at startup, since until then the filters are built in the
+    background and every check goes to the database.
+
+    :rtype: None
+    """
+    for name in _FILTER_SOURCES:
+        rebuild_membership_filter(name)
+
+
+def rebuild_membership_filter(name, batch_size=10000):
+    """
+    Builds a filter from scratch, sized for <code>MEMBERSHIP_FILTER_HEADROOM</code> times the current number of values.
+
+    Filters are rebuilt in the background once they are <code>MEMBERSHIP_FILTER_REFRESH</code> seconds old, which
+    picks up values taken by other worker processes, or once they hold more values than they were sized for.
+
+    *(Tables involved: users u, books b)*
+
+    :param name: the name of the filter
+    :type name: str
+    :param batch_size: the number of values read from the database at a time
+    :type batch_size: int
+    :rtype: None
+    """
+    table, column = _FILTER_SOURCES[name]
+    with _rebuild_locks[name]:
+        with _lock:
+            _taken_while_rebuilding[name] = []
+        started_at = monotonic()
+        with get_db_connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(f"""SELECT COUNT({column})
+                                     FROM {table}""")
+                (value_count,) = cursor.fetchone()
+                bloom_filter = BloomFilter(value_count * MEMBERSHIP_FILTER_HEADROOM, MEMBERSHIP_FILTER_FALSE_POSITIVE_RATE)
+                cursor.execute(f"""SELECT {column}
+                                     FROM {table}
+                                    WHERE {column} IS NOT NULL""")
+                while rows := cursor.fetchmany(batch_size):
+                    for (value,) in rows:
+                        bloom_filter.add(value.lower())
+        with _lock:
+            for value in _taken_while_rebuilding.pop(name):  # Their rows may have been committed after the scan began
+                bloom_filter.add(value)
+            _filters[name] = bloom_filter
+            _built_at[name] = started_at
+
+
+def get_membership_filter_stats():
+    """
+    Gets the size of each filter and how often it let a check skip the database in this process.
+
+    :return: a dictionary of the form
+        <code>{name: {'items': ..., 'bits': ..., 'hashes': ..., 'estimated_false_positive_rate': ...,
+        'checks': ..., 'skipped_queries': ..., 'false_positives': ..., 'false_positive_rate': ...}}</code>
+    :rtype: dict
+    """
+    stats = {}
+    with _lock:
+        for name in _FILTER_SOURCES:
+            counts = dict(_counts[name])
+            bloom_filter = _filters.get(name)
+            if bloom_filter is not None:
+                counts.update(items=bloom_filter.item_count, bits=bloom_filter.bit_count, hashes=bloom_filter.hash_count,
+                              estimated_false_positive_rate=bloom_filter.get_false_positive_rate())
+            negatives = counts['skipped_queries'] + counts['false_positives']
+            counts['false_positive_rate'] = counts['false_positives'] / negatives if negatives else None
+            stats[name] = counts
+    return stats
+
+
+def _get_filter(name):
+    """Gets a filter, or <code>None</code> if it is not built yet, and starts rebuilding it in the background when due."""
+    bloom_filter = _filters.get(name)
+    if bloom_filter is None or monotonic() - _built_at[name] > MEMBERSHIP_FILTER_REFRESH \
+            or bloom_filter.item_count > bloom_filter.capacity:
+        _schedule_rebuild(name)     # Keep answering from the old filter until the new one is built
+    return bloom_filter
+
+
+def _schedule_rebuild(name):
+    with _lock:
+        if name in _rebuilds_pending or monotonic() < _retry_at[name]:
+            return
+        _rebuilds_pending.add(name)
+    Thread(target=_rebuild_in_background, args=(name,), name=f'membership-filter-{name}', daemon=True).start()
+
+
+def _rebuild_in_background(name):
+    try:
+        rebuild_membership_filter(name)
+    except Exception:
+        _logger.exception('Could not rebuild the %s filter, retrying in %ss', name, _RETRY_DELAY)
+        with _lock:
+            _retry_at[name] = monotonic() + _RETRY_DELAY
+    finally:
+        with _lock:
+            _rebuilds_pending.discard(name)
+
+
+def _reset_after_fork():
+    global _lock, _rebuild_locks
+    _rebuilds_pending.clear()   # A rebuild thread was not copied into the forked process
+    _lock, _rebuild_locks = Lock(), {name: Lock() for name in _FILTER_SOURCES}
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,217 @@
+# To install flask, run `pip install flask`
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from time import perf_counter, time
+import json
+import logging
+import re
+import sys
+
+from flask import g, has_app_context, has_request_context, request
+
+from config import DB_SLOW_QUERY_THRESHOLD, DB_SLOW_QUERY_LOG, REQUEST_LOG
+
+MAX_FINGERPRINTS = 1000         # Statements beyond this many distinct fingerprints are counted together
+
+_FINGERPRINT_PATTERNS = [
+    (re.compile(r"'(?:[^'\\]|\\.)*'"), '?'),                    # String literals
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),                    # Number literals
+    (re.compile(r'%s'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(?+)'),        # IN lists and VALUES rows of any length
+    (re.compile(r'\(\?\+\)(?:\s*,\s*\(\?\+\))+'), '(?+)'),      # Multi-row VALUES
+    (re.compile(r'\s+'), ' '),
+]
+
+_slow_query_logger = logging.getLogger('instabook.slow_queries')
+_slow_query_logger.addHandler(logging.NullHandler())     # Scripts that never call init_metrics stay quiet
+_request_logger = logging.getLogger('instabook.requests')
+_fingerprint_stats = {}
+_request_totals = {'requests': 0, 'request_seconds': 0.0, 'queries': 0, 'query_seconds': 0.0, 'slow_queries': 0}
+_lock = Lock()
+_borrowed_query_stats = ContextVar('borrowed_query_stats', default=None)
+_captured_statements = ContextVar('captured_statements', default=None)
+
+
+class QueryStats:
+    """The number of statements a request executed, the time they took, and the slowest of them."""
+
+    __slots__ = ('count', 'duration', 'slowest_duration', 'slowest_fingerprint')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = self.slowest_duration = 0.0
+        self.slowest_fingerprint = None
+
+
+def get_request_query_stats():
+    """
+    Gets the stats of the request being handled, including from threads the request handed work to.
+
+    :return: the stats, or <code>None</code> outside of a request
+    :rtype: QueryStats or None
+    """
+    if not has_app_context():
+        return _borrowed_query_stats.get()
+    if 'query_stats' not in g:
+        g.query_stats = QueryStats()
+    return g.query_stats
+
+
+def bind_query_stats(func, query_stats):
+    """
+    Wraps a function so that the queries it executes, on whichever thread it is called, count towards a request's stats.
+
+    :param func: the function to wrap
+    :type func: callable
+    :param query_stats: the stats of the request, from :func:`get_request_query_stats`
+    :type query_stats: QueryStats or None
+    :rtype: callable
+    """
+    def bound_func(*args, **kwargs):
+        token = _borrowed_query_stats.set(query_stats)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _borrowed_query_stats.reset(token)
+    return bound_func
+
+
+def get_fingerprint(operation):
+    """
+    Normalizes a statement so that every execution of the same query has the same fingerprint, whatever its values.
+
+    :param operation: the statement
+    :type operation: str
+    :rtype: str
+    """
+    for pattern, replacement in _FINGERPRINT_PATTERNS:
+        operation = pattern.sub(replacement, operation)
+    return operation.strip()
+
+
+def record_query(operation, duration, query_stats=None, params=None):
+    """
+    Records that a statement was executed, and writes it to the slow query log if it took too long.
+
+    :param operation: the statement
+    :type operation: str
+    :param duration: the number of seconds it took
+    :type duration: float
+    :param query_stats: the stats of the request it was executed for, if any
+    :type query_stats: QueryStats or None
+    :param params: the values it was executed with
+    :type params: list or tuple or None
+    :rtype: None
+    """
+    fingerprint = get_fingerprint(operation)
+    is_slow = duration >= DB_SLOW_QUERY_THRESHOLD
+    if (captured := _captured_statements.get()) is not None and fingerprint not in captured:
+        captured[fingerprint] = (operation, params)
+    with _lock:  # Requests that fan out update their stats from several threads
+        if query_stats is not None:
+            query_stats.count += 1
+            query_stats.duration += duration
+            if duration > query_stats.slowest_duration:
+                query_stats.slowest_duration, query_stats.slowest_fingerprint = duration, fingerprint
+        if fingerprint not in _fingerprint_stats and len(_fingerprint_stats) >= MAX_FINGERPRINTS:
+            fingerprint = '(other)'
+        stats = _fingerprint_stats.setdefault(fingerprint, {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'slow': 0})
+        stats['count'] += 1
+        stats['seconds'] += duration
+        stats['max_seconds'] = max(stats['max_seconds'], duration)
+        stats['slow'] += is_slow
+        _request_totals['slow_queries'] += is_slow
+    if is_slow:
+        _slow_query_logger.warning(json.dumps({
+            'time': time(),
+            'duration_ms': round(duration * 1000, 3),
+            'fingerprint': fingerprint,
+            'path': request.path if has_request_context() else None,
+        }))
+
+
+@contextmanager
+def capture_statements():
+    """
+    Collects every distinct statement the calling thread executes while the block runs. Those of background work,
+    such as rebuilding the membership filters, run on threads of their own and are left out.
+
+    :return: a dictionary from the fingerprint of each statement to the statement and the values it was
+        first executed with, filled in as the block runs
+    :rtype: dict[str, tuple[str, list or tuple or None]]
+    """
+    captured = {}
+    token = _captured_statements.set(captured)
+    try:
+        yield captured
+    finally:
+        _captured_statements.reset(token)
+
+
+def get_query_metrics(limit=50):
+    """
+    Gets the request and query counters of this process, with the statements that took the most time in total.
+
+    :param limit: the number of statements to include
+    :type limit: int
+    :return: a dictionary of the form <code>{'requests': ..., 'request_seconds': ..., 'queries': ...,
+        'query_seconds': ..., 'slow_queries': ..., 'statements': [{'fingerprint': ..., 'count': ..., 'seconds': ...,
+        'max_seconds': ..., 'slow': ...}]}</code>
+    :rtype: dict
+    """
+    with _lock:
+        statements = [{'fingerprint': fingerprint, **stats} for fingerprint, stats in _fingerprint_stats.items()]
+        totals = dict(_request_totals)
+    statements.sort(key=lambda statement: statement['seconds'], reverse=True)
+    return {**totals, 'statements': statements[:limit]}
+
+
+def start_request_timer():
+    g.request_started_at = perf_counter()
+
+
+def report_request_timing(response):
+    """Adds the request's query totals to the response headers and the request log."""
+    request_duration = perf_counter() - g.pop('request_started_at', perf_counter())
+    query_stats = get_request_query_stats()
+    with _lock:
+        _request_totals['requests'] += 1
+        _request_totals['request_seconds'] += request_duration
+        _request_totals['queries'] += query_stats.count
+        _request_totals['query_seconds'] += query_stats.duration
+    response.headers['Server-Timing'] = f'db;dur={query_stats.duration * 1000:.2f};desc="{query_stats.count} queries", ' \
+                                        f'total;dur={request_duration * 1000:.2f}'
+    response.headers['X-Query-Count'] = str(query_stats.count)
+    _request_logger.info(json.dumps({
+        'time': time(),
+        'method': request.method,
+        'path': request.path,
+        'status': response.status_code,
+        'duration_ms': round(request_duration * 1000, 3),
+        'query_count': query_stats.count,
+        'db_ms': round(query_stats.duration * 1000, 3),
+        'slowest_query_ms': round(query_stats.slowest_duration * 1000, 3),
+        'slowest_query': query_stats.slowest_fingerprint,
+    }))
+    return response
+
+
+def init_metrics(app):
+    """
+    Times every request made to a Flask app and reports its query totals in a <code>Server-Timing</code> header,
+    and sets up the request log and the slow query log.
+
+    :param app: the app to set up
+    :type app: flask.Flask
+    :rtype: None
+    """
+    app.before_request(start_request_timer)
+    app.after_request(report_request_timing)
+    if DB_SLOW_QUERY_LOG and not any(isinstance(handler, logging.FileHandler) for handler in _slow_query_logger.handlers):
+        _slow_query_logger.addHandler(logging.FileHandler(DB_SLOW_QUERY_LOG))
+        _slow_query_logger.propagate = False
+    if REQUEST_LOG and not _request_logger.handlers:
+        _request_logger.addHandler(logging.StreamHandler(sys.stderr))
+        _request_logger.setLevel(logging.INFO)
+        _request_logger.propagate = False
@@ -0,0 +1,171 @@
+"""
+Versioned, reversible schema changes, applied from the files in ``sql_scripts/migrations``.
+Each file has a ``-- migrate:up`` and a ``-- migrate:down`` section, and may add ``-- migrate:up sqlite`` or
+``-- migrate:down sqlite`` sections to use instead on the SQLite backend.
+"""
+from collections import namedtuple
+import os
+import re
+
+from db_management import get_db_connection
+from config import DB_BACKEND
+
+MIGRATIONS_DIR = 'sql_scripts/migrations'
+
+Migration = namedtuple('Migration', ['version', 'name', 'up', 'down'])
+
+_FILE_NAME_PATTERN = re.compile(r'^(\d+)_(\w+)\.sql$')
+_SECTION_PATTERN = re.compile(r'^-- migrate:(up|down)(?: (sqlite))?\s*$', re.MULTILINE)
+_CREATE_MIGRATIONS_TABLE = """CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER NOT NULL,
+    name VARCHAR(255) NOT NULL,
+    applied_at DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+
+    PRIMARY KEY (version)
+);"""
+
+
+class MigrationError(Exception):
+    """Raised when a migration file is malformed, or migrations are asked for in a way that cannot be done."""
+
+
+def get_migrations():
+    """
+    Reads every migration in <code>MIGRATIONS_DIR</code>.
+
+    :return: the migrations, oldest first
+    :rtype: list[Migration]
+    :raises MigrationError: if two files have the same version, or a file lacks its up or down section or repeats one
+    """
+    migrations = {}
+    for file_name in sorted(os.listdir(MIGRATIONS_DIR)):
+        if not (match := _FILE_NAME_PATTERN.match(file_name)):
+            continue
+        version, name = int(match[1]), match[2]
+        if version in migrations:
+            raise MigrationError(f'Migrations {migrations[version].name} and {name} are both version {version}')
+        with open(os.path.join(MIGRATIONS_DIR, file_name)) as migration_file:
+            _, *sections = _SECTION_PATTERN.split(migration_file.read())
+        scripts = {}
+        for direction, backend, script in zip(sections[::3], sections[1::3], sections[2::3]):
+            if (direction, backend) in scripts:
+                raise MigrationError(f'{file_name} has more than one "-- migrate:{direction}" section for the same backend')
+            scripts[direction, backend] = script
+        if not {('up', None), ('down', None)} <= set(scripts):
+            raise MigrationError(f'{file_name} needs a "-- migrate:up" and a "-- migrate:down" section')
+        up, down = (scripts.get((direction, DB_BACKEND), scripts[direction, None]) for direction in ('up', 'down'))
+        migrations[version] = Migration(version, name, up, down)
+    return [migrations[version] for version in sorted(migrations)]
+
+
+def get_migration_status():
+    """
+    Lists every migration, and when it was applied to the database.
+
+    *(Tables involved: schema_migrations m)*
+
+    :return: a list of dictionaries of the form
+        <code>{'version': ..., 'name': ..., 'applied_at': m.applied_at}</code>, oldest first,
+        where <code>applied_at</code> is <code>None</code> for pending migrations
+    :rtype: list[dict]
+    """
+    applied = _get_applied_migrations()
+    return [{'version': migration.version, 'name': migration.name, 'applied_at': applied.get(migration.version)}
+            for migration in get_migrations()]
+
+
+def migrate(target_version=None):
+    """
+    Applies every pending migration up to a version, and undoes every applied one after it, newest first.
+
+    Each migration is recorded as soon as it is done, so that a failed one can be fixed and the run repeated.
+    MySQL commits schema changes as it makes them, so a migration that fails halfway may need tidying by hand first.
+
+    *(Tables involved: schema_migrations m, and those the migrations change)*
+
+    :param target_version: the version to end up at, or <code>None</code> for the newest one
+    :type target_version: int or None
+    :return: the migrations applied and undone, as <code>('up' or 'down', migration)</code> pairs in the order they ran
+    :rtype: list[tuple[str, Migration]]
+    :raises MigrationError: if the target version does not exist
+    """
+    migrations = get_migrations()
+    versions = [migration.version for migration in migrations]
+    if target_version is None:
+        target_version = max(versions, default=0)
+    elif target_version != 0 and target_version not in versions:
+        raise MigrationError(f'There is no migration with version {target_version}')
+    applied = _get_applied_migrations()
+    steps = [('down', migration) for migration in reversed(migrations)
+             if migration.version > target_version and migration.version in applied]
+    steps += [('up', migration) for migration in migrations
+              if migration.version <= target_version and migration.version not in applied]
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            for direction, migration in steps:
+                for statement in _split_script(getattr(migration, direction)):
+                    cursor.execute(statement)
+                if direction == 'up':
+                    cursor.execute("""INSERT
+                                        INTO schema_migrations (version, name)
+                                      VALUES (%s, %s)""", [migration.version, migration.name])
+                else:
+                    cursor.execute("""DELETE
+                                        FROM schema_migrations
+                                       WHERE version = %s""", [migration.version])
+                connection.commit()
+    return steps
+
+
+def baseline_migrations(version):
+    """
+    Records every migration up to a version as applied without running it, for a database that already has them,
+    such as one created from an older schema.sql.
+
+    *(Tables involved: schema_migrations m)*
+
+    :param version: the newest migration the database has
+    :type version: int
+    :return: the migrations newly recorded
+    :rtype: list[Migration]
+    :raises MigrationError: if the version does not exist
+    """
+    migrations = get_migrations()
+    if version not in [migration.version for migration in migrations]:
+        raise MigrationError(f'There is no migration with version {version}')
+    applied = _get_applied_migrations()
+    recorded = [migration for migration in migrations if migration.version <= version and migration.version not in applied]
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            for migration in recorded:
+                cursor.execute("""INSERT
+                                    INTO schema_migrations (version, name)
+                                  VALUES (%s, %s)""", [migration.version, migration.name])
+            connection.commit()
+    return recorded
+
+
+def _get_applied_migrations():
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            for statement in _split_script(_CREATE_MIGRATIONS_TABLE):
+                cursor.execute(statement)
+            cursor.execute("""SELECT m.version, m.applied_at
+                                FROM schema_migrations AS m""")
+            return dict(cursor.fetchall())
+
+
+def _split_script(script):
+    """Splits a MySQL script into its statements, translated for the configured backend."""
+    if DB_BACKEND == 'sqlite':
+        from sqlite_backend import translate_script
+        return translate_script(script)
+    statements, statement = [], ''
+    for line in script.splitlines(keepends=True):
+        if not statement and (not line.strip() or line.lstrip().startswith('--')):
+            continue
+        statement += line
+        if line.rstrip().endswith(';'):
+            statements.append(statement.strip().rstrip(';'))
+            statement = ''
+    return statements
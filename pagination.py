@@ -0,0 +1,97 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as Base64Error
+from datetime import datetime
+from decimal import Decimal
+import json
+
+
+class InvalidPageToken(ValueError):
+    """Raised when a page token was not produced by :func:`encode_page_token`."""
+
+
+def encode_page_token(sort_key):
+    """
+    Turns the sort key of the last row on a page into an opaque token for the next page.
+
+    :param sort_key: the values the rows are sorted by, for the last row on the page
+    :type sort_key: list or tuple
+    :rtype: str
+    """
+    sort_key = [_to_token_value(value) for value in sort_key]
+    return urlsafe_b64encode(json.dumps(sort_key, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_page_token(page_token, key_length):
+    """
+    Turns a page token back into the sort key that the page starts after.
+
+    :param page_token: a token from :func:`encode_page_token`, or <code>None</code> for the first page
+    :type page_token: str or None
+    :param key_length: the number of values in the sort key
+    :type key_length: int
+    :return: the sort key, or <code>None</code> for the first page
+    :rtype: list or None
+    :raises InvalidPageToken: if the token is malformed
+    """
+    if not page_token:
+        return None
+    try:
+        sort_key = json.loads(urlsafe_b64decode(page_token + '=' * (-len(page_token) % 4)))
+    except (Base64Error, UnicodeDecodeError, ValueError):
+        raise InvalidPageToken(page_token) from None
+    if not isinstance(sort_key, list) or len(sort_key) != key_length \
+            or not all(isinstance(value, (int, str)) for value in sort_key):
+        raise InvalidPageToken(page_token)
+    return sort_key
+
+
+def get_page(rows, page_size, sort_key_columns):
+    """
+    Splits the rows fetched for a page into the page itself and the token for the next page.
+
+    Rows should be fetched with a limit of <code>page_size + 1</code>, so that the extra row tells
+    whether there is a next page.
+
+    :param rows: the fetched rows, as dictionaries
+    :type rows: list[dict]
+    :param page_size: the number of rows on a page
+    :type page_size: int
+    :param sort_key_columns: the columns the rows are sorted by
+    :type sort_key_columns: list[str]
+    :return: the rows on the page and the token for the next page, or <code>None</code> if this is the last page
+    :rtype: tuple[list[dict], str or None]
+    """
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, encode_page_token([rows[-1][column] for column in sort_key_columns])
+
+
+def get_recency_condition(sort_key, *columns):
+    """
+    Builds the SQL condition for rows that come after a sort key, when rows are sorted by the given columns
+    in descending order (most recent first).
+
+    :param sort_key: the sort key from a decoded page token, or <code>None</code> for the first page
+    :type sort_key: list or None
+    :param columns: the columns the rows are sorted by, such as <code>'r.rated_at', 'r.user_id'</code>
+    :type columns: str
+    :return: the condition and its parameters
+    :rtype: tuple[str, list]
+    """
+    if sort_key is None:
+        return 'TRUE', []
+    alternatives, params = [], []
+    for position, column in enumerate(columns):
+        equalities = [f'{equal_column} = %s' for equal_column in columns[:position]]
+        alternatives.append('(' + ' AND '.join(equalities + [f'{column} < %s']) + ')')
+        params += sort_key[:position + 1]
+    return '(' + ' OR '.join(alternatives) + ')', params
+
+
+def _to_token_value(value):
+    if isinstance(value, Decimal):
+        return int(value)  # Sort keys are counts or ids, which MySQL sums up as decimals
+    if isinstance(value, datetime):
+        return value.isoformat(' ')
+    return value
@@ -0,0 +1,141 @@
+"""
+Checks that the queries behind the pages use indexes, by running EXPLAIN on each of them.
+Run it against a database filled by generate_data.py, as the planner scans small tables whatever their indexes.
+"""
+# To install flask, run `pip install flask`
+import re
+
+from flask import Flask
+
+import book_management
+import follower_management
+import rating_management
+import recommendation_management
+import session_management
+import user_management
+import version_management
+from db_management import get_db_connection, init_db
+from metrics_management import capture_statements
+from search_management import tokenize
+from config import DB_BACKEND, QUERY_PLAN_LARGE_TABLE_ROWS, RATING_WRITE_BEHIND
+
+_TABLE_REFERENCE_PATTERN = re.compile(r'\b(?:FROM|JOIN|INTO|UPDATE)\s+(\w+)(?:\s+AS\s+(\w+))?', re.IGNORECASE)
+_SQLITE_SCAN_PATTERN = re.compile(r'^SCAN (\w+)')
+_MYSQL_SCAN_TYPES = {'ALL', 'index'}    # A full table scan, and a full index scan
+
+
+def find_full_scans():
+    """
+    Finds the statements the pages execute that read a large table in full.
+
+    :return: a list of dictionaries of the form
+        <code>{'statement': ..., 'table': ..., 'table_rows': ..., 'plan': ...}</code>, one per table scanned in full
+        by a statement, where <code>statement</code> is the statement's fingerprint and <code>plan</code> the line of
+        the plan that scans it, and the number of distinct statements explained
+    :rtype: tuple[list[dict], int]
+    """
+    app = Flask(__name__)
+    init_db(app)
+    with app.app_context():     # One connection for every call, rolled back when the context ends
+        sample = _get_sample()
+        with capture_statements() as statements:
+            if sample is not None:
+                _call_page_functions(sample)
+        table_rows = {}
+        full_scans = []
+        with get_db_connection() as connection:
+            with connection.cursor(dictionary=True) as cursor:
+                for fingerprint, (operation, params) in statements.items():
+                    if params is None and '%s' in operation:
+                        continue    # Executed with executemany, so there are no values to explain it with
+                    for table, plan in _get_scanned_tables(cursor, operation, params):
+                        if table not in table_rows:
+                            cursor.execute(f'SELECT COUNT(*) AS row_count FROM {table}')
+                            table_rows[table] = cursor.fetchone()['row_count']
+                        if table_rows[table] >= QUERY_PLAN_LARGE_TABLE_ROWS:
+                            full_scans.append({'statement': fingerprint, 'table': table,
+                                               'table_rows': table_rows[table], 'plan': plan})
+    return full_scans, len(statements)
+
+
+def _get_sample():
+    """Picks a rating and a follow to call the page functions with, or returns <code>None</code> if there are none."""
+    with get_db_connection() as connection:
+        with connection.cursor(dictionary=True) as cursor:
+            cursor.execute("""SELECT r.user_id,
+                                     u.username,
+                                     r.book_id,
+                                     b.title,
+                                     r.score,
+                                     r.review
+                                FROM book_ratings AS r
+                                JOIN users AS u
+                                  ON u.id = r.user_id
+                                JOIN books AS b
+                                  ON b.id = r.book_id
+                               LIMIT 1""")
+            rating = cursor.fetchone()
+            cursor.execute("""SELECT f.follower_user_id,
+                                     f.followed_user_id
+                                FROM followers AS f
+                               LIMIT 1""")
+            follow = cursor.fetchone()
+    if rating is None or follow is None:
+        return None
+    return {**rating, **follow}
+
+
+def _call_page_functions(sample):
+    user_id, book_id = sample['user_id'], sample['book_id']
+    follower_user_id, followed_user_id = sample['follower_user_id'], sample['followed_user_id']
+    book_management.get_book_details(book_id)
+    _call_paginated(book_management.get_book_page, book_id, user_id)
+    _call_paginated(book_management.search_books, (tokenize(sample['title']) or ['a'])[0])
+    user_management.get_user_details(user_id)
+    user_management.get_users_details([user_id, followed_user_id])
+    user_management.username_available(sample['username'])
+    user_management.is_admin_user(user_id)
+    _call_paginated(user_management.get_user_page, user_id, follower_user_id)
+    _call_paginated(user_management.search_users, sample['username'])
+    rating_management.get_book_rating_for_user(book_id, user_id)
+    _call_paginated(rating_management.get_recent_book_ratings, book_id)
+    _call_paginated(rating_management.get_recent_user_ratings, user_id)
+    _call_paginated(rating_management.get_recent_followed_user_ratings, follower_user_id)
+    recommendation_management.get_recommended_books(book_id)
+    version_management.get_entity_version(version_management.BOOK, book_id)
+    session_token = session_management.create_session(user_id)
+    session_management.get_session_user_id(session_token)
+    session_management.delete_session(session_token)
+    follower_management.follower_pair_exists(follower_user_id, followed_user_id)
+    follower_management.remove_follower_pair(follower_user_id, followed_user_id)
+    follower_management.add_follower_pair(follower_user_id, followed_user_id)
+    if not RATING_WRITE_BEHIND:     # Otherwise they would be logged, and written for real by the next flush
+        rating_management.remove_rating(user_id, book_id)
+        rating_management.add_rating(user_id, book_id, sample['score'], sample['review'])
+
+
+def _call_paginated(func, *args):
+    """Calls a function for its first page, and for its second page too if there is one."""
+    result = func(*args, page_size=1)
+    if result is None:
+        return
+    next_page_token = result['next_page_token'] if isinstance(result, dict) else result[1]
+    if next_page_token is not None:
+        func(*args, page_token=next_page_token, page_size=1)
+
+
+def _get_scanned_tables(cursor, operation, params):
+    """Explains a statement, and yields the tables it reads in full along with the line of the plan that does."""
+    tables = {}
+    for table, alias in _TABLE_REFERENCE_PATTERN.findall(operation):
+        tables[alias or table] = table
+    if DB_BACKEND == 'sqlite':
+        cursor.execute(f'EXPLAIN QUERY PLAN {operation}', params)
+        for row in cursor.fetchall():
+            if (scan := _SQLITE_SCAN_PATTERN.match(row['detail'])) and scan[1] in tables:
+                yield tables[scan[1]], row['detail']
+    else:
+        cursor.execute(f'EXPLAIN {operation}', params)
+        for row in cursor.fetchall():
+            if row['type'] in _MYSQL_SCAN_TYPES and row['table'] in tables:
+                yield tables[row['table']], f'{row["table"]}: type {row["type"]}, key {row["key"]}, rows {row["rows"]}'
@@ -1,4 +1,27 @@
-from db_management import get_db_connection
+import logging
+
+from db_management import READ, Error, get_db_connection, stick_reads_to_primary
+from cache_management import invalidate
+from pagination import decode_page_token, get_page, get_recency_condition
+from recommendation_management import is_like, mark_neighbours_stale
+from timeline_management import push_rating, retract_rating
+from user_management import update_user_stats
+from version_management import ALL_PAGES, BOOK, USER, bump_version
+from write_behind import WriteBehindLog
+from config import PAGE_SIZE, RATING_WRITE_BEHIND, RATING_WRITE_BEHIND_LOG, RATING_WRITE_BEHIND_DELAY, \
+    RATING_WRITE_BEHIND_BATCH_SIZE
+
+_STATS_COLUMNS = ['rating_count', 'score_sum', 'score_1_count', 'score_2_count', 'score_3_count', 'score_4_count', 'score_5_count']
+_STATS_AGGREGATES = """COUNT(*) AS rating_count,
+                       SUM(r.score) AS score_sum,
+                       SUM(r.score = 1) AS score_1_count,
+                       SUM(r.score = 2) AS score_2_count,
+                       SUM(r.score = 3) AS score_3_count,
+                       SUM(r.score = 4) AS score_4_count,
+                       SUM(r.score = 5) AS score_5_count"""
+_NOT_BUFFERED = object()
+
+_logger = logging.getLogger('instabook.ratings')
 
 
 def get_book_rating_for_user(book_id, user_id):
@@ -13,11 +36,14 @@ def get_book_rating_for_user(book_id, user_id):
     :type book_id: int
     :return: a dictionary of the form
         <code>{'score': r.score, 'review': r.review}</code>
-        representing a rating
-    :rtype: dict
+        representing a rating, or <code>None</code> if the user has not rated the book
+    :rtype: dict or None
     """
-    with get_db_connection() as connection:
-        with connection.cursor() as cursor:
+    is_buffered, rating = get_buffered_rating(user_id, book_id)
+    if is_buffered:
+        return rating
+    with get_db_connection(READ) as connection:
+        with connection.cursor(dictionary=True) as cursor:
             cursor.execute("""SELECT r.score, r.review
                                 FROM book_ratings AS r
                                WHERE r.user_id = %s
@@ -26,80 +52,196 @@ def get_book_rating_for_user(book_id, user_id):
             return rating
 
 
-def get_recent_book_ratings(book_id):
+def get_recent_book_ratings(book_id, page_token=None, page_size=PAGE_SIZE):
     """
-    Gets any 10 ratings for a book, along with details of the users who created them.
+    Gets a page of ratings for a book, most recent first, along with details of the users who created them.
 
     *(Tables involved: users u, book_ratings r)*
 
     :param book_id: the id of the book to retrieve the ratings for
     :type book_id: int
+    :param page_token: the token of the page to get, or <code>None</code> for the first page
+    :type page_token: str or None
+    :param page_size: the maximum number of ratings on a page
+    :type page_size: int
     :return: a list of dictionaries of the form
-        <code>{'user_id': r.user_id, 'username': u.username, 'display_name': u.display_name, 'score': r.score, 'review': r.review}</code>
-        representing ratings
-    :rtype: dict
+        <code>{'user_id': r.user_id, 'username': u.username, 'display_name': u.display_name, 'score': r.score, 'review': r.review, 'rated_at': r.rated_at}</code>
+        representing ratings, and the token of the next page, or <code>None</code> if there are no more ratings
+    :rtype: tuple[list[dict], str or None]
+    :raises pagination.InvalidPageToken: if the page token is malformed
     """
-    with get_db_connection() as connection:
-        with connection.cursor() as cursor:
-            # Temporary code
-            ratings = [
-                {'user_id': 1, 'username': 'somebody',     'display_name': 'Some Body',     'score': 5, 'review': 'Banging'},
-                {'user_id': 2, 'username': 'somebodyelse', 'display_name': 'Somebody Else', 'score': 4, 'review': 'It was good I guess'},
-            ]
-            return ratings
+    after, after_params = get_recency_condition(decode_page_token(page_token, 2), 'r.rated_at', 'r.user_id')
+    with get_db_connection(READ) as connection:
+        with connection.cursor(dictionary=True) as cursor:
+            cursor.execute(f"""SELECT r.user_id,
+                                      u.username,
+                                      u.display_name,
+                                      r.score,
+                                      r.review,
+                                      r.rated_at
+                                 FROM book_ratings AS r
+                                 JOIN users AS u
+                                   ON u.id = r.user_id
+                                WHERE r.book_id = %s
+                                  AND {after}
+                             ORDER BY r.rated_at DESC, r.user_id DESC
+                                LIMIT %s""", [book_id, *after_params, page_size + 1])
+            ratings = cursor.fetchall()
+            return get_page(ratings, page_size, ['rated_at', 'user_id'])
 
 
-def get_recent_user_ratings(user_id):
+def get_recent_user_ratings(user_id, page_token=None, page_size=PAGE_SIZE):
     """
-    Gets any 10 ratings from a user, along with details of the books they were for.
+    Gets a page of ratings from a user, most recent first, along with details of the books they were for.
 
     *(Tables involved: books b, book_ratings r)*
 
     :param user_id: the id of the user to retrieve the ratings for
     :type user_id: int
+    :param page_token: the token of the page to get, or <code>None</code> for the first page
+    :type page_token: str or None
+    :param page_size: the maximum number of ratings on a page
+    :type page_size: int
     :return: a list of dictionaries of the form
-        <code>{'book_id': r.book_id, 'title': b.title, 'author': b.author, 'score': r.score, 'review': r.review}</code>
-        representing ratings
-    :rtype: dict
+        <code>{'book_id': r.book_id, 'title': b.title, 'author': b.author, 'score': r.score, 'review': r.review, 'rated_at': r.rated_at}</code>
+        representing ratings, and the token of the next page, or <code>None</code> if there are no more ratings
+    :rtype: tuple[list[dict], str or None]
+    :raises pagination.InvalidPageToken: if the page token is malformed
     """
-    with get_db_connection() as connection:
-        with connection.cursor() as cursor:
-            # Temporary code
-            ratings = [
-                {'book_id': 1, 'title': 'Some Book',       'author': 'Some Author',       'score': 5, 'review': 'Banging'},
-                {'book_id': 2, 'title': 'Some Other Book', 'author': 'Some Other Author', 'score': 4, 'review': 'It was good I guess'},
-            ]
-            return ratings
+    after, after_params = get_recency_condition(decode_page_token(page_token, 2), 'r.rated_at', 'r.book_id')
+    with get_db_connection(READ) as connection:
+        with connection.cursor(dictionary=True) as cursor:
+            cursor.execute(f"""SELECT r.book_id,
+                                      b.title,
+                                      b.author,
+                                      r.score,
+                                      r.review,
+                                      r.rated_at
+                                 FROM book_ratings AS r
+                                 JOIN books AS b
+                                   ON b.id = r.book_id
+                                WHERE r.user_id = %s
+                                  AND {after}
+                             ORDER BY r.rated_at DESC, r.book_id DESC
+                                LIMIT %s""", [user_id, *after_params, page_size + 1])
+            ratings = cursor.fetchall()
+            return get_page(ratings, page_size, ['rated_at', 'book_id'])
 
 
-def get_recent_followed_user_ratings(user_id):
+def get_recent_followed_user_ratings(user_id, page_token=None, page_size=PAGE_SIZE):
     """
-    Gets any 10 ratings from users followed by a particular user, along with details of who created them and the books they were for.
+    Gets a page of ratings from users followed by a particular user, most recent first, along with details of who
+    created them and the books they were for.
 
-    *(Tables involved: users u, followers f, books b, book_ratings r)*
+    Ratings are read from the user's precomputed timeline, merged with the ratings of any followed users who have
+    too many followers for their ratings to be pushed into timelines. Ratings older than the timeline's oldest
+    entry, which it may have been trimmed of, are read from the ratings of every followed user instead.
+
+    *(Tables involved: users u, followers f, books b, book_ratings r, timeline_entries t, timeline_pull_accounts p)*
 
     :param user_id: the id of the user to retrieve the followed user ratings for
     :type user_id: int
+    :param page_token: the token of the page to get, or <code>None</code> for the first page
+    :type page_token: str or None
+    :param page_size: the maximum number of ratings on a page
+    :type page_size: int
     :return: a list of dictionaries of the form
-        <code>{'user_id': r.user_id, 'username': u.username, 'display_name': u.display_name, 'book_id': r.book_id, 'title': b.title, 'author': b.author, 'score': r.score, 'review': r.review}</code>
-        representing ratings
-    :rtype: dict
+        <code>{'user_id': r.user_id, 'username': u.username, 'display_name': u.display_name, 'book_id': r.book_id, 'title': b.title, 'author': b.author, 'score': r.score, 'review': r.review, 'rated_at': r.rated_at}</code>
+        representing ratings, and the token of the next page, or <code>None</code> if there are no more ratings
+    :rtype: tuple[list[dict], str or None]
+    :raises pagination.InvalidPageToken: if the page token is malformed
     """
-    with get_db_connection() as connection:
-        with connection.cursor() as cursor:
-            # Temporary code
-            ratings = [
-                {'user_id': 1, 'username': 'somebody',     'display_name': 'Some Body',     'book_id': 1, 'title': 'Some Book',       'author': 'Some Author',       'score': 5, 'review': 'Banging'},
-                {'user_id': 2, 'username': 'somebodyelse', 'display_name': 'Somebody Else', 'book_id': 2, 'title': 'Some Other Book', 'author': 'Some Other Author', 'score': 4, 'review': 'It was good I guess'},
-            ]
-            return ratings
+    sort_key = decode_page_token(page_token, 3)
+    pushed_after, pushed_params = get_recency_condition(sort_key, 't.rated_at', 't.rater_user_id', 't.book_id')
+    pulled_after, pulled_params = get_recency_condition(sort_key, 'r.rated_at', 'r.user_id', 'r.book_id')
+    with get_db_connection(READ) as connection:
+        with connection.cursor(dictionary=True) as cursor:
+            cursor.execute("""SELECT MIN(t.rated_at) AS horizon
+                                FROM timeline_entries AS t
+                               WHERE t.owner_user_id = %s""", [user_id])
+            horizon = cursor.fetchone()['horizon']
+            ratings = []
+            if horizon is not None:
+                timeline_sql = f"""SELECT *
+                                     FROM (SELECT t.rater_user_id AS user_id,
+                                                  t.book_id,
+                                                  t.rated_at
+                                             FROM timeline_entries AS t
+                                            WHERE t.owner_user_id = %s
+                                              AND t.rated_at > %s
+                                              AND {pushed_after}
+                                         ORDER BY t.rated_at DESC, t.rater_user_id DESC, t.book_id DESC
+                                            LIMIT %s) AS pushed
+                                    UNION ALL
+                                   SELECT *
+                                     FROM (SELECT r.user_id,
+                                                  r.book_id,
+                                                  r.rated_at
+                                             FROM followers AS f
+                                             JOIN timeline_pull_accounts AS p
+                                               ON p.user_id = f.followed_user_id
+                                             JOIN book_ratings AS r
+                                               ON r.user_id = f.followed_user_id
+                                            WHERE f.follower_user_id = %s
+                                              AND r.rated_at > %s
+                                              AND {pulled_after}
+                                         ORDER BY r.rated_at DESC, r.user_id DESC, r.book_id DESC
+                                            LIMIT %s) AS pulled"""
+                ratings = _get_followed_user_ratings(cursor, timeline_sql, [user_id, horizon, *pushed_params, page_size + 1,
+                                                                            user_id, horizon, *pulled_params, page_size + 1],
+                                                     page_size + 1)
+            if len(ratings) <= page_size:   # The timeline ran out, so older ratings are pulled from everyone followed
+                before_horizon, horizon_params = ('r.rated_at <= %s', [horizon]) if horizon is not None else ('TRUE', [])
+                followed_sql = f"""SELECT r.user_id,
+                                          r.book_id,
+                                          r.rated_at
+                                     FROM followers AS f
+                                     JOIN book_ratings AS r
+                                       ON r.user_id = f.followed_user_id
+                                    WHERE f.follower_user_id = %s
+                                      AND {before_horizon}
+                                      AND {pulled_after}
+                                 ORDER BY r.rated_at DESC, r.user_id DESC, r.book_id DESC
+                                    LIMIT %s"""
+                remaining = page_size + 1 - len(ratings)
+                ratings += _get_followed_user_ratings(cursor, followed_sql, [user_id, *horizon_params, *pulled_params, remaining],
+                                                      remaining)
+            return get_page(ratings, page_size, ['rated_at', 'user_id', 'book_id'])
+
+
+def _get_followed_user_ratings(cursor, ratings_sql, params, limit):
+    """Adds the details of who created each of the ratings a query selects, and of the books they were for."""
+    cursor.execute(f"""SELECT x.user_id,
+                              u.username,
+                              u.display_name,
+                              x.book_id,
+                              b.title,
+                              b.author,
+                              r.score,
+                              r.review,
+                              x.rated_at
+                         FROM ({ratings_sql}) AS x
+                         JOIN book_ratings AS r
+                           ON r.user_id = x.user_id
+                          AND r.book_id = x.book_id
+                         JOIN users AS u
+                           ON u.id = x.user_id
+                         JOIN books AS b
+                           ON b.id = x.book_id
+                     ORDER BY x.rated_at DESC, x.user_id DESC, x.book_id DESC
+                        LIMIT %s""", [*params, limit])
+    return cursor.fetchall()
 
 
 def add_rating(user_id, book_id, score, review):
     """
-    Adds a user rating for a specific book.
+    Adds a user rating for a specific book, replacing any existing rating the user has for it,
+    and pushes it into the timelines of the user's followers.
 
-    *(Tables involved: book_ratings r)*
+    With <code>RATING_WRITE_BEHIND</code> on, the rating is only logged, and written to the database by the next flush.
+
+    *(Tables involved: book_ratings r, book_rating_stats s, followers f, timeline_entries t, user_stats c,
+    stale_book_neighbours x, entity_versions v)*
 
     :param user_id: the id of the user to add the rating for
     :type user_id: int
@@ -111,17 +253,24 @@ def add_rating(user_id, book_id, score, review):
     :type review: str
     :rtype: None
     """
+    if _rating_log is not None:
+        _rating_log.append((user_id, book_id), {'score': int(score), 'review': review})
+        stick_reads_to_primary()
+        return
     with get_db_connection() as connection:
-        with connection.cursor() as cursor:
-            # Temporary code
-            pass
+        _write_rating(connection, user_id, book_id, score, review)
+        connection.commit()
+        invalidate('book_details', book_id)
 
 
 def remove_rating(user_id, book_id):
     """
-    Removes a user rating for a specific book.
+    Removes a user rating for a specific book, and from any timelines it was pushed into.
 
-    *(Tables involved: book_ratings r)*
+    With <code>RATING_WRITE_BEHIND</code> on, the removal is only logged, and made in the database by the next flush.
+
+    *(Tables involved: book_ratings r, book_rating_stats s, timeline_entries t, user_stats c, stale_book_neighbours x,
+    entity_versions v)*
 
     :param user_id: the id of the user to remove the rating for
     :type user_id: int
@@ -129,7 +278,220 @@ def remove_rating(user_id, book_id):
     :type book_id: int
     :rtype: None
     """
+    if _rating_log is not None:
+        _rating_log.append((user_id, book_id), None)
+        stick_reads_to_primary()
+        return
+    with get_db_connection() as connection:
+        if _delete_rating(connection, user_id, book_id):
+            connection.commit()
+            invalidate('book_details', book_id)
+
+
+def get_buffered_rating(user_id, book_id):
+    """
+    Gets a user's latest rating for a book if it is still waiting in the write-behind log, so that pages can show
+    users their own ratings before they are flushed.
+
+    Call it before reading the rating from the database: a write that is not buffered any more by then has been
+    committed.
+
+    :param user_id: the id of the user
+    :type user_id: int
+    :param book_id: the id of the book
+    :type book_id: int
+    :return: whether a rating or removal is waiting, and the rating in the same shape as
+        <code>get_book_rating_for_user</code>, or <code>None</code> for a removal
+    :rtype: tuple[bool, dict or None]
+    """
+    if _rating_log is None:
+        return False, None
+    rating = _rating_log.get_pending((user_id, book_id), _NOT_BUFFERED)
+    if rating is _NOT_BUFFERED:
+        return False, None
+    return True, rating
+
+
+def flush_buffered_ratings():
+    """
+    Writes every rating waiting in the write-behind log to the database, collapsing repeated ratings of a book by
+    the same user into the last one.
+
+    :return: the number of ratings and removals written, or <code>None</code> if another process is flushing them
+    :rtype: int or None
+    """
+    if _rating_log is None:
+        return 0
+    return _rating_log.flush()
+
+
+def has_unwritten_buffered_ratings():
+    """
+    Tells whether the last flush left ratings in the write-behind log that could not be written, to be retried.
+
+    :rtype: bool
+    """
+    return _rating_log is not None and _rating_log.has_failed_writes()
+
+
+def schedule_buffered_rating_flush():
+    """Flushes the write-behind log in the background, such as at startup to pick up ratings logged before a crash."""
+    if _rating_log is not None:
+        _rating_log.schedule_flush()
+
+
+def rebuild_book_rating_stats():
+    """
+    Recomputes the rating aggregates of every book from scratch.
+
+    *(Tables involved: book_ratings r, book_rating_stats s, entity_versions v)*
+
+    :return: the number of books that have ratings
+    :rtype: int
+    """
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("""DELETE
+                                FROM book_rating_stats""")
+            cursor.execute(f"""INSERT
+                                 INTO book_rating_stats (book_id, {', '.join(_STATS_COLUMNS)})
+                               SELECT r.book_id, {_STATS_AGGREGATES}
+                                 FROM book_ratings AS r
+                             GROUP BY r.book_id""")
+            book_count = cursor.rowcount
+            bump_version(connection, ALL_PAGES, 0)
+            connection.commit()
+            return book_count
+
+
+def verify_book_rating_stats():
+    """
+    Finds books whose stored rating aggregates differ from the ones computed from their ratings.
+
+    *(Tables involved: book_ratings r, book_rating_stats s)*
+
+    :return: the ids of the books with stale aggregates
+    :rtype: list[int]
+    """
+    mismatch = ' OR '.join(f's.{column} <> x.{column}' for column in _STATS_COLUMNS)
     with get_db_connection() as connection:
         with connection.cursor() as cursor:
-            # Temporary code
-            pass
+            cursor.execute(f"""SELECT x.book_id
+                                 FROM (SELECT r.book_id, {_STATS_AGGREGATES}
+                                         FROM book_ratings AS r
+                                     GROUP BY r.book_id) AS x
+                            LEFT JOIN book_rating_stats AS s
+                                   ON s.book_id = x.book_id
+                                WHERE s.book_id IS NULL OR {mismatch}
+                                UNION
+                               SELECT s.book_id
+                                 FROM book_rating_stats AS s
+                                WHERE s.rating_count > 0
+                                  AND NOT EXISTS (SELECT *
+                                                    FROM book_ratings AS r
+                                                   WHERE r.book_id = s.book_id)""")
+            return sorted(book_id for (book_id,) in cursor.fetchall())
+
+
+def _get_score_for_update(cursor, user_id, book_id):
+    cursor.execute("""SELECT r.score
+                        FROM book_ratings AS r
+                       WHERE r.user_id = %s
+                         AND r.book_id = %s
+                         FOR UPDATE""", [user_id, book_id])
+    row = cursor.fetchone()
+    return row[0] if row is not None else None
+
+
+def _write_rating(connection, user_id, book_id, score, review):
+    with connection.cursor() as cursor:
+        old_score = _get_score_for_update(cursor, user_id, book_id)
+        cursor.execute("""INSERT
+                            INTO book_ratings (user_id, book_id, score, review)
+                          VALUES (%s, %s, %s, %s)
+                              ON DUPLICATE KEY UPDATE score = VALUES(score),
+                                                      review = VALUES(review),
+                                                      rated_at = CURRENT_TIMESTAMP(6)""", [user_id, book_id, score, review])
+        _update_book_rating_stats(cursor, book_id, old_score, int(score))
+    push_rating(connection, user_id, book_id)
+    if old_score is None:
+        update_user_stats(connection, user_id, rating_delta=1)
+    if is_like(old_score) != is_like(score):
+        mark_neighbours_stale(connection, book_id)
+    bump_version(connection, BOOK, book_id)
+    bump_version(connection, USER, user_id)
+
+
+def _delete_rating(connection, user_id, book_id):
+    """Removes a rating, and returns whether there was one."""
+    with connection.cursor() as cursor:
+        old_score = _get_score_for_update(cursor, user_id, book_id)
+        if old_score is None:
+            return False
+        retract_rating(connection, user_id, book_id)
+        cursor.execute("""DELETE
+                            FROM book_ratings
+                           WHERE user_id = %s
+                             AND book_id = %s""", [user_id, book_id])
+        _update_book_rating_stats(cursor, book_id, old_score, None)
+    update_user_stats(connection, user_id, rating_delta=-1)
+    if is_like(old_score):
+        mark_neighbours_stale(connection, book_id)
+    bump_version(connection, BOOK, book_id)
+    bump_version(connection, USER, user_id)
+    return True
+
+
+def _apply_buffered_ratings(writes):
+    """
+    Writes the ratings flushed from the write-behind log, in one transaction per batch, and returns those that could
+    not be written so that they stay logged for the next flush.
+    """
+    failed_writes = []
+    for start in range(0, len(writes), RATING_WRITE_BEHIND_BATCH_SIZE):
+        batch = writes[start:start + RATING_WRITE_BEHIND_BATCH_SIZE]
+        try:
+            _apply_rating_batch(batch)
+        except Error:
+            for write in batch:  # One by one, so that a rating that cannot be written only holds back itself
+                try:
+                    _apply_rating_batch([write])
+                except Error:
+                    _logger.exception('Could not write buffered rating %s, keeping it to retry', write)
+                    failed_writes.append(write)
+    return failed_writes
+
+
+def _apply_rating_batch(batch):
+    with get_db_connection() as connection:
+        for (user_id, book_id), rating in batch:
+            if rating is None:
+                _delete_rating(connection, user_id, book_id)
+            else:
+                _write_rating(connection, user_id, book_id, rating['score'], rating['review'])
+        connection.commit()
+    for book_id in {book_id for (_, book_id), _ in batch}:
+        invalidate('book_details', book_id)
+
+
+def _update_book_rating_stats(cursor, book_id, old_score, new_score):
+    """Applies the change from one rating score to another (either may be <code>None</code>) to a book's aggregates."""
+    deltas = [(new_score is not None) - (old_score is not None), (new_score or 0) - (old_score or 0)]
+    deltas += [(new_score == score) - (old_score == score) for score in range(1, 6)]
+    if not any(deltas):
+        return
+    if old_score is not None:  # The book already has aggregates, and the deltas may be negative
+        increments = ', '.join(f'{column} = {column} + %s' for column in _STATS_COLUMNS)
+        cursor.execute(f"""UPDATE book_rating_stats
+                              SET {increments}
+                            WHERE book_id = %s""", [*deltas, book_id])
+        return
+    increments = ', '.join(f'{column} = {column} + VALUES({column})' for column in _STATS_COLUMNS)
+    cursor.execute(f"""INSERT
+                         INTO book_rating_stats (book_id, {', '.join(_STATS_COLUMNS)})
+                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                           ON DUPLICATE KEY UPDATE {increments}""", [book_id, *deltas])
+
+
+_rating_log = WriteBehindLog(RATING_WRITE_BEHIND_LOG, _apply_buffered_ratings, RATING_WRITE_BEHIND_DELAY) \
+    if RATING_WRITE_BEHIND else None
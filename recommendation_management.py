@@ -0,0 +1,344 @@
+"""
+"Readers also liked" recommendations: for every book, the books most often liked by the same readers,
+precomputed into ``book_neighbours``.
+
+They are served from that table rather than from arrays held by each process: refreshes run in whichever worker
+took the rating, and every worker has to show them once committed. A book's list is one primary key range,
+read alongside the titles it needs anyway.
+"""
+from array import array
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from heapq import nlargest
+from math import sqrt
+from threading import Lock
+import logging
+import os
+
+from db_management import READ, get_db_connection, call_after_commit
+from version_management import ALL_PAGES, BOOK, bump_version
+from config import RECOMMENDATION_COUNT, RECOMMENDATION_NEIGHBOURS, RECOMMENDATION_MIN_SCORE, RECOMMENDATION_MIN_CO_LIKES
+
+_LIKE_COUNT = ' + '.join(f's.score_{score}_count' for score in range(RECOMMENDATION_MIN_SCORE, 6))
+
+_logger = logging.getLogger('instabook.recommendations')
+_executor = None
+_refresh_pending = False
+_refresh_lock = Lock()
+
+
+def get_recommended_books(book_id, count=RECOMMENDATION_COUNT):
+    """
+    Gets the books most liked by the readers who liked a particular book.
+
+    *(Tables involved: books b, book_neighbours n)*
+
+    :param book_id: the id of the book to get recommendations for
+    :type book_id: int
+    :param count: the maximum number of books to get
+    :type count: int
+    :return: a list of dictionaries of the form <code>{'id': b.id, 'title': b.title, 'author': b.author}</code>,
+        most similar first
+    :rtype: list[dict]
+    """
+    with get_db_connection(READ) as connection:
+        with connection.cursor(dictionary=True) as cursor:
+            cursor.execute("""SELECT b.id,
+                                     b.title,
+                                     b.author
+                                FROM book_neighbours AS n
+                                JOIN books AS b
+                                  ON b.id = n.neighbour_book_id
+                               WHERE n.book_id = %s
+                            ORDER BY n.similarity DESC, n.neighbour_book_id
+                               LIMIT %s""", [book_id, count])
+            return cursor.fetchall()
+
+
+def is_like(score):
+    return score is not None and int(score) >= RECOMMENDATION_MIN_SCORE
+
+
+def mark_neighbours_stale(connection, book_id):
+    """
+    Records that the readers who like a book changed, so that its neighbours are recomputed once that is committed.
+
+    *(Tables involved: stale_book_neighbours x)*
+
+    :param connection: the connection the rating was written with
+    :param book_id: the id of the book
+    :type book_id: int
+    :rtype: None
+    """
+    with connection.cursor() as cursor:
+        _mark_stale(cursor, book_id)
+    call_after_commit(schedule_neighbour_refresh, connection)
+
+
+def schedule_neighbour_refresh():
+    """Runs :func:`refresh_stale_neighbours` on a background thread, unless a run is already waiting to start."""
+    global _executor, _refresh_pending
+    with _refresh_lock:
+        if _refresh_pending:
+            return
+        _refresh_pending = True
+        if _executor is None:
+            _executor = ThreadPoolExecutor(1, thread_name_prefix='recommendations')
+    _executor.submit(_refresh_in_background)
+
+
+def _refresh_in_background():
+    global _refresh_pending
+    with _refresh_lock:
+        _refresh_pending = False  # Ratings committed from now on are picked up by this run or the next one
+    try:
+        refresh_stale_neighbours()
+    except Exception:
+        _logger.exception('Could not refresh stale book neighbours')
+
+
+def _reset_after_fork():
+    global _executor, _refresh_pending, _refresh_lock
+    _executor, _refresh_pending, _refresh_lock = None, False, Lock()    # Its thread was not copied into the forked process
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def refresh_stale_neighbours(batch_size=100):
+    """
+    Recomputes the neighbours of every book marked as stale, and updates the books they are a neighbour of.
+
+    *(Tables involved: book_ratings r, book_rating_stats s, book_neighbours n, stale_book_neighbours x, entity_versions v)*
+
+    :param batch_size: the number of stale books refreshed per transaction
+    :type batch_size: int
+    :return: the number of books refreshed
+    :rtype: int
+    """
+    refreshed_count = 0
+    while True:
+        with get_db_connection() as connection:
+            with connection.cursor(dictionary=True) as cursor:
+                cursor.execute("""SELECT x.book_id,
+                                         x.marked_at
+                                    FROM stale_book_neighbours AS x
+                                ORDER BY x.marked_at
+                                   LIMIT %s""", [batch_size])
+                stale_books = cursor.fetchall()
+                changed_book_ids = set()
+                for stale_book in stale_books:
+                    changed_book_ids |= _refresh_book(cursor, stale_book['book_id'])
+                    cursor.execute("""DELETE
+                                        FROM stale_book_neighbours
+                                       WHERE book_id = %s
+                                         AND marked_at = %s""", [stale_book['book_id'], stale_book['marked_at']])
+                for book_id in changed_book_ids:
+                    bump_version(connection, BOOK, book_id)
+                connection.commit()
+        if not stale_books:  # Refreshing can mark more books, whose lists it could not complete
+            return refreshed_count
+        refreshed_count += len(stale_books)
+
+
+def rebuild_book_neighbours(batch_size=1000):
+    """
+    Recomputes the neighbours of every book from scratch, for example after bulk loading ratings.
+
+    The reader-by-book matrix of likes is held in memory. With NumPy and SciPy installed, the similarities of a
+    batch of books to every other book are computed with one sparse matrix product; otherwise they are counted in
+    plain Python, which gives the same results more slowly. Each batch of books replaces its own rows, so pages keep
+    showing the old neighbours of the books the rebuild has not reached yet.
+
+    *(Tables involved: book_ratings r, book_neighbours n, stale_book_neighbours x, entity_versions v)*
+
+    :param batch_size: the number of books whose neighbours are computed and written per transaction
+    :type batch_size: int
+    :return: the number of books that have neighbours
+    :rtype: int
+    """
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("""DELETE
+                                FROM stale_book_neighbours""")  # Ratings committed from now on are marked again
+            connection.commit()
+            user_ids, book_ids = array('i'), array('i')
+            cursor.execute("""SELECT r.user_id,
+                                     r.book_id
+                                FROM book_ratings AS r
+                               WHERE r.score >= %s""", [RECOMMENDATION_MIN_SCORE])
+            while rows := cursor.fetchmany(10000):
+                for user_id, book_id in rows:
+                    user_ids.append(user_id)
+                    book_ids.append(book_id)
+            try:
+                # To install numpy and scipy, run `pip install numpy scipy`
+                import numpy  # noqa: F401
+                import scipy.sparse  # noqa: F401
+                all_neighbours = _compute_neighbours_vectorized(user_ids, book_ids, batch_size)
+            except ImportError:
+                all_neighbours = _compute_neighbours(user_ids, book_ids)
+            book_count = 0
+            rebuilt_book_ids = set()
+            batch_book_ids, batch = [], []
+            for book_id, neighbours in all_neighbours:
+                batch_book_ids.append(book_id)
+                batch += [(book_id, neighbour_book_id, similarity) for neighbour_book_id, similarity in neighbours]
+                book_count += bool(neighbours)
+                if len(batch_book_ids) >= batch_size:
+                    _replace_neighbours(cursor, batch_book_ids, batch)
+                    connection.commit()
+                    rebuilt_book_ids.update(batch_book_ids)
+                    batch_book_ids, batch = [], []
+            _replace_neighbours(cursor, batch_book_ids, batch)
+            rebuilt_book_ids.update(batch_book_ids)
+            cursor.execute("""SELECT DISTINCT n.book_id
+                                FROM book_neighbours AS n""")
+            unliked_book_ids = [book_id for book_id, in cursor.fetchall() if book_id not in rebuilt_book_ids]
+            for start in range(0, len(unliked_book_ids), batch_size):  # Books nobody likes any more
+                _replace_neighbours(cursor, unliked_book_ids[start:start + batch_size], [])
+            bump_version(connection, ALL_PAGES, 0)
+            connection.commit()
+            return book_count
+
+
+def _compute_neighbours_vectorized(user_ids, book_ids, batch_size):
+    """Yields the neighbours of every liked book, using sparse matrix products over batches of books."""
+    import numpy
+    from scipy.sparse import csr_matrix
+
+    if not book_ids:
+        return
+    book_keys, book_columns = numpy.unique(numpy.frombuffer(book_ids, dtype=numpy.int32), return_inverse=True)
+    _, user_rows = numpy.unique(numpy.frombuffer(user_ids, dtype=numpy.int32), return_inverse=True)
+    likes = csr_matrix((numpy.ones(len(book_columns), dtype=numpy.float32), (user_rows, book_columns)),
+                       shape=(user_rows.max() + 1, len(book_keys)))
+    liked_by = likes.T.tocsr()
+    norms = numpy.sqrt(numpy.asarray(likes.sum(axis=0)).ravel())
+    for start in range(0, len(book_keys), batch_size):
+        co_likes = (liked_by[start:start + batch_size] @ likes).tocsr()  # Readers who liked both, for each pair
+        for offset in range(co_likes.shape[0]):
+            column = start + offset
+            row = slice(co_likes.indptr[offset], co_likes.indptr[offset + 1])
+            columns, counts = co_likes.indices[row], co_likes.data[row]
+            keep = (counts >= RECOMMENDATION_MIN_CO_LIKES) & (columns != column)
+            columns, counts = columns[keep], counts[keep]
+            similarities = counts / (norms[column] * norms[columns])
+            order = numpy.lexsort((book_keys[columns], -similarities))[:RECOMMENDATION_NEIGHBOURS]
+            yield int(book_keys[column]), [(int(book_keys[columns[i]]), float(similarities[i])) for i in order]
+
+
+def _compute_neighbours(user_ids, book_ids):
+    """Yields the neighbours of every liked book, counting readers who liked both books in plain Python."""
+    likes_by_user, likers_by_book = {}, {}
+    for user_id, book_id in zip(user_ids, book_ids):
+        likes_by_user.setdefault(user_id, array('i')).append(book_id)
+        likers_by_book.setdefault(book_id, array('i')).append(user_id)
+    for book_id in sorted(likers_by_book):
+        co_likes = Counter()
+        for user_id in likers_by_book[book_id]:
+            co_likes.update(likes_by_user[user_id])
+        del co_likes[book_id]
+        yield book_id, _get_top_neighbours(
+            {other_book_id: count / sqrt(len(likers_by_book[book_id]) * len(likers_by_book[other_book_id]))
+             for other_book_id, count in co_likes.items() if count >= RECOMMENDATION_MIN_CO_LIKES})
+
+
+def _refresh_book(cursor, book_id):
+    """Recomputes a book's neighbours and its similarity to the books it is, or should be, a neighbour of."""
+    cursor.execute("""SELECT o.book_id,
+                             COUNT(*) AS co_likes
+                        FROM book_ratings AS r
+                        JOIN book_ratings AS o
+                          ON o.user_id = r.user_id
+                       WHERE r.book_id = %s
+                         AND r.score >= %s
+                         AND o.score >= %s
+                         AND o.book_id <> r.book_id
+                    GROUP BY o.book_id
+                      HAVING COUNT(*) >= %s""",
+                   [book_id, RECOMMENDATION_MIN_SCORE, RECOMMENDATION_MIN_SCORE, RECOMMENDATION_MIN_CO_LIKES])
+    co_likes = {row['book_id']: row['co_likes'] for row in cursor.fetchall()}
+    like_counts = _get_like_counts(cursor, [book_id, *co_likes])
+    similarities = {other_book_id: count / sqrt(like_counts[book_id] * like_counts[other_book_id])
+                    for other_book_id, count in co_likes.items() if like_counts.get(book_id) and like_counts.get(other_book_id)}
+
+    cursor.execute("""SELECT n.book_id
+                        FROM book_neighbours AS n
+                       WHERE n.neighbour_book_id = %s""", [book_id])
+    affected_book_ids = [book_id, *similarities.keys() | {row['book_id'] for row in cursor.fetchall()}]
+    current_neighbours = _get_neighbours(cursor, affected_book_ids)
+    new_neighbours = {book_id: _get_top_neighbours(similarities)}
+    for other_book_id in affected_book_ids[1:]:
+        neighbours = dict(current_neighbours.get(other_book_id, []))
+        old_similarity = neighbours.pop(book_id, None)
+        if other_book_id in similarities:
+            neighbours[book_id] = similarities[other_book_id]
+        new_neighbours[other_book_id] = _get_top_neighbours(neighbours)
+        if old_similarity is not None and len(current_neighbours[other_book_id]) >= RECOMMENDATION_NEIGHBOURS \
+                and round(neighbours.get(book_id, 0), 4) < round(old_similarity, 4):
+            _mark_stale(cursor, other_book_id)  # A book that was not stored may now belong in its full list
+
+    changed_book_ids = {other_book_id for other_book_id, neighbours in new_neighbours.items()
+                        if _round(neighbours) != _round(current_neighbours.get(other_book_id, []))}
+    for changed_book_id in changed_book_ids:
+        cursor.execute("""DELETE
+                            FROM book_neighbours
+                           WHERE book_id = %s""", [changed_book_id])
+    _insert_neighbours(cursor, [(changed_book_id, neighbour_book_id, similarity)
+                                for changed_book_id in changed_book_ids
+                                for neighbour_book_id, similarity in new_neighbours[changed_book_id]])
+    return changed_book_ids
+
+
+def _mark_stale(cursor, book_id):
+    cursor.execute("""INSERT
+                        INTO stale_book_neighbours (book_id)
+                      VALUES (%s)
+                          ON DUPLICATE KEY UPDATE marked_at = CURRENT_TIMESTAMP(6)""", [book_id])
+
+
+def _get_like_counts(cursor, book_ids):
+    cursor.execute(f"""SELECT s.book_id,
+                              {_LIKE_COUNT} AS like_count
+                         FROM book_rating_stats AS s
+                        WHERE s.book_id IN ({', '.join(['%s'] * len(book_ids))})""", book_ids)
+    return {row['book_id']: row['like_count'] for row in cursor.fetchall()}
+
+
+def _get_neighbours(cursor, book_ids):
+    neighbours = {}
+    for start in range(0, len(book_ids), 1000):
+        batch = book_ids[start:start + 1000]
+        cursor.execute(f"""SELECT n.book_id,
+                                  n.neighbour_book_id,
+                                  n.similarity
+                             FROM book_neighbours AS n
+                            WHERE n.book_id IN ({', '.join(['%s'] * len(batch))})
+                         ORDER BY n.book_id, n.similarity DESC, n.neighbour_book_id""", batch)
+        for row in cursor.fetchall():
+            neighbours.setdefault(row['book_id'], []).append((row['neighbour_book_id'], row['similarity']))
+    return neighbours
+
+
+def _get_top_neighbours(similarities):
+    return nlargest(RECOMMENDATION_NEIGHBOURS, similarities.items(), key=lambda item: (item[1], -item[0]))
+
+
+def _round(neighbours):
+    return [(neighbour_book_id, round(similarity, 4)) for neighbour_book_id, similarity in neighbours]
+
+
+def _replace_neighbours(cursor, book_ids, rows):
+    if book_ids:
+        cursor.execute(f"""DELETE
+                              FROM book_neighbours
+                             WHERE book_id IN ({', '.join(['%s'] * len(book_ids))})""", book_ids)
+    _insert_neighbours(cursor, rows)
+
+
+def _insert_neighbours(cursor, rows):
+    if rows:
+        cursor.executemany("""INSERT
+                                INTO book_neighbours (book_id, neighbour_book_id, similarity)
+                              VALUES (%s, %s, %s)""", rows)
@@ -0,0 +1,229 @@
+import re
+
+from db_management import get_db_connection
+
+MAX_QUERY_TERMS = 5
+MAX_TERM_MATCHES = 10000    # Index entries read per search word at most, so that very common prefixes stay fast
+MAX_TOKEN_LENGTH = 50
+
+_TOKEN_PATTERN = re.compile(r'[^\W_]+')
+_INDEXES = {
+    'books': ('book_search_tokens', 'book_id', ('title', 'author')),
+    'users': ('user_search_tokens', 'user_id', ('username', 'display_name')),
+}
+
+
+def tokenize(text):
+    """
+    Splits text into the lowercase words it is indexed and searched by.
+
+    :param text: the text to split
+    :type text: str or None
+    :return: the distinct words in the text, in order of first appearance
+    :rtype: list[str]
+    """
+    tokens = (token[:MAX_TOKEN_LENGTH] for token in _TOKEN_PATTERN.findall((text or '').lower()))
+    return list(dict.fromkeys(tokens))
+
+
+def index_book(cursor, book_id, title, author):
+    """
+    Adds a book's title and author to the search index.
+
+    *(Tables involved: book_search_tokens t)*
+
+    :param cursor: a cursor on the connection the book was added with
+    :param book_id: the id of the book to index
+    :type book_id: int
+    :param title: the title of the book
+    :type title: str
+    :param author: the author of the book
+    :type author: str
+    :rtype: None
+    """
+    _index_entity(cursor, 'books', book_id, title, author)
+
+
+def index_books(cursor, books):
+    """
+    Adds the titles and authors of many books to the search index at once.
+
+    *(Tables involved: book_search_tokens t)*
+
+    :param cursor: a cursor on the connection the books were added with
+    :param books: <code>(book_id, title, author)</code> tuples
+    :type books: list[tuple]
+    :rtype: None
+    """
+    tokens = [(token, book_id) for book_id, title, author in books
+              for token in dict.fromkeys(tokenize(title) + tokenize(author))]
+    if tokens:
+        cursor.executemany("""INSERT
+                                INTO book_search_tokens (token, book_id)
+                              VALUES (%s, %s)""", tokens)
+
+
+def index_user(cursor, user_id, username, display_name):
+    """
+    Adds a user's username and display name to the search index.
+
+    *(Tables involved: user_search_tokens t)*
+
+    :param cursor: a cursor on the connection the user was added with
+    :param user_id: the id of the user to index
+    :type user_id: int
+    :param username: the username of the user
+    :type username: str
+    :param display_name: the display name of the user
+    :type display_name: str
+    :rtype: None
+    """
+    _index_entity(cursor, 'users', user_id, username, display_name)
+
+
+def get_search_matches_query(connection, entity, query, after, limit):
+    """
+    Builds a query for the ids of the entities that best match a search query.
+
+    Each word of the search query matches indexed words that start with it. Entities are ranked by how
+    many of the search words they match, then by how many of those match a whole indexed word, then by id.
+    Each search word reads at most <code>MAX_TERM_MATCHES</code> index entries, whole words first, so a very common
+    prefix ranks only some of the entities it matches rather than scanning the whole index. With several words,
+    the other words are also looked up for every entity the rarest word matches, so entities that match them all
+    are ranked whole even when another word is that common.
+
+    *(Tables involved: book_search_tokens t or user_search_tokens t)*
+
+    :param connection: the connection to count the matches of each word with, when there are several
+    :param entity: <code>'books'</code> or <code>'users'</code>
+    :type entity: str
+    :param query: the search query
+    :type query: str
+    :param after: the <code>[matched_terms, exact_terms, id]</code> sort key to continue after, or <code>None</code>
+    :type after: list or None
+    :param limit: the maximum number of matches
+    :type limit: int
+    :return: a <code>(sql, params)</code> pair selecting rows of the form
+        <code>{'id': ..., 'matched_terms': ..., 'exact_terms': ...}</code>,
+        or <code>None</code> if the query has no searchable words
+    :rtype: tuple[str, list] or None
+    """
+    table, id_column, _ = _INDEXES[entity]
+    terms = tokenize(query)[:MAX_QUERY_TERMS]
+    if not terms:
+        return None
+    term_matches = f"""SELECT *
+                         FROM (SELECT %s AS term,
+                                      t.{id_column} AS id,
+                                      t.token = %s AS is_exact
+                                 FROM {table} AS t
+                                WHERE t.token LIKE %s
+                             ORDER BY t.token, t.{id_column}
+                                LIMIT %s) AS c"""
+    selects = [term_matches] * len(terms)
+    params = [param for index, term in enumerate(terms) for param in (index, term, f'{term}%', MAX_TERM_MATCHES)]
+    if len(terms) > 1:
+        rarest = _get_rarest_term(connection, table, terms)
+        rarest_matches = f"""SELECT %s AS term,
+                                    t.{id_column} AS id,
+                                    t.token = %s AS is_exact
+                               FROM (SELECT r.{id_column} AS id
+                                       FROM {table} AS r
+                                      WHERE r.token LIKE %s
+                                   ORDER BY r.token, r.{id_column}
+                                      LIMIT %s) AS r
+                               JOIN {table} AS t
+                                 ON t.{id_column} = r.id
+                              WHERE t.token LIKE %s"""
+        for index, term in enumerate(terms):
+            if term != rarest:
+                selects.append(rarest_matches)
+                params += [index, term, f'{rarest}%', MAX_TERM_MATCHES, f'{term}%']
+    having = ''
+    if after is not None:
+        matched_terms, exact_terms, last_id = after
+        having = """HAVING COUNT(*) < %s
+                        OR (COUNT(*) = %s AND (SUM(m.is_exact) < %s
+                                               OR (SUM(m.is_exact) = %s AND m.id > %s)))"""
+        params += [matched_terms, matched_terms, exact_terms, exact_terms, last_id]
+    sql = f"""SELECT m.id,
+                     COUNT(*) AS matched_terms,
+                     SUM(m.is_exact) AS exact_terms
+                FROM (SELECT c.term,
+                             c.id,
+                             MAX(c.is_exact) AS is_exact
+                        FROM ({' UNION ALL '.join(selects)}) AS c
+                    GROUP BY c.term, c.id) AS m
+            GROUP BY m.id
+            {having}
+            ORDER BY matched_terms DESC, exact_terms DESC, m.id
+               LIMIT %s"""
+    return sql, params + [limit]
+
+
+def _get_rarest_term(connection, table, terms):
+    """
+    Finds the search word that matches the fewest index entries. Counting stops one entry past
+    <code>MAX_TERM_MATCHES</code>, since no more than that many are ever read.
+    """
+    term_counts = f"""SELECT %s AS term_index,
+                             COUNT(*) AS match_count
+                        FROM (SELECT 1
+                                FROM {table} AS t
+                               WHERE t.token LIKE %s
+                               LIMIT %s) AS c"""
+    with connection.cursor() as cursor:
+        cursor.execute(f"""{' UNION ALL '.join([term_counts] * len(terms))}
+                        ORDER BY match_count, term_index
+                           LIMIT 1""",
+                       [param for index, term in enumerate(terms) for param in (index, f'{term}%', MAX_TERM_MATCHES + 1)])
+        return terms[cursor.fetchone()[0]]
+
+
+def rebuild_search_index(batch_size=1000):
+    """
+    Recreates the search index of every book and user from scratch.
+
+    Each batch of rows replaces its own entries, so searches keep finding the rows the rebuild has not reached yet.
+
+    *(Tables involved: books b, users u, book_search_tokens t, user_search_tokens t)*
+
+    :param batch_size: the number of rows read and indexed at a time
+    :type batch_size: int
+    :return: a dictionary of the form <code>{'books': ..., 'users': ...}</code> with the number of rows indexed
+    :rtype: dict
+    """
+    indexed = {}
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            for entity, (table, id_column, columns) in _INDEXES.items():
+                indexed[entity] = last_id = 0
+                while True:
+                    cursor.execute(f"""SELECT id, {', '.join(columns)}
+                                         FROM {entity}
+                                        WHERE id > %s
+                                     ORDER BY id
+                                        LIMIT %s""", [last_id, batch_size])
+                    rows = cursor.fetchall()
+                    if not rows:
+                        break
+                    cursor.execute(f"""DELETE
+                                         FROM {table}
+                                        WHERE {id_column} > %s
+                                          AND {id_column} <= %s""", [last_id, rows[-1][0]])
+                    for entity_id, *texts in rows:
+                        _index_entity(cursor, entity, entity_id, *texts)
+                    connection.commit()
+                    indexed[entity] += len(rows)
+                    last_id = rows[-1][0]
+            connection.commit()
+    return indexed
+
+
+def _index_entity(cursor, entity, entity_id, *texts):
+    table, id_column, _ = _INDEXES[entity]
+    tokens = list(dict.fromkeys(token for text in texts for token in tokenize(text)))
+    if tokens:
+        cursor.executemany(f"""INSERT
+                                 INTO {table} (token, {id_column})
+                               VALUES (%s, %s)""", [(token, entity_id) for token in tokens])
@@ -0,0 +1,60 @@
+"""
+Serves the app in production, from several worker processes forked by gunicorn.
+
+Run ``python serve.py --help`` for the available options.
+"""
+# To install gunicorn, run `pip install gunicorn`
+from argparse import ArgumentParser
+import gc
+
+from gunicorn.app.base import BaseApplication
+
+from app import create_app, warm_app
+from rating_management import schedule_buffered_rating_flush
+from user_management import start_user_stats_reconciler
+from config import SERVER_BIND, SERVER_WORKERS, SERVER_THREADS
+
+
+class PreforkedServer(BaseApplication):
+    """A gunicorn server for an app that was already created and warmed in this process."""
+
+    def __init__(self, app, options):
+        self.application = app
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+
+def start_worker(server, worker):
+    schedule_buffered_rating_flush()    # Picks up ratings logged before a crash
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--bind', default=SERVER_BIND, help='the address to listen on')
+    parser.add_argument('--workers', type=int, default=SERVER_WORKERS, help='number of worker processes')
+    parser.add_argument('--threads', type=int, default=SERVER_THREADS, help='number of requests each worker handles at once')
+    args = parser.parse_args()
+
+    app = create_app()
+    warm_app(app)
+    gc.freeze()     # Objects created so far are never collected, so the workers keep sharing their pages
+    start_user_stats_reconciler()   # In this process only, as forked workers do not inherit its thread
+    PreforkedServer(app, {
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': 'gthread',
+        'preload_app': True,
+        'post_fork': start_worker,
+    }).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+# itsdangerous is installed along with flask
+from datetime import datetime, timedelta
+from hashlib import blake2b
+import secrets
+
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+from cache_management import cached, invalidate
+from db_management import get_db_connection
+from config import FLASK_SECRET, SESSION_MAX_AGE, SESSION_IDENTITY_TTL
+
+SESSION_COOKIE_NAME = 'session_token'
+
+_serializer = URLSafeTimedSerializer(FLASK_SECRET, salt='instabook-session')
+
+
+def create_session(user_id):
+    """
+    Starts a session for a user who just signed in, and removes their expired ones.
+
+    *(Tables involved: user_sessions s)*
+
+    :param user_id: the id of the signed in user
+    :type user_id: int
+    :return: the signed session token to give the user
+    :rtype: str
+    """
+    session_id = secrets.token_urlsafe(32)
+    now = datetime.now()
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("""DELETE
+                                FROM user_sessions
+                               WHERE user_id = %s
+                                 AND expires_at <= %s""", [user_id, now])
+            cursor.execute("""INSERT
+                                INTO user_sessions (session_hash, user_id, expires_at)
+                              VALUES (%s, %s, %s)""",
+                           [_hash_session_id(session_id), user_id, now + timedelta(seconds=SESSION_MAX_AGE)])
+            connection.commit()
+    return _serializer.dumps(session_id)
+
+
+def get_session_user_id(session_token):
+    """
+    Gets the id of the user a session was started for. Sessions are cached for <code>SESSION_IDENTITY_TTL</code>
+    seconds, so most requests do not touch the database.
+
+    *(Tables involved: user_sessions s)*
+
+    :param session_token: the session token, if any
+    :type session_token: str or None
+    :return: the id of the user, or <code>None</code> if the token is missing, forged or expired or the user signed out
+    :rtype: int or None
+    """
+    session_id = _load_session_id(session_token)
+    return _get_session_owner(_hash_session_id(session_id)) if session_id is not None else None
+
+
+def delete_session(session_token):
+    """
+    Ends a session when the user signs out. Servers that cached it stop accepting it within
+    <code>SESSION_IDENTITY_TTL</code> seconds, or straight away with a shared cache backend.
+
+    *(Tables involved: user_sessions s)*
+
+    :param session_token: the session token, if any
+    :type session_token: str or None
+    :rtype: None
+    """
+    if (session_id := _load_session_id(session_token)) is None:
+        return
+    session_hash = _hash_session_id(session_id)
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("""DELETE
+                                FROM user_sessions
+                               WHERE session_hash = %s""", [session_hash])
+            connection.commit()
+            invalidate('session_owner', session_hash)
+
+
+@cached('session_owner', ttl=SESSION_IDENTITY_TTL)
+def _get_session_owner(session_hash):
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("""SELECT s.user_id
+                                FROM user_sessions AS s
+                               WHERE s.session_hash = %s
+                                 AND s.expires_at > %s""", [session_hash, datetime.now()])
+            row = cursor.fetchone()
+            return row[0] if row is not None else None
+
+
+def _load_session_id(session_token):
+    if not session_token:
+        return None
+    try:
+        session_id = _serializer.loads(session_token, max_age=SESSION_MAX_AGE)
+    except BadSignature:
+        return None
+    return session_id if isinstance(session_id, str) else None   # Tokens signed before sessions were stored
+
+
+def _hash_session_id(session_id):
+    return blake2b(session_id.encode(), digest_size=32).hexdigest()    # A leaked table cannot be used to sign in
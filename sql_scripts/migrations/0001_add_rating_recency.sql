@@ -0,0 +1,28 @@
+-- migrate:up
+ALTER TABLE book_ratings ADD COLUMN rated_at DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6);
+
+-- migrate:down
+ALTER TABLE book_ratings DROP COLUMN rated_at;
+
+-- migrate:up sqlite
+-- SQLite cannot add a column whose default is not a constant, so the table is rebuilt with it
+CREATE TABLE IF NOT EXISTS book_ratings_with_recency (
+    user_id INTEGER NOT NULL,
+    book_id INTEGER NOT NULL,
+    score INTEGER NOT NULL,
+    review VARCHAR(255),
+    rated_at DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+
+    PRIMARY KEY (user_id, book_id),
+    FOREIGN KEY (user_id) REFERENCES users(id),
+    FOREIGN KEY (book_id) REFERENCES books(id),
+    CHECK (score BETWEEN 1 AND 5)
+);
+
+INSERT INTO book_ratings_with_recency (user_id, book_id, score, review)
+SELECT user_id, book_id, score, review
+  FROM book_ratings;
+
+DROP TABLE book_ratings;
+
+ALTER TABLE book_ratings_with_recency RENAME TO book_ratings;
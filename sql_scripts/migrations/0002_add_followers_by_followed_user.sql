@@ -0,0 +1,8 @@
+-- migrate:up
+CREATE INDEX followers_by_followed_user ON followers (followed_user_id, follower_user_id);
+
+-- migrate:down
+-- MySQL will not drop the only index behind a foreign key, so the key is put back after it, with an index of its own
+ALTER TABLE followers DROP FOREIGN KEY followers_ibfk_2;
+DROP INDEX followers_by_followed_user ON followers;
+ALTER TABLE followers ADD CONSTRAINT followers_ibfk_2 FOREIGN KEY (followed_user_id) REFERENCES users(id);
@@ -0,0 +1,23 @@
+-- migrate:up
+CREATE TABLE IF NOT EXISTS book_rating_stats (
+    book_id INTEGER NOT NULL,
+    rating_count INTEGER NOT NULL DEFAULT 0,
+    score_sum INTEGER NOT NULL DEFAULT 0,
+    score_1_count INTEGER NOT NULL DEFAULT 0,
+    score_2_count INTEGER NOT NULL DEFAULT 0,
+    score_3_count INTEGER NOT NULL DEFAULT 0,
+    score_4_count INTEGER NOT NULL DEFAULT 0,
+    score_5_count INTEGER NOT NULL DEFAULT 0,
+
+    PRIMARY KEY (book_id),
+    FOREIGN KEY (book_id) REFERENCES books(id),
+    CHECK (rating_count >= 0)
+);
+
+INSERT INTO book_rating_stats (book_id, rating_count, score_sum, score_1_count, score_2_count, score_3_count, score_4_count, score_5_count)
+SELECT book_id, COUNT(*), SUM(score), SUM(score = 1), SUM(score = 2), SUM(score = 3), SUM(score = 4), SUM(score = 5)
+  FROM book_ratings
+ GROUP BY book_id;
+
+-- migrate:down
+DROP TABLE book_rating_stats;
@@ -0,0 +1,21 @@
+-- migrate:up
+-- The tables start empty: run `python maintenance.py rebuild-search-index` afterwards
+CREATE TABLE IF NOT EXISTS book_search_tokens (
+    token VARCHAR(50) NOT NULL,
+    book_id INTEGER NOT NULL,
+
+    PRIMARY KEY (token, book_id),
+    FOREIGN KEY (book_id) REFERENCES books(id)
+);
+
+CREATE TABLE IF NOT EXISTS user_search_tokens (
+    token VARCHAR(50) NOT NULL,
+    user_id INTEGER NOT NULL,
+
+    PRIMARY KEY (token, user_id),
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
+
+-- migrate:down
+DROP TABLE user_search_tokens;
+DROP TABLE book_search_tokens;
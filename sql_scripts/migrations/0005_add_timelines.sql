@@ -0,0 +1,25 @@
+-- migrate:up
+-- The timelines start empty: run `python maintenance.py rebuild-timelines` afterwards
+CREATE TABLE IF NOT EXISTS timeline_entries (
+    owner_user_id INTEGER NOT NULL,
+    rater_user_id INTEGER NOT NULL,
+    book_id INTEGER NOT NULL,
+    rated_at DATETIME(6) NOT NULL,
+
+    PRIMARY KEY (owner_user_id, rater_user_id, book_id),
+    INDEX timeline_entries_by_recency (owner_user_id, rated_at, rater_user_id, book_id),
+    INDEX timeline_entries_by_rating (rater_user_id, book_id),
+    FOREIGN KEY (owner_user_id) REFERENCES users(id),
+    FOREIGN KEY (rater_user_id, book_id) REFERENCES book_ratings(user_id, book_id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS timeline_pull_accounts (
+    user_id INTEGER NOT NULL,
+
+    PRIMARY KEY (user_id),
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
+
+-- migrate:down
+DROP TABLE timeline_pull_accounts;
+DROP TABLE timeline_entries;
@@ -0,0 +1,12 @@
+-- migrate:up
+CREATE TABLE IF NOT EXISTS entity_versions (
+    entity VARCHAR(10) NOT NULL,
+    entity_id INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    updated_at DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+
+    PRIMARY KEY (entity, entity_id)
+);
+
+-- migrate:down
+DROP TABLE entity_versions;
@@ -0,0 +1,24 @@
+-- migrate:up
+-- The neighbours start empty: run `python maintenance.py rebuild-recommendations` afterwards
+CREATE TABLE IF NOT EXISTS book_neighbours (
+    book_id INTEGER NOT NULL,
+    neighbour_book_id INTEGER NOT NULL,
+    similarity FLOAT NOT NULL,
+
+    PRIMARY KEY (book_id, neighbour_book_id),
+    INDEX book_neighbours_by_neighbour (neighbour_book_id, book_id),
+    FOREIGN KEY (book_id) REFERENCES books(id),
+    FOREIGN KEY (neighbour_book_id) REFERENCES books(id)
+);
+
+CREATE TABLE IF NOT EXISTS stale_book_neighbours (
+    book_id INTEGER NOT NULL,
+    marked_at DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+
+    PRIMARY KEY (book_id),
+    FOREIGN KEY (book_id) REFERENCES books(id)
+);
+
+-- migrate:down
+DROP TABLE stale_book_neighbours;
+DROP TABLE book_neighbours;
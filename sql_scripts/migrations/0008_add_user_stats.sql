@@ -0,0 +1,23 @@
+-- migrate:up
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id INTEGER NOT NULL,
+    follower_count INTEGER NOT NULL DEFAULT 0,
+    following_count INTEGER NOT NULL DEFAULT 0,
+    rating_count INTEGER NOT NULL DEFAULT 0,
+
+    PRIMARY KEY (user_id),
+    FOREIGN KEY (user_id) REFERENCES users(id),
+    CHECK (follower_count >= 0),
+    CHECK (following_count >= 0),
+    CHECK (rating_count >= 0)
+);
+
+INSERT INTO user_stats (user_id, follower_count, following_count, rating_count)
+SELECT u.id,
+       (SELECT COUNT(*) FROM followers AS f WHERE f.followed_user_id = u.id),
+       (SELECT COUNT(*) FROM followers AS f WHERE f.follower_user_id = u.id),
+       (SELECT COUNT(*) FROM book_ratings AS r WHERE r.user_id = u.id)
+  FROM users AS u;
+
+-- migrate:down
+DROP TABLE user_stats;
@@ -0,0 +1,10 @@
+-- migrate:up
+CREATE INDEX book_ratings_by_book_recency ON book_ratings (book_id, rated_at, user_id);
+CREATE INDEX book_ratings_by_user_recency ON book_ratings (user_id, rated_at, book_id);
+
+-- migrate:down
+-- MySQL will not drop the only index behind a foreign key, so the key is put back after it, with an index of its own
+DROP INDEX book_ratings_by_user_recency ON book_ratings;
+ALTER TABLE book_ratings DROP FOREIGN KEY book_ratings_ibfk_2;
+DROP INDEX book_ratings_by_book_recency ON book_ratings;
+ALTER TABLE book_ratings ADD CONSTRAINT book_ratings_ibfk_2 FOREIGN KEY (book_id) REFERENCES books(id);
@@ -0,0 +1,10 @@
+-- migrate:up
+CREATE TABLE IF NOT EXISTS replication_heartbeat (
+    id INTEGER NOT NULL,
+    beat_at DATETIME(6) NOT NULL,
+
+    PRIMARY KEY (id)
+);
+
+-- migrate:down
+DROP TABLE replication_heartbeat;
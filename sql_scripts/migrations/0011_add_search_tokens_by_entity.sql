@@ -0,0 +1,12 @@
+-- migrate:up
+CREATE INDEX book_search_tokens_by_book ON book_search_tokens (book_id, token);
+CREATE INDEX user_search_tokens_by_user ON user_search_tokens (user_id, token);
+
+-- migrate:down
+-- MySQL will not drop the only index behind a foreign key, so the key is put back after it, with an index of its own
+ALTER TABLE user_search_tokens DROP FOREIGN KEY user_search_tokens_ibfk_1;
+DROP INDEX user_search_tokens_by_user ON user_search_tokens;
+ALTER TABLE user_search_tokens ADD CONSTRAINT user_search_tokens_ibfk_1 FOREIGN KEY (user_id) REFERENCES users(id);
+ALTER TABLE book_search_tokens DROP FOREIGN KEY book_search_tokens_ibfk_1;
+DROP INDEX book_search_tokens_by_book ON book_search_tokens;
+ALTER TABLE book_search_tokens ADD CONSTRAINT book_search_tokens_ibfk_1 FOREIGN KEY (book_id) REFERENCES books(id);
@@ -0,0 +1,13 @@
+-- migrate:up
+CREATE TABLE IF NOT EXISTS user_sessions (
+    session_hash CHAR(64) NOT NULL,
+    user_id INTEGER NOT NULL,
+    expires_at DATETIME(6) NOT NULL,
+
+    PRIMARY KEY (session_hash),
+    INDEX user_sessions_by_user (user_id, expires_at),
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
+
+-- migrate:down
+DROP TABLE user_sessions;
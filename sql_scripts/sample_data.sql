@@ -49,3 +49,23 @@ INSERT INTO book_ratings (user_id, book_id, score, review) VALUES
 (7, 4, 4, 'A fun woodland story'),
 (8, 5, 3, 'I prefer manicures'),
 (8, 6, 3, 'A bit violent');
+
+INSERT INTO book_rating_stats (book_id, rating_count, score_sum, score_1_count, score_2_count, score_3_count, score_4_count, score_5_count)
+SELECT book_id, COUNT(*), SUM(score), SUM(score = 1), SUM(score = 2), SUM(score = 3), SUM(score = 4), SUM(score = 5)
+  FROM book_ratings
+ GROUP BY book_id;
+
+INSERT INTO timeline_entries (owner_user_id, rater_user_id, book_id, rated_at)
+SELECT f.follower_user_id, r.user_id, r.book_id, r.rated_at
+  FROM followers AS f
+  JOIN book_ratings AS r
+    ON r.user_id = f.followed_user_id;
+
+INSERT INTO user_stats (user_id, follower_count, following_count, rating_count)
+SELECT u.id,
+       (SELECT COUNT(*) FROM followers AS f WHERE f.followed_user_id = u.id),
+       (SELECT COUNT(*) FROM followers AS f WHERE f.follower_user_id = u.id),
+       (SELECT COUNT(*) FROM book_ratings AS r WHERE r.user_id = u.id)
+  FROM users AS u;
+
+-- The search index is built in Python: run `python maintenance.py rebuild-search-index` after loading this file
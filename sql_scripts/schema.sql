@@ -18,6 +18,7 @@ CREATE TABLE IF NOT EXISTS followers (
     followed_user_id INTEGER NOT NULL,
 
     PRIMARY KEY (follower_user_id, followed_user_id),
+    INDEX followers_by_followed_user (followed_user_id, follower_user_id),
     FOREIGN KEY (follower_user_id) REFERENCES users(id),
     FOREIGN KEY (followed_user_id) REFERENCES users(id),
     CHECK (follower_user_id != followed_user_id)
@@ -39,9 +40,146 @@ CREATE TABLE IF NOT EXISTS book_ratings (
     book_id INTEGER NOT NULL,
     score INTEGER NOT NULL,
     review VARCHAR(255),
+    rated_at DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
 
     PRIMARY KEY (user_id, book_id),
+    INDEX book_ratings_by_book_recency (book_id, rated_at, user_id),
+    INDEX book_ratings_by_user_recency (user_id, rated_at, book_id),
     FOREIGN KEY (user_id) REFERENCES users(id),
     FOREIGN KEY (book_id) REFERENCES books(id),
     CHECK (score BETWEEN 1 AND 5)
 );
+
+CREATE TABLE IF NOT EXISTS book_rating_stats (
+    book_id INTEGER NOT NULL,
+    rating_count INTEGER NOT NULL DEFAULT 0,
+    score_sum INTEGER NOT NULL DEFAULT 0,
+    score_1_count INTEGER NOT NULL DEFAULT 0,
+    score_2_count INTEGER NOT NULL DEFAULT 0,
+    score_3_count INTEGER NOT NULL DEFAULT 0,
+    score_4_count INTEGER NOT NULL DEFAULT 0,
+    score_5_count INTEGER NOT NULL DEFAULT 0,
+
+    PRIMARY KEY (book_id),
+    FOREIGN KEY (book_id) REFERENCES books(id),
+    CHECK (rating_count >= 0)
+);
+
+CREATE TABLE IF NOT EXISTS book_search_tokens (
+    token VARCHAR(50) NOT NULL,
+    book_id INTEGER NOT NULL,
+
+    PRIMARY KEY (token, book_id),
+    INDEX book_search_tokens_by_book (book_id, token),
+    FOREIGN KEY (book_id) REFERENCES books(id)
+);
+
+CREATE TABLE IF NOT EXISTS user_search_tokens (
+    token VARCHAR(50) NOT NULL,
+    user_id INTEGER NOT NULL,
+
+    PRIMARY KEY (token, user_id),
+    INDEX user_search_tokens_by_user (user_id, token),
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
+
+CREATE TABLE IF NOT EXISTS timeline_entries (
+    owner_user_id INTEGER NOT NULL,
+    rater_user_id INTEGER NOT NULL,
+    book_id INTEGER NOT NULL,
+    rated_at DATETIME(6) NOT NULL,
+
+    PRIMARY KEY (owner_user_id, rater_user_id, book_id),
+    INDEX timeline_entries_by_recency (owner_user_id, rated_at, rater_user_id, book_id),
+    INDEX timeline_entries_by_rating (rater_user_id, book_id),
+    FOREIGN KEY (owner_user_id) REFERENCES users(id),
+    FOREIGN KEY (rater_user_id, book_id) REFERENCES book_ratings(user_id, book_id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS timeline_pull_accounts (
+    user_id INTEGER NOT NULL,
+
+    PRIMARY KEY (user_id),
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
+
+CREATE TABLE IF NOT EXISTS entity_versions (
+    entity VARCHAR(10) NOT NULL,
+    entity_id INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    updated_at DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+
+    PRIMARY KEY (entity, entity_id)
+);
+
+CREATE TABLE IF NOT EXISTS book_neighbours (
+    book_id INTEGER NOT NULL,
+    neighbour_book_id INTEGER NOT NULL,
+    similarity FLOAT NOT NULL,
+
+    PRIMARY KEY (book_id, neighbour_book_id),
+    INDEX book_neighbours_by_neighbour (neighbour_book_id, book_id),
+    FOREIGN KEY (book_id) REFERENCES books(id),
+    FOREIGN KEY (neighbour_book_id) REFERENCES books(id)
+);
+
+CREATE TABLE IF NOT EXISTS stale_book_neighbours (
+    book_id INTEGER NOT NULL,
+    marked_at DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+
+    PRIMARY KEY (book_id),
+    FOREIGN KEY (book_id) REFERENCES books(id)
+);
+
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id INTEGER NOT NULL,
+    follower_count INTEGER NOT NULL DEFAULT 0,
+    following_count INTEGER NOT NULL DEFAULT 0,
+    rating_count INTEGER NOT NULL DEFAULT 0,
+
+    PRIMARY KEY (user_id),
+    FOREIGN KEY (user_id) REFERENCES users(id),
+    CHECK (follower_count >= 0),
+    CHECK (following_count >= 0),
+    CHECK (rating_count >= 0)
+);
+
+CREATE TABLE IF NOT EXISTS replication_heartbeat (
+    id INTEGER NOT NULL,
+    beat_at DATETIME(6) NOT NULL,
+
+    PRIMARY KEY (id)
+);
+
+CREATE TABLE IF NOT EXISTS user_sessions (
+    session_hash CHAR(64) NOT NULL,
+    user_id INTEGER NOT NULL,
+    expires_at DATETIME(6) NOT NULL,
+
+    PRIMARY KEY (session_hash),
+    INDEX user_sessions_by_user (user_id, expires_at),
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
+
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER NOT NULL,
+    name VARCHAR(255) NOT NULL,
+    applied_at DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+
+    PRIMARY KEY (version)
+);
+
+-- The migrations in sql_scripts/migrations that this file already includes
+INSERT IGNORE INTO schema_migrations (version, name) VALUES
+(1, 'add_rating_recency'),
+(2, 'add_followers_by_followed_user'),
+(3, 'add_book_rating_stats'),
+(4, 'add_search_tokens'),
+(5, 'add_timelines'),
+(6, 'add_entity_versions'),
+(7, 'add_book_neighbours'),
+(8, 'add_user_stats'),
+(9, 'add_book_ratings_by_recency'),
+(10, 'add_replication_heartbeat'),
+(11, 'add_search_tokens_by_entity'),
+(12, 'add_user_sessions');
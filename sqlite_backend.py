@@ -0,0 +1,214 @@
+"""
+An in-process SQLite backend that the management modules can use in place of MySQL, selected with
+``DB_BACKEND = 'sqlite'`` in config.py. Statements are translated from the MySQL dialect before they run.
+"""
+from functools import lru_cache
+import re
+import sqlite3
+
+Error = sqlite3.Error
+IntegrityError = sqlite3.IntegrityError
+
+# Tuned for many concurrent readers and one writer at a time, as in a web app
+PRAGMAS = {
+    'journal_mode': 'WAL',          # Readers never block the writer, and the writer never blocks readers
+    'synchronous': 'NORMAL',        # Safe with WAL; only the last transactions can be lost on power failure
+    'foreign_keys': 'ON',
+    'busy_timeout': 5000,           # Milliseconds a writer waits for another writer before giving up
+    'cache_size': -64000,           # Kibibytes of page cache per connection
+    'temp_store': 'MEMORY',
+    'mmap_size': 268435456,         # Bytes of the database file read through memory mapping
+}
+TIMESTAMP_SQL = "strftime('%Y-%m-%d %H:%M:%f', 'now')"     # CURRENT_TIMESTAMP(6), to the millisecond
+
+_WRITE_PATTERN = re.compile(r'^\s*(INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+_FOR_UPDATE_PATTERN = re.compile(r'\s+FOR\s+UPDATE\b', re.IGNORECASE)
+_ON_DUPLICATE_PATTERN = re.compile(r'ON\s+DUPLICATE\s+KEY\s+UPDATE\b(.*)$', re.IGNORECASE | re.DOTALL)
+_TRANSLATIONS = [
+    (re.compile(r'%s'), '?'),
+    (re.compile(r'\bINSERT\s+IGNORE\b', re.IGNORECASE), 'INSERT OR IGNORE'),
+    (re.compile(r'\bVALUES\((\w+)\)', re.IGNORECASE), r'excluded.\1'),
+    (re.compile(r'\bCURRENT_TIMESTAMP\(6\)', re.IGNORECASE), TIMESTAMP_SQL),
+    (re.compile(r'([\w.]+) / (?=NULLIF\()'), r'CAST(\1 AS REAL) / '),     # SQLite would truncate to an integer
+    (re.compile(r'\bDROP\s+INDEX\s+(\w+)\s+ON\s+\w+', re.IGNORECASE), r'DROP INDEX \1'),    # Index names are global
+    (re.compile(r'\bCONCAT\(([^()]*)\)', re.IGNORECASE), lambda match: '(' + ' || '.join(match[1].split(', ')) + ')'),
+]
+
+
+class SqliteCursor:
+    """A cursor that takes MySQL statements and can return rows as dictionaries, like a ``mysql.connector`` one."""
+
+    def __init__(self, connection, dictionary=False):
+        self._connection = connection
+        self._cursor = connection._connection.cursor()
+        if dictionary:
+            self._cursor.row_factory = lambda cursor, row: dict(zip([column[0] for column in cursor.description], row))
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._cursor.close()
+
+    def execute(self, operation, params=()):
+        sql, is_write = translate(operation)
+        if is_write:
+            self._connection.begin()
+        self._cursor.execute(sql, params or ())
+
+    def executemany(self, operation, seq_params):
+        sql, is_write = translate(operation)
+        if is_write:
+            self._connection.begin()
+        self._cursor.executemany(sql, seq_params)
+
+
+class SqliteConnection:
+    """
+    A SQLite connection that starts a transaction on the first write, the way MySQL does with autocommit off.
+
+    Reads outside a transaction see the latest committed data. Writes, and reads ending in ``FOR UPDATE``,
+    take SQLite's write lock until the transaction is committed or rolled back.
+    """
+
+    def __init__(self, database):
+        self._connection = sqlite3.connect(database, isolation_level=None, check_same_thread=False)
+        for pragma, value in PRAGMAS.items():
+            self._connection.execute(f'PRAGMA {pragma} = {value}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def in_transaction(self):
+        return self._connection.in_transaction
+
+    def begin(self):
+        if not self._connection.in_transaction:
+            self._connection.execute('BEGIN IMMEDIATE')
+
+    def cursor(self, dictionary=False):
+        return SqliteCursor(self, dictionary)
+
+    def commit(self):
+        if self._connection.in_transaction:
+            self._connection.execute('COMMIT')
+
+    def rollback(self):
+        if self._connection.in_transaction:
+            self._connection.execute('ROLLBACK')
+
+    def ping(self, reconnect=False):
+        self._connection.execute('SELECT 1')
+
+    def close(self):
+        self._connection.close()
+
+
+def connect(database):
+    """
+    Opens a connection to a SQLite database file, creating the file if it does not exist.
+
+    :param database: the path of the database file
+    :type database: str
+    :rtype: SqliteConnection
+    """
+    return SqliteConnection(database)
+
+
+@lru_cache(maxsize=1024)
+def translate(operation):
+    """
+    Translates a statement from MySQL to SQLite.
+
+    :param operation: the MySQL statement, with <code>%s</code> placeholders
+    :type operation: str
+    :return: the SQLite statement, and whether it needs the write lock
+    :rtype: tuple[str, bool]
+    """
+    is_write = bool(_WRITE_PATTERN.match(operation) or _FOR_UPDATE_PATTERN.search(operation))
+    sql = _FOR_UPDATE_PATTERN.sub('', operation)
+    sql = _ON_DUPLICATE_PATTERN.sub(lambda match: 'ON CONFLICT DO UPDATE SET' + match[1], sql)
+    for pattern, replacement in _TRANSLATIONS:
+        sql = pattern.sub(replacement, sql)
+    return sql, is_write
+
+
+def translate_script(script):
+    """
+    Translates a MySQL script such as schema.sql into SQLite statements.
+
+    Columns that MySQL auto-increments become SQLite's <code>INTEGER PRIMARY KEY</code>, indexes declared
+    inside <code>CREATE TABLE</code> become separate <code>CREATE INDEX</code> statements, and text columns
+    compare case-insensitively, as they do under MySQL's default collation.
+
+    :param script: the MySQL script
+    :type script: str
+    :return: the SQLite statements
+    :rtype: list[str]
+    """
+    statements, statement = [], ''
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            statements.append(statement.strip())
+            statement = ''
+    translated = []
+    for statement in statements:
+        statement = re.sub(r'^(--.*\n\s*)+', '', statement)  # Comments before a statement would hide what it is
+        if re.match(r'(CREATE\s+DATABASE|USE)\b', statement, re.IGNORECASE):
+            continue
+        if re.match(r'ALTER\s+TABLE\s+\w+\s+(DROP|ADD\s+CONSTRAINT\s+\w+)\s+FOREIGN\s+KEY\b', statement, re.IGNORECASE):
+            continue    # SQLite declares foreign keys with the table, and they need no index of their own
+        if table := re.match(r'CREATE\s+TABLE\s+IF\s+NOT\s+EXISTS\s+(\w+)', statement, re.IGNORECASE):
+            translated += _translate_create_table(table[1], statement)
+        else:
+            translated.append(translate(statement)[0])
+    return translated
+
+
+def run_script(connection, script):
+    """
+    Runs a MySQL script such as schema.sql or sample_data.sql against a SQLite database in one transaction.
+
+    :param connection: a connection from :func:`connect`
+    :type connection: SqliteConnection
+    :param script: the MySQL script
+    :type script: str
+    :return: the number of statements run
+    :rtype: int
+    """
+    statements = translate_script(script)
+    connection.begin()
+    for statement in statements:
+        connection._connection.execute(statement)
+    connection.commit()
+    return len(statements)
+
+
+def _translate_create_table(table, statement):
+    lines, indexes = [], []
+    auto_increment_column = None
+    for line in statement.splitlines():
+        if column := re.match(r'\s+(\w+) INTEGER NOT NULL AUTO_INCREMENT', line):
+            auto_increment_column = column[1]
+            line = f'    {column[1]} INTEGER PRIMARY KEY,'  # An alias of the rowid, which SQLite numbers by itself
+        elif index := re.match(r'\s+INDEX (\w+) (\(.*?\)),?$', line):
+            indexes.append(f'CREATE INDEX IF NOT EXISTS {index[1]} ON {table} {index[2]}')
+            continue
+        elif auto_increment_column and re.match(rf'\s+PRIMARY KEY \({auto_increment_column}\),?$', line):
+            continue
+        line = re.sub(r'^(\s+\w+ (?:VAR)?CHAR\(\d+\))', r'\1 COLLATE NOCASE', line)
+        line = re.sub(r'DEFAULT CURRENT_TIMESTAMP\(6\)', f'DEFAULT ({TIMESTAMP_SQL})', line)
+        lines.append(line)
+    create_table = re.sub(r',(\s*\n\s*\);)$', r'\1', '\n'.join(lines))  # Drop the comma left before a removed last line
+    return [create_table, *indexes]
@@ -0,0 +1,30 @@
+import os
+import tempfile
+
+import pytest
+
+import config
+
+# Point the app at a throwaway SQLite database before any of its modules read the config
+DATABASE_DIR = tempfile.mkdtemp(prefix='instabook-tests-')
+config.DB_BACKEND = 'sqlite'
+config.DB_SQLITE_PATH = os.path.join(DATABASE_DIR, 'instabook.sqlite3')
+config.DB_SLOW_QUERY_LOG = None
+config.RATING_WRITE_BEHIND_LOG = os.path.join(DATABASE_DIR, 'rating_writes.log')
+
+CONFIG_OVERRIDES = (f"import config; config.DB_BACKEND = 'sqlite'; config.DB_SQLITE_PATH = {config.DB_SQLITE_PATH!r}; "
+                    f"config.DB_SLOW_QUERY_LOG = None\n")
+
+
+def create_schema(path):
+    from sqlite_backend import connect, run_script
+    with connect(path) as connection:
+        for script_path in ('sql_scripts/schema.sql', 'sql_scripts/sample_data.sql'):
+            with open(script_path) as script_file:
+                run_script(connection, script_file.read())
+
+
+@pytest.fixture(scope='session', autouse=True)
+def database():
+    create_schema(config.DB_SQLITE_PATH)
+    return config.DB_SQLITE_PATH
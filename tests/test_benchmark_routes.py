@@ -0,0 +1,48 @@
+import benchmark_routes
+from benchmark_routes import find_regressions, load_dataset, run_route
+
+
+class FakeSession:
+    """Answers every request at once, counting the requests and telling the benchmark each ran three statements."""
+
+    def __init__(self, status=200):
+        self.requests = []
+        self.status = status
+
+    def request(self, method, path, form):
+        self.requests.append((method, path, form))
+        return self.status, 3
+
+
+def test_requests_are_shared_between_workers_and_reproducible():
+    data = {'max_book_id': 6, 'max_user_id': 8, 'names': ['Emily']}
+    runs = []
+    for _ in range(2):
+        sessions = [FakeSession(), FakeSession(404)]
+        result = run_route('view_book', sessions, data, request_count=5, seed=1)
+        runs.append([session.requests for session in sessions])
+        assert (result['requests'], result['queries_per_request'], result['errors']) == (5, 3, 2)
+        assert result['p50_ms'] <= result['p95_ms'] <= result['p99_ms']
+    assert [len(requests) for requests in runs[0]] == [3, 2]
+    assert runs[0] == runs[1]
+
+
+def test_regressions_are_found_against_the_baseline():
+    baseline = {'feed': {'p95_ms': 10.0, 'requests_per_second': 100.0, 'queries_per_request': 3.0}}
+    assert find_regressions({'feed': {'p95_ms': 11.0, 'requests_per_second': 90.0, 'queries_per_request': 3.0},
+                             'new_route': {'p95_ms': 99.0, 'requests_per_second': 1.0, 'queries_per_request': 9.0}},
+                            baseline, tolerance=0.2) == []
+    regressions = find_regressions({'feed': {'p95_ms': 13.0, 'requests_per_second': 80.0, 'queries_per_request': 4.0}},
+                                   baseline, tolerance=0.2)
+    assert [regression.split(' went')[0] for regression in regressions] == ['feed: p95', 'feed: throughput',
+                                                                           'feed: queries per request']
+
+
+def test_every_read_route_runs_against_the_app():
+    accounts, data = load_dataset(1)
+    session = benchmark_routes.TestClientSession(None)   # Imported as is, pytest would try to collect it
+    assert session.sign_in(accounts[0]['username'], accounts[0]['pin'])
+    for route in ('feed', 'search_books', 'search_users', 'view_book', 'view_user'):
+        result = run_route(route, [session], data, request_count=3, seed=0)
+        assert result['errors'] == 0, route
+        assert result['queries_per_request'] > 0, route
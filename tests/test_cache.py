@@ -0,0 +1,81 @@
+from flask import Response
+
+from app import create_app
+from book_management import get_book_details
+from cache_management import LocalCacheBackend, get_cache_stats
+from db_management import call_after_commit, get_db_connection
+from rating_management import add_rating, remove_rating
+
+
+def test_local_backend_evicts_the_least_recently_used_entry():
+    backend = LocalCacheBackend(max_size=2)
+    backend.set('a', 1, ttl=60)
+    backend.set('b', 2, ttl=60)
+    backend.get('a')
+    backend.set('c', 3, ttl=60)
+    assert (backend.get('a'), backend.get('c'), backend.size()) == (1, 3, 2)
+
+
+def test_local_backend_expires_entries():
+    backend = LocalCacheBackend(max_size=2)
+    backend.set('a', 1, ttl=0)
+    backend.set('b', 2, ttl=60)
+    backend.get('a')
+    assert (backend.get('b'), backend.size()) == (2, 1)
+
+
+def test_book_details_are_cached_and_invalidated_by_ratings():
+    get_book_details(6)
+    hits = get_cache_stats()['namespaces']['book_details']['hits']
+    before = get_book_details(6)
+    assert get_cache_stats()['namespaces']['book_details']['hits'] == hits + 1
+    add_rating(1, 6, 5, 'Fewer chairs than expected')
+    try:
+        assert get_book_details(6) != before
+    finally:
+        remove_rating(1, 6)
+    assert get_book_details(6) == before
+
+
+def test_after_commit_callback_waits_for_the_request_to_commit():
+    app = create_app({'TESTING': True})
+    calls = []
+    with app.test_request_context('/', method='POST'):
+        with get_db_connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("""UPDATE users
+                                     SET display_name = display_name
+                                   WHERE id = 1""")
+            call_after_commit(lambda: calls.append('committed'))
+            connection.commit()
+        assert calls == []
+        app.process_response(Response())
+        assert calls == ['committed']
+
+
+def test_after_commit_callback_is_dropped_on_rollback():
+    app = create_app({'TESTING': True})
+    calls = []
+    with app.test_request_context('/', method='POST'):
+        with get_db_connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("""UPDATE users
+                                     SET display_name = display_name
+                                   WHERE id = 1""")
+            call_after_commit(lambda: calls.append('committed'))
+    assert calls == []
+
+
+def test_after_commit_callback_outside_a_request_waits_for_its_connection():
+    calls = []
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("""UPDATE users
+                                 SET display_name = display_name
+                               WHERE id = 1""")
+        call_after_commit(lambda: calls.append('committed'), connection)
+        assert calls == []
+        connection.commit()
+    assert calls == ['committed']
+    call_after_commit(lambda: calls.append('now'))
+    assert calls == ['committed', 'now']
@@ -0,0 +1,52 @@
+from app import create_app
+from follower_management import add_follower_pair, remove_follower_pair
+from rating_management import add_rating, remove_rating
+
+
+def sign_in(username, pin):
+    client = create_app({'TESTING': True}).test_client()
+    client.post('/signin', data={'username': username, 'pin': pin})
+    return client
+
+
+def revalidate(client, path, etag):
+    return client.get(path, headers={'If-None-Match': etag})
+
+
+def test_unchanged_book_page_is_answered_with_304():
+    client = sign_in('emma', '5678')
+    response = client.get('/books/3')
+    etag = response.headers['ETag']
+    assert response.status_code == 200
+    assert 'Cookie' in response.headers['Vary']
+    revalidated = revalidate(client, '/books/3', etag)
+    assert (revalidated.status_code, revalidated.data) == (304, b'')
+    assert revalidated.headers['ETag'] == etag
+    assert revalidate(client, '/books/3?page=', etag).status_code == 200   # Other query values, another page
+    assert revalidate(sign_in('emily', '1234'), '/books/3', etag).status_code == 200
+    assert client.get('/books/404').headers.get('ETag') is None
+
+
+def test_rating_a_book_changes_its_page_tag():
+    client = sign_in('emma', '5678')
+    etag = client.get('/books/4').headers['ETag']
+    add_rating(5, 4, 1, 'Not radical at all')
+    try:
+        response = revalidate(client, '/books/4', etag)
+        assert response.status_code == 200
+        assert b'Not radical at all' in response.data
+        etag = response.headers['ETag']
+    finally:
+        remove_rating(5, 4)
+    assert revalidate(client, '/books/4', etag).status_code == 200
+
+
+def test_following_a_user_changes_their_page_tag():
+    client = sign_in('emma', '5678')
+    etag = client.get('/users/6').headers['ETag']
+    assert revalidate(client, '/users/6', etag).status_code == 304
+    add_follower_pair(2, 6)
+    try:
+        assert revalidate(client, '/users/6', etag).status_code == 200
+    finally:
+        remove_follower_pair(2, 6)
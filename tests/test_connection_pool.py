@@ -0,0 +1,93 @@
+from threading import Event, Thread
+
+import pytest
+
+from config import DB_SQLITE_PATH
+from db_management import ConnectionPool, PoolBusyError, PoolTimeoutError, get_db_connection, get_db_pool
+
+
+def create_pool(size=1, max_overflow=1, timeout=0.1):
+    return ConnectionPool({'database': DB_SQLITE_PATH}, size=size, max_overflow=max_overflow, timeout=timeout,
+                          recycle=3600, idle_timeout=300, pre_ping=True)
+
+
+def test_connections_are_reused():
+    pool = create_pool()
+    for _ in range(3):
+        with pool.acquire() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+                assert cursor.fetchone()[0] == 1
+    stats = pool.stats()
+    assert (stats['connects'], stats['checkouts'], stats['idle'], stats['checked_out']) == (1, 3, 1, 0)
+
+
+def test_overflow_connections_are_opened_then_closed():
+    pool = create_pool(size=1, max_overflow=2)
+    connections = [pool.acquire() for _ in range(3)]
+    assert pool.stats()['overflow'] == 2
+    for connection in connections:
+        connection.close()
+    assert pool.stats()['open'] == 1
+
+
+def test_checkout_times_out_when_every_connection_is_checked_out():
+    pool = create_pool()
+    connections = [pool.acquire() for _ in range(2)]
+    with pytest.raises(PoolTimeoutError):
+        pool.acquire()
+    assert pool.stats()['timeouts'] == 1
+    with pytest.raises(PoolBusyError):
+        pool.acquire(wait=False)
+    assert pool.stats()['busy'] == 1
+    for connection in connections:
+        connection.close()
+
+
+def test_waiting_checkout_gets_a_released_connection():
+    pool = create_pool(size=1, max_overflow=0, timeout=5)
+    connection = pool.acquire()
+    waiting, acquired = Event(), []
+
+    def acquire():
+        waiting.set()
+        with pool.acquire():
+            acquired.append(True)
+
+    thread = Thread(target=acquire)
+    thread.start()
+    waiting.wait()
+    connection.close()
+    thread.join()
+    assert acquired == [True]
+    assert pool.stats()['connects'] == 1
+
+
+def test_returned_connection_cannot_be_used():
+    pool = create_pool()
+    connection = pool.acquire()
+    connection.close()
+    with pytest.raises(Exception):
+        connection.cursor()
+
+
+def test_fan_out_runs_in_the_request_when_the_pool_is_full():
+    from app import create_app
+    from async_management import fan_out
+    from book_management import get_book_details
+
+    pool = get_db_pool()
+    with create_app({'TESTING': True}).app_context():
+        get_db_connection()
+        held = []
+        while True:
+            try:
+                held.append(pool.acquire(wait=False))
+            except PoolBusyError:
+                break
+        try:
+            first_book, second_book = fan_out((get_book_details, 1), (get_book_details, 2))
+        finally:
+            for connection in held:
+                connection.close()
+    assert (first_book['id'], second_book['id']) == (1, 2)
@@ -0,0 +1,80 @@
+from random import Random
+
+from flask import Response
+
+from app import create_app
+from follower_management import add_follower_pair, remove_follower_pair
+from graph_management import CsrAdjacency, follows, warm_follower_graph
+from session_management import SESSION_COOKIE_NAME, create_session
+
+
+def build(edges, batch_size=3):
+    edges = sorted(edges)
+    return CsrAdjacency.from_sorted_batches(edges[start:start + batch_size] for start in range(0, len(edges), batch_size))
+
+
+def assert_matches(adjacency, edges, node_count):
+    for node in range(node_count + 2):
+        targets = sorted(target for source, target in edges if source == node)
+        assert list(adjacency.neighbours(node)) == targets
+        assert adjacency.degree(node) == len(targets)
+        for target in range(node_count + 2):
+            assert adjacency.contains(node, target) == ((node, target) in edges)
+
+
+def test_from_sorted_batches():
+    edges = {(1, 2), (1, 5), (3, 1), (5, 0), (5, 1), (5, 4)}
+    adjacency = build(edges)
+    assert list(adjacency.offsets) == [0, 0, 2, 2, 3, 3, 6]
+    assert adjacency.node_count == 6
+    assert_matches(adjacency, edges, 6)
+
+
+def test_empty_graph():
+    adjacency = CsrAdjacency.from_sorted_batches([])
+    assert adjacency.node_count == 0
+    assert adjacency.degree(3) == 0
+    assert not adjacency.contains(0, 0)
+
+
+def test_merged_matches_a_rebuild():
+    random = Random(0)
+    edges = {(random.randrange(30), random.randrange(30)) for _ in range(200)}
+    original_edges = set(edges)
+    adjacency = build(edges)
+    changes = {}
+    for _ in range(100):
+        edge = (random.randrange(40), random.randrange(40))     # Some past the current last node
+        is_edge = random.random() < 0.5
+        changes.setdefault(edge[0], {})[edge[1]] = is_edge
+        if is_edge:
+            edges.add(edge)
+        else:
+            edges.discard(edge)
+    merged = adjacency.merged(changes)
+    assert_matches(merged, edges, 40)
+    assert_matches(adjacency, original_edges, 30)   # The arrays being read are left alone
+
+
+def test_follows_are_applied_once_committed():
+    warm_follower_graph()
+    app = create_app({'TESTING': True})
+    with app.test_request_context('/users/2/follow', method='POST'):
+        add_follower_pair(5, 2)
+        assert not follows(5, 2)
+    assert not follows(5, 2)   # Rolled back
+    with app.test_request_context('/users/2/follow', method='POST'):
+        add_follower_pair(5, 2)
+        app.process_response(Response())
+    assert follows(5, 2)
+    remove_follower_pair(5, 2)
+    assert not follows(5, 2)
+
+
+def test_feed_suggests_users_followed_by_followed_users():
+    warm_follower_graph()
+    client = create_app({'TESTING': True}).test_client()
+    client.set_cookie(SESSION_COOKIE_NAME, create_session(1))
+    page = client.get('/').get_data(as_text=True)
+    assert 'Who to follow' in page
+    assert '@omotola' in page and '@emma' not in page.split('Who to follow')[1].split('</p>')[0]
@@ -0,0 +1,36 @@
+from jinja2 import Environment
+
+from app import create_app
+from fragment_cache import FragmentCacheExtension, get_fragment_cache_stats
+from rating_management import add_rating, remove_rating
+
+
+def get_counts(name):
+    return get_fragment_cache_stats()['fragments'].get(name, {'hits': 0, 'misses': 0})
+
+
+def test_fragments_are_rendered_once_per_key():
+    template = Environment(autoescape=True, extensions=[FragmentCacheExtension]).from_string(
+        "{% cache 'test_card', card_id, version %}{{ text }}{% endcache %}")
+    assert template.render(card_id=1, version=1, text='first') == 'first'
+    assert template.render(card_id=1, version=1, text='ignored') == 'first'
+    assert template.render(card_id=1, version=2, text='second') == 'second'
+    assert template.render(card_id=2, version=1, text='<b>other</b>') == '&lt;b&gt;other&lt;/b&gt;'
+    assert get_counts('test_card') == {'hits': 1, 'misses': 3, 'hit_rate': 0.25}
+
+
+def test_rating_cards_are_reused_until_the_rating_changes():
+    client = create_app({'TESTING': True}).test_client()
+    client.post('/signin', data={'username': 'emma', 'pin': '5678'})
+    client.get('/books/4')
+    hits = get_counts('book_rating')['hits']
+    client.get('/books/4?page=')
+    assert get_counts('book_rating')['hits'] > hits
+    add_rating(5, 4, 2, 'Radical, but only just')
+    try:
+        assert b'Radical, but only just' in client.get('/books/4').data
+        add_rating(5, 4, 3, 'Radical after all')
+        page = client.get('/books/4').data
+        assert b'Radical after all' in page and b'only just' not in page
+    finally:
+        remove_rating(5, 4)
@@ -0,0 +1,46 @@
+from collections import Counter
+from datetime import datetime
+from random import Random
+
+from generate_data import FileWriter, PowerLaw, generate_books, generate_followers, generate_ratings, generate_users
+
+
+def generate(seed):
+    return (list(generate_users(200, Random(f'{seed}:users'))),
+            list(generate_books(80, Random(f'{seed}:books'))),
+            list(generate_followers(200, 5, Random(f'{seed}:followers'))),
+            list(generate_ratings(200, 80, 2000, Random(f'{seed}:ratings'))))
+
+
+def test_same_seed_generates_the_same_data():
+    assert generate(3) == generate(3)
+    assert generate(3) != generate(4)
+
+
+def test_generated_rows_fit_the_schema():
+    users, books, followers, ratings = generate(0)
+    assert len({username for _, username, _, _, _ in users}) == len(users) == 200
+    assert len({isbn for _, _, _, isbn in books if isbn}) == sum(1 for book in books if book[3])
+    assert len(set(followers)) == len(followers)
+    assert all(follower_user_id != followed_user_id and 1 <= followed_user_id <= 200
+               for follower_user_id, followed_user_id in followers)
+    assert len({(user_id, book_id) for user_id, book_id, *_ in ratings}) == len(ratings)
+    assert all(1 <= book_id <= 80 and 1 <= score <= 5 for _, book_id, score, _, _ in ratings)
+
+
+def test_power_law_favours_a_few_ids():
+    popularity = PowerLaw(1000, 1.1, Random(0))
+    picks = Counter(book_id for _ in range(2000) for book_id in popularity.sample(1))
+    top_ten_share = sum(count for _, count in picks.most_common(10)) / 2000
+    assert top_ten_share > 0.3
+    assert popularity.sample(5000) == list(range(1, 1001))
+
+
+def test_file_writer_escapes_values_for_load_data(tmp_path):
+    writer = FileWriter(str(tmp_path), 'instabook', batch_size=1)
+    rows = [(1, 2, 5, 'Tabs\tand\nnewlines \\ all', datetime(2024, 1, 2, 3, 4, 5)), (1, 3, 4, None, datetime(2024, 1, 2))]
+    assert list(writer.write('book_ratings', rows)) == [1, 1, 0]
+    writer.finish()
+    assert (tmp_path / 'book_ratings.tsv').read_text() == ('1\t2\t5\tTabs\\tand\\nnewlines \\\\ all\t2024-01-02 03:04:05\n'
+                                                           '1\t3\t4\t\\N\t2024-01-02 00:00:00\n')
+    assert 'LOAD DATA LOCAL INFILE' in (tmp_path / 'load_data.sql').read_text()
@@ -0,0 +1,76 @@
+import io
+import json
+
+import pytest
+
+from book_management import search_books
+from db_management import get_db_connection
+from import_books import import_books, load_checkpoint, read_rows
+
+CATALOG = [
+    {'title': 'Imported Anthology of Spoons', 'author': 'A. Ladle', 'isbn': '9780000000101'},
+    {'title': '', 'author': 'Nobody', 'isbn': '9780000000102'},
+    {'title': 'Imported Spoons, Again', 'author': 'A. Ladle', 'isbn': '9780000000101'},
+    {'title': 'Imported Forks', 'author': 'B. Tine', 'isbn': '123'},
+    'Row is not a JSON object',
+    {'title': 'Imported Knives', 'author': 'C. Edge', 'isbn': '9780000000103'},
+    {'title': 'Imported Napkins', 'author': None, 'isbn': None},
+]
+
+
+@pytest.fixture
+def catalog_path(tmp_path):
+    path = tmp_path / 'catalog.jsonl'
+    path.write_text(''.join((json.dumps(row) if isinstance(row, dict) else 'not json') + '\n' for row in CATALOG))
+    yield str(path)
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("""DELETE
+                                FROM book_search_tokens
+                               WHERE book_id IN (SELECT b.id
+                                                   FROM books AS b
+                                                  WHERE b.title LIKE 'Imported %%')""")
+            cursor.execute("""DELETE
+                                FROM books
+                               WHERE title LIKE 'Imported %%'""")
+            connection.commit()
+
+
+def get_imported_titles():
+    books, _ = search_books('imported', page_size=10)
+    return sorted(book['title'] for book in books)
+
+
+def run_import(rows, catalog_path, rejects_file):
+    checkpoint_path = catalog_path + '.checkpoint'
+    checkpoint = load_checkpoint(checkpoint_path, catalog_path)
+    with get_db_connection() as connection:
+        import_books(rows, connection, checkpoint, checkpoint_path, rejects_file, batch_size=3)
+    return checkpoint
+
+
+def stop_after(rows, count):
+    for row_number, row in enumerate(rows):
+        if row_number == count:
+            raise KeyboardInterrupt
+        yield row
+
+
+def test_import_indexes_valid_books_and_lists_the_rest(catalog_path):
+    rejects_file = io.StringIO()
+    checkpoint = run_import(read_rows(catalog_path, 'jsonl'), catalog_path, rejects_file)
+    assert (checkpoint['rows_read'], checkpoint['imported'], checkpoint['rejected']) == (7, 3, 4)
+    assert get_imported_titles() == ['Imported Anthology of Spoons', 'Imported Knives', 'Imported Napkins']
+    assert [line.split(',')[0] for line in rejects_file.getvalue().splitlines()] == ['2', '3', '4', '5']
+
+
+def test_interrupted_import_resumes_after_the_last_batch(catalog_path):
+    rejects_file = io.StringIO()
+    with pytest.raises(KeyboardInterrupt):
+        run_import(stop_after(read_rows(catalog_path, 'jsonl'), 4), catalog_path, rejects_file)
+    assert get_imported_titles() == ['Imported Anthology of Spoons']
+    checkpoint = run_import(read_rows(catalog_path, 'jsonl'), catalog_path, rejects_file)
+    assert (checkpoint['rows_read'], checkpoint['imported'], checkpoint['rejected']) == (7, 3, 4)
+    assert get_imported_titles() == ['Imported Anthology of Spoons', 'Imported Knives', 'Imported Napkins']
+    with pytest.raises(SystemExit):
+        load_checkpoint(catalog_path + '.checkpoint', 'another.csv')
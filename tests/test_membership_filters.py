@@ -0,0 +1,25 @@
+from membership_management import BloomFilter
+
+
+def test_added_values_are_always_found():
+    bloom_filter = BloomFilter(1000, 0.01)
+    values = [f'user{number}' for number in range(1000)]
+    for value in values:
+        bloom_filter.add(value)
+    assert all(value in bloom_filter for value in values)
+    assert bloom_filter.item_count == 1000
+
+
+def test_false_positive_rate_is_near_the_target():
+    bloom_filter = BloomFilter(1000, 0.01)
+    for number in range(1000):
+        bloom_filter.add(f'user{number}')
+    false_positives = sum(f'other{number}' in bloom_filter for number in range(10000))
+    assert false_positives / 10000 < 0.03
+    assert 0.005 < bloom_filter.get_false_positive_rate() < 0.02
+
+
+def test_empty_filter_contains_nothing():
+    bloom_filter = BloomFilter(0, 0.01)
+    assert 'anything' not in bloom_filter
+    assert bloom_filter.get_false_positive_rate() == 0
@@ -0,0 +1,40 @@
+import subprocess
+import sys
+
+from app import create_app
+from metrics_management import QueryStats, get_fingerprint, get_query_metrics, record_query
+from session_management import SESSION_COOKIE_NAME, create_session
+from tests.conftest import CONFIG_OVERRIDES
+
+
+def test_fingerprints_hide_values():
+    assert get_fingerprint("SELECT * FROM users WHERE id IN (1, 2, 3) AND username = 'emily'") == \
+        get_fingerprint('SELECT * FROM users\n WHERE id IN (%s, %s) AND username = %s') == \
+        'SELECT * FROM users WHERE id IN (?+) AND username = ?'
+
+
+def test_query_stats_keep_the_slowest_statement():
+    query_stats = QueryStats()
+    record_query('SELECT 1', 0.002, query_stats)
+    record_query('SELECT 2', 0.001, query_stats)
+    assert (query_stats.count, query_stats.slowest_fingerprint) == (2, 'SELECT ?')
+    assert round(query_stats.duration, 6) == 0.003
+
+
+def test_responses_report_their_queries():
+    client = create_app({'TESTING': True}).test_client()
+    client.set_cookie(SESSION_COOKIE_NAME, create_session(1))
+    requests = get_query_metrics()['requests']
+    response = client.get('/books/1')
+    assert response.headers['Server-Timing'].startswith('db;dur=')
+    assert int(response.headers['X-Query-Count']) > 0
+    assert get_query_metrics()['requests'] == requests + 1
+
+
+def test_scripts_do_not_print_slow_queries():
+    script = CONFIG_OVERRIDES + ('config.DB_SLOW_QUERY_THRESHOLD = 0\n'
+                                 'from book_management import get_book_details\n'
+                                 'get_book_details(1)\n')
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stderr == ''
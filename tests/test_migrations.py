@@ -0,0 +1,40 @@
+import sqlite3
+
+from tests.conftest import DATABASE_DIR, create_schema
+from config import DB_SQLITE_PATH
+from migration_management import get_migration_status, get_migrations, migrate
+
+
+def get_schema(path):
+    with sqlite3.connect(path) as connection:
+        objects = connection.execute("""SELECT type, name, tbl_name, sql
+                                          FROM sqlite_master
+                                         WHERE name NOT LIKE 'sqlite_%'""")
+        # A table renamed by a migration has its name quoted
+        return sorted((type, name, table, sql.replace(f'"{name}"', name)) for type, name, table, sql in objects)
+
+
+def test_migrations_are_numbered_in_order():
+    versions = [migration.version for migration in get_migrations()]
+    assert versions == list(range(1, len(versions) + 1))
+
+
+def test_schema_records_every_migration():
+    assert all(status['applied_at'] is not None for status in get_migration_status())
+    assert migrate() == []
+
+
+def test_migrations_round_trip_to_the_schema():
+    saved = sqlite3.connect(':memory:')
+    with sqlite3.connect(DB_SQLITE_PATH) as connection:
+        connection.backup(saved)    # Migrating down drops the data the other tests use
+    try:
+        migrated_count = len(get_migrations())
+        assert [direction for direction, _ in migrate(0)] == ['down'] * migrated_count
+        assert [direction for direction, _ in migrate()] == ['up'] * migrated_count
+        fresh_path = f'{DATABASE_DIR}/fresh.sqlite3'
+        create_schema(fresh_path)
+        assert get_schema(DB_SQLITE_PATH) == get_schema(fresh_path)
+    finally:
+        with sqlite3.connect(DB_SQLITE_PATH) as connection:
+            saved.backup(connection)
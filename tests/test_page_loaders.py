@@ -0,0 +1,57 @@
+from book_management import get_book_details, get_book_page
+from follower_management import follower_pair_exists
+from metrics_management import QueryStats, bind_query_stats
+from rating_management import add_rating, get_book_rating_for_user, get_recent_book_ratings, get_recent_user_ratings, \
+    remove_rating
+from user_management import get_user_details, get_user_page
+
+
+def load_every_page(get_page, *args):
+    """Loads a page at a time, two ratings long, and counts the statements each load executes."""
+    pages, page_token, statement_counts = [], None, []
+    while True:
+        query_stats = QueryStats()
+        page = bind_query_stats(get_page, query_stats)(*args, page_token, 2)
+        statement_counts.append(query_stats.count)
+        pages.append(page)
+        if (page_token := page['next_page_token']) is None:
+            return pages, statement_counts
+
+
+def test_book_page_matches_the_separate_lookups():
+    add_rating(1, 2, 4, 'Better than the film')
+    add_rating(3, 2, 2, 'Worse than the film')
+    try:
+        pages, statement_counts = load_every_page(get_book_page, 2, 1)
+        assert statement_counts == [1] * len(pages)
+        assert all(page['book_details'] == get_book_details(2) for page in pages)
+        assert all(page['current_user_rating'] == get_book_rating_for_user(2, 1) for page in pages)
+        ratings, page_token = get_recent_book_ratings(2, page_size=2)
+        for page in pages:
+            assert page['book_ratings'] == ratings
+            if page_token is not None:
+                ratings, page_token = get_recent_book_ratings(2, page_token, 2)
+        assert get_book_page(404, 1) is None
+    finally:
+        remove_rating(1, 2)
+        remove_rating(3, 2)
+
+
+def test_user_page_matches_the_separate_lookups():
+    add_rating(2, 1, 5, 'Bracelets galore')
+    add_rating(2, 6, 3, 'Chairs, mostly')
+    try:
+        pages, statement_counts = load_every_page(get_user_page, 2, 1)
+        assert statement_counts == [1] * len(pages)
+        assert all(page['user_details'] == get_user_details(2) for page in pages)
+        assert all(page['current_user_follows_user'] is follower_pair_exists(1, 2) for page in pages)
+        assert pages[0]['user_stats']['rating_count'] == sum(len(page['user_ratings']) for page in pages)
+        ratings, page_token = get_recent_user_ratings(2, page_size=2)
+        for page in pages:
+            assert page['user_ratings'] == ratings
+            if page_token is not None:
+                ratings, page_token = get_recent_user_ratings(2, page_token, 2)
+        assert get_user_page(404, 1) is None
+    finally:
+        remove_rating(2, 1)
+        remove_rating(2, 6)
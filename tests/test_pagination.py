@@ -0,0 +1,37 @@
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from pagination import InvalidPageToken, decode_page_token, encode_page_token, get_page, get_recency_condition
+
+
+def test_page_tokens_round_trip():
+    token = encode_page_token([Decimal(3), datetime(2024, 5, 6, 7, 8, 9, 123456), 42])
+    assert decode_page_token(token, 3) == [3, '2024-05-06 07:08:09.123456', 42]
+
+
+@pytest.mark.parametrize('token', ['not a token!', 'bnVsbA', encode_page_token([1]), encode_page_token([1.5, 2])])
+def test_malformed_page_tokens_are_rejected(token):
+    with pytest.raises(InvalidPageToken):
+        decode_page_token(token, 2)
+
+
+def test_first_page_has_no_token():
+    assert decode_page_token(None, 2) is None
+    assert decode_page_token('', 2) is None
+
+
+def test_get_page_uses_the_extra_row_to_tell_whether_there_is_a_next_page():
+    rows = [{'id': id, 'score': 10 - id} for id in range(4)]
+    page, token = get_page(rows, 3, ['score', 'id'])
+    assert page == rows[:3]
+    assert decode_page_token(token, 2) == [8, 2]
+    assert get_page(rows, 4, ['score', 'id']) == (rows, None)
+
+
+def test_recency_condition():
+    assert get_recency_condition(None, 'r.rated_at', 'r.user_id') == ('TRUE', [])
+    condition, params = get_recency_condition(['2024-01-01', 7], 'r.rated_at', 'r.user_id')
+    assert condition == '((r.rated_at < %s) OR (r.rated_at = %s AND r.user_id < %s))'
+    assert params == ['2024-01-01', '2024-01-01', 7]
@@ -0,0 +1,28 @@
+from threading import Thread
+
+from db_management import get_db_connection
+from metrics_management import capture_statements
+from query_plan_management import find_full_scans
+
+
+def select(statement):
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(statement)
+            cursor.fetchall()
+
+
+def test_capture_leaves_out_other_threads():
+    with capture_statements() as statements:
+        select('SELECT COUNT(*) FROM books')
+        thread = Thread(target=select, args=('SELECT COUNT(*) FROM users',))
+        thread.start()
+        thread.join()
+    select('SELECT COUNT(*) FROM followers')
+    assert list(statements) == ['SELECT COUNT(*) FROM books']
+
+
+def test_page_queries_are_explained():
+    full_scans, statement_count = find_full_scans()
+    assert statement_count > 30
+    assert full_scans == []     # The sample tables are all smaller than QUERY_PLAN_LARGE_TABLE_ROWS
@@ -0,0 +1,43 @@
+from book_management import get_book_details
+from db_management import get_db_connection
+from rating_management import add_rating, rebuild_book_rating_stats, remove_rating, verify_book_rating_stats
+
+
+def get_rating_stats(book_id):
+    with get_db_connection() as connection:
+        with connection.cursor(dictionary=True) as cursor:
+            cursor.execute("""SELECT s.rating_count, s.score_sum, s.score_1_count, s.score_5_count
+                                FROM book_rating_stats AS s
+                               WHERE s.book_id = %s""", [book_id])
+            return cursor.fetchone()
+
+
+def test_aggregates_follow_ratings_as_they_change():
+    before = get_rating_stats(5)
+    add_rating(1, 5, 1, 'Too many hats')
+    try:
+        add_rating(2, 5, 5, 'Not enough hats')
+        add_rating(1, 5, 5, 'Came round to the hats')     # A new score for the same rating
+        stats = get_rating_stats(5)
+        assert stats['rating_count'] == before['rating_count'] + 2
+        assert stats['score_sum'] == before['score_sum'] + 10
+        assert (stats['score_1_count'], stats['score_5_count']) == (before['score_1_count'], before['score_5_count'] + 2)
+        assert get_book_details(5)['rating_count'] == stats['rating_count']
+        assert verify_book_rating_stats() == []
+    finally:
+        remove_rating(1, 5)
+        remove_rating(2, 5)
+    assert get_rating_stats(5) == before
+    assert verify_book_rating_stats() == []
+
+
+def test_verify_finds_stale_aggregates_and_rebuild_fixes_them():
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("""UPDATE book_rating_stats
+                                 SET score_sum = score_sum + 1
+                               WHERE book_id IN (1, 3)""")
+            connection.commit()
+    assert verify_book_rating_stats() == [1, 3]
+    rebuild_book_rating_stats()
+    assert verify_book_rating_stats() == []
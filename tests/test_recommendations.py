@@ -0,0 +1,79 @@
+from array import array
+from random import Random
+
+import pytest
+from flask import Response
+
+import recommendation_management
+from app import create_app
+from db_management import get_db_connection
+from rating_management import add_rating, remove_rating
+from recommendation_management import get_recommended_books, rebuild_book_neighbours, refresh_stale_neighbours
+
+
+def get_stored_neighbours():
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("""SELECT n.book_id, n.neighbour_book_id, ROUND(n.similarity, 4)
+                                FROM book_neighbours AS n
+                            ORDER BY n.book_id, n.neighbour_book_id""")
+            return cursor.fetchall()
+
+
+def get_stale_book_ids():
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("""SELECT x.book_id
+                                FROM stale_book_neighbours AS x""")
+            return [book_id for book_id, in cursor.fetchall()]
+
+
+def test_vectorized_neighbours_match_plain_python():
+    pytest.importorskip('numpy')
+    pytest.importorskip('scipy.sparse')
+    random = Random(19)
+    likes = {(random.randrange(1, 60), random.randrange(1, 40)) for _ in range(600)}
+    user_ids, book_ids = array('i', [user_id for user_id, _ in likes]), array('i', [book_id for _, book_id in likes])
+
+    def rounded(all_neighbours):
+        return [(book_id, [(neighbour_book_id, round(similarity, 4)) for neighbour_book_id, similarity in neighbours])
+                for book_id, neighbours in all_neighbours]
+
+    expected = rounded(recommendation_management._compute_neighbours(user_ids, book_ids))
+    assert rounded(recommendation_management._compute_neighbours_vectorized(user_ids, book_ids, 7)) == expected
+
+
+def test_refresh_is_scheduled_once_the_rating_is_committed(monkeypatch):
+    seen_stale_book_ids = []
+    monkeypatch.setattr(recommendation_management, 'schedule_neighbour_refresh',
+                        lambda: seen_stale_book_ids.append(get_stale_book_ids()))
+    app = create_app({'TESTING': True})
+    with app.test_request_context('/books/2/rate', method='POST'):
+        add_rating(1, 2, 5, 'Worth every bracelet')
+        assert seen_stale_book_ids == []
+        app.process_response(Response())
+    assert seen_stale_book_ids == [[2]]
+    refresh_stale_neighbours()
+    remove_rating(1, 2)     # Outside a request too
+    assert seen_stale_book_ids == [[2], [2]]
+    refresh_stale_neighbours()
+    assert get_stale_book_ids() == []
+
+
+def test_refresh_matches_a_rebuild(monkeypatch):
+    monkeypatch.setattr(recommendation_management, 'schedule_neighbour_refresh', lambda: None)
+    rebuild_book_neighbours()
+    add_rating(3, 2, 5, 'Shiny')
+    add_rating(3, 3, 4, 'Sparkling')
+    try:
+        refresh_stale_neighbours()
+        assert [book['id'] for book in get_recommended_books(2)] == [3]
+        refreshed = get_stored_neighbours()
+        rebuild_book_neighbours()
+        assert get_stored_neighbours() == refreshed
+    finally:
+        remove_rating(3, 2)
+        remove_rating(3, 3)
+    refresh_stale_neighbours()
+    assert get_recommended_books(2) == []
+    assert get_stored_neighbours() == []
@@ -0,0 +1,70 @@
+import sqlite3
+from time import sleep, time
+
+from flask import Response
+
+import db_management
+from app import create_app
+from config import DB_SQLITE_PATH
+from db_management import PRIMARY_STICKY_COOKIE_NAME, ConnectionPool, ReplicaSet, get_db_connection, \
+    should_read_from_primary
+
+
+def create_pool(path):
+    return ConnectionPool({'database': path}, size=1, max_overflow=0, timeout=1, recycle=3600, idle_timeout=300,
+                          pre_ping=False)
+
+
+def copy_primary(replica_path):
+    """Brings the replica up to date with the primary, as replication would."""
+    with sqlite3.connect(DB_SQLITE_PATH) as primary, sqlite3.connect(replica_path) as replica:
+        primary.backup(replica)
+
+
+def test_replicas_join_and_leave_the_rotation_by_their_lag(tmp_path):
+    replica_path = str(tmp_path / 'replica.sqlite3')
+    copy_primary(replica_path)
+    replica_set = ReplicaSet(create_pool(DB_SQLITE_PATH), [create_pool(replica_path)], max_lag=60, check_interval=3600)
+    replica_set._is_checking = True     # Checked by hand below, rather than on a background thread
+    assert replica_set.acquire() is None
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("""DELETE
+                                FROM replication_heartbeat""")
+            connection.commit()
+    assert replica_set.check()[0]['error'] == 'no heartbeat yet'
+    copy_primary(replica_path)
+    sleep(0.01)     # So that the next heartbeat is a few milliseconds ahead of the copied one
+    [replica] = replica_set.check()
+    assert (replica['in_rotation'], replica['lag_seconds']) == (True, 0.0)
+    with replica_set.acquire():
+        assert replica_set.stats()[0]['pool']['checked_out'] == 1
+    replica_set.max_lag = 0.001
+    [replica] = replica_set.check()
+    assert (replica['in_rotation'], replica['removals']) == (False, 1)
+    assert replica['lag_seconds'] > 0.001
+    assert replica_set.acquire() is None
+
+
+def test_reads_stick_to_the_primary_after_a_write(monkeypatch):
+    monkeypatch.setattr(db_management, 'DB_REPLICAS', [{'database': 'replica'}])
+    app = create_app({'TESTING': True})
+    with app.test_request_context('/books/1'):
+        assert not should_read_from_primary()
+    with app.test_request_context('/books/1/rate', method='POST'):
+        assert should_read_from_primary()
+    with app.test_request_context('/books/1', headers={'Cookie': f'{PRIMARY_STICKY_COOKIE_NAME}={time() + 5}'}):
+        assert should_read_from_primary()
+    with app.test_request_context('/books/1', headers={'Cookie': f'{PRIMARY_STICKY_COOKIE_NAME}={time() - 1}'}):
+        assert not should_read_from_primary()
+    with app.test_request_context('/books/1'):
+        with get_db_connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("""UPDATE users
+                                     SET display_name = display_name
+                                   WHERE id = 1""")
+            connection.commit()
+        assert should_read_from_primary()
+        response = app.process_response(Response())
+        assert should_read_from_primary()
+    assert PRIMARY_STICKY_COOKIE_NAME in response.headers['Set-Cookie']
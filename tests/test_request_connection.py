@@ -0,0 +1,57 @@
+from flask import Response
+
+from app import create_app
+from db_management import get_db_connection, get_db_pool
+from follower_management import add_follower_pair, remove_follower_pair
+from rating_management import add_rating, get_book_rating_for_user, remove_rating
+
+
+def count_committed_writes():
+    """Counts the rows the writes below leave, from a connection of its own, as another request would."""
+    with get_db_pool().acquire() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("""SELECT (SELECT COUNT(*)
+                                        FROM followers AS f
+                                       WHERE f.follower_user_id = 1
+                                         AND f.followed_user_id = 4)
+                                   + (SELECT COUNT(*)
+                                        FROM book_ratings AS r
+                                       WHERE r.user_id = 1
+                                         AND r.book_id = 4)""")
+            return cursor.fetchone()[0]
+
+
+def test_request_writes_are_committed_together_once_it_is_done():
+    app = create_app({'TESTING': True})
+    try:
+        with app.test_request_context('/users/4/follow', method='POST'):
+            add_follower_pair(1, 4)
+            add_rating(1, 4, 3, 'Pencil-shaped')
+            assert get_db_connection() is get_db_connection()
+            assert get_book_rating_for_user(4, 1)['score'] == 3     # The request sees its own writes
+            assert count_committed_writes() == 0
+            app.process_response(Response())
+            assert count_committed_writes() == 2
+    finally:
+        remove_follower_pair(1, 4)
+        remove_rating(1, 4)
+
+
+def test_request_that_fails_rolls_back_all_of_its_writes():
+    app = create_app({'TESTING': True})
+    with app.test_request_context('/users/4/follow', method='POST'):
+        add_follower_pair(1, 4)
+        add_rating(1, 4, 3, 'Pencil-shaped')
+    assert count_committed_writes() == 0
+    assert get_db_pool().stats()['checked_out'] == 0
+
+
+def test_rating_a_book_again_replaces_the_rating():
+    add_rating(1, 4, 2, 'Blunt')
+    try:
+        add_rating(1, 4, 5, 'Sharpened')
+        assert get_book_rating_for_user(4, 1) == {'score': 5, 'review': 'Sharpened'}
+        assert count_committed_writes() == 1
+    finally:
+        remove_rating(1, 4)
+    assert get_book_rating_for_user(4, 1) is None
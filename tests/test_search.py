@@ -0,0 +1,73 @@
+import search_management
+from book_management import add_book, search_books
+from db_management import get_db_connection
+from search_management import rebuild_search_index, tokenize
+from user_management import search_users
+
+
+def get_titles(query, page_size=10):
+    books, page_token = search_books(query, page_size=page_size)
+    while page_token is not None:
+        page, page_token = search_books(query, page_token, page_size)
+        books += page
+    return [book['title'] for book in books]
+
+
+def get_book_index():
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("""SELECT t.token, t.book_id
+                                FROM book_search_tokens AS t
+                            ORDER BY t.book_id, t.token""")
+            indexed = cursor.fetchall()
+            cursor.execute("""SELECT b.id, b.title, b.author
+                                FROM books AS b
+                            ORDER BY b.id""")
+            expected = sorted(((token, book_id) for book_id, title, author in cursor.fetchall()
+                               for token in set(tokenize(title) + tokenize(author))), key=lambda entry: entry[::-1])
+            return indexed, expected
+
+
+def test_tokenize_splits_lowercase_words():
+    assert tokenize("The Tiger, the Wizard and the Dishwasher") == ['the', 'tiger', 'wizard', 'and', 'dishwasher']
+    assert tokenize(None) == []
+
+
+def test_search_ranks_books_matching_more_words_first():
+    rebuild_search_index()
+    assert get_titles('the lord')[0] == 'The Lord of the Bracelets'
+    assert get_titles('pedi') == ['Pride and Pedicures']
+    assert get_titles('the', page_size=1) == ['Ron Weasley and the Bag of Rocks', 'The Lord of the Bracelets',
+                                              'The Tiger, the Wizard and the Dishwasher']
+    assert get_titles('zzz') == []
+    assert [user['username'] for user in search_users('emily')[0]] == ['emily']
+
+
+def test_common_words_do_not_hide_books_matching_every_word(monkeypatch):
+    rebuild_search_index()
+    monkeypatch.setattr(search_management, 'MAX_TERM_MATCHES', 1)
+    assert get_titles('the dishwasher')[0] == 'The Tiger, the Wizard and the Dishwasher'
+    assert get_titles('dishwasher the')[0] == 'The Tiger, the Wizard and the Dishwasher'
+
+
+def test_rebuild_replaces_the_index_batch_by_batch():
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("""INSERT
+                                INTO book_search_tokens (token, book_id)
+                              VALUES ('stale', 1)""")
+            cursor.execute("""DELETE
+                                FROM book_search_tokens
+                               WHERE book_id = 2""")
+            connection.commit()
+    assert get_titles('stale') != []
+    indexed_count = rebuild_search_index(batch_size=2)
+    indexed, expected = get_book_index()
+    assert indexed == expected
+    assert indexed_count == {'books': len({book_id for _, book_id in expected}), 'users': 8}
+    assert get_titles('stale') == []
+
+
+def test_new_books_are_searchable():
+    add_book('The Search for Spock', 'Someone', '9780000000017')
+    assert get_titles('spock') == ['The Search for Spock']
@@ -0,0 +1,51 @@
+import cache_management
+from app import create_app
+from db_management import get_db_connection
+from session_management import SESSION_COOKIE_NAME, create_session, get_session_user_id
+from user_management import set_user_admin
+from config import SESSION_ROLE_TTL
+
+
+def sign_in(client, username, pin):
+    client.post('/signin', data={'username': username, 'pin': pin})
+    return client.get_cookie(SESSION_COOKIE_NAME).value
+
+
+def set_admin_elsewhere(user_id, is_admin):
+    """Changes a user's role the way another worker would, without invalidating this process's cache."""
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("""UPDATE users
+                                 SET is_admin = %s
+                               WHERE id = %s""", [is_admin, user_id])
+            connection.commit()
+
+
+def test_signing_out_ends_the_session():
+    client = create_app({'TESTING': True}).test_client()
+    session_token = sign_in(client, 'emma', '5678')
+    assert get_session_user_id(session_token) == 2
+    assert client.get('/').status_code == 200
+    client.post('/signout')
+    assert get_session_user_id(session_token) is None
+    client.set_cookie(SESSION_COOKIE_NAME, session_token)
+    assert client.get('/').headers['Location'] == '/signin'
+
+
+def test_forged_tokens_are_rejected():
+    assert get_session_user_id('2') is None
+    assert get_session_user_id(create_session(2)[:-1]) is None
+
+
+def test_revoked_admin_role_expires_from_other_workers(monkeypatch):
+    client = create_app({'TESTING': True}).test_client()
+    sign_in(client, 'emily', '1234')
+    assert client.get('/books/add').status_code == 200
+    set_admin_elsewhere(1, False)
+    try:
+        assert client.get('/books/add').status_code == 200   # Still cached
+        now = cache_management.monotonic()
+        monkeypatch.setattr(cache_management, 'monotonic', lambda: now + SESSION_ROLE_TTL + 1)
+        assert client.get('/books/add').headers['Location'] == '/'
+    finally:
+        set_user_admin(1, True)
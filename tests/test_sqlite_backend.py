@@ -0,0 +1,60 @@
+import pytest
+
+from sqlite_backend import connect, run_script, translate, translate_script
+
+
+@pytest.mark.parametrize('mysql, sqlite, is_write', [
+    ('SELECT * FROM users WHERE id = %s', 'SELECT * FROM users WHERE id = ?', False),
+    ('SELECT * FROM users WHERE id = %s FOR UPDATE', 'SELECT * FROM users WHERE id = ?', True),
+    ('INSERT IGNORE INTO followers (a, b) VALUES (%s, %s)', 'INSERT OR IGNORE INTO followers (a, b) VALUES (?, ?)', True),
+    ('INSERT INTO t (id, n) VALUES (%s, %s) ON DUPLICATE KEY UPDATE n = VALUES(n)',
+     'INSERT INTO t (id, n) VALUES (?, ?) ON CONFLICT DO UPDATE SET n = excluded.n', True),
+    ('UPDATE t SET at = CURRENT_TIMESTAMP(6)', "UPDATE t SET at = strftime('%Y-%m-%d %H:%M:%f', 'now')", True),
+    ('SELECT s.score_sum / NULLIF(s.count, 0) FROM s', 'SELECT CAST(s.score_sum AS REAL) / NULLIF(s.count, 0) FROM s', False),
+    ('SELECT CONCAT(a, %s, b) FROM t', 'SELECT (a || ? || b) FROM t', False),
+    ('DROP INDEX by_user ON ratings', 'DROP INDEX by_user', False),
+])
+def test_translate(mysql, sqlite, is_write):
+    assert translate(mysql) == (sqlite, is_write)
+
+
+def test_translate_create_table():
+    statements = translate_script("""CREATE DATABASE instabook;
+USE instabook;
+CREATE TABLE IF NOT EXISTS books (
+    id INTEGER NOT NULL AUTO_INCREMENT,
+    title VARCHAR(100) NOT NULL,
+    added_at DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+
+    PRIMARY KEY (id),
+    INDEX books_by_title (title)
+);
+ALTER TABLE ratings DROP FOREIGN KEY ratings_ibfk_1;""")
+    assert len(statements) == 2
+    assert 'id INTEGER PRIMARY KEY,' in statements[0]
+    assert 'title VARCHAR(100) COLLATE NOCASE NOT NULL' in statements[0]
+    assert "DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))" in statements[0]
+    assert 'PRIMARY KEY (id)' not in statements[0]
+    assert statements[1] == 'CREATE INDEX IF NOT EXISTS books_by_title ON books (title)'
+
+
+def test_connection_behaves_like_mysql(tmp_path):
+    with connect(str(tmp_path / 'test.sqlite3')) as connection:
+        run_script(connection, """CREATE TABLE IF NOT EXISTS counts (
+    name VARCHAR(20) NOT NULL,
+    n INTEGER NOT NULL,
+
+    PRIMARY KEY (name)
+);""")
+        with connection.cursor(dictionary=True) as cursor:
+            upsert = 'INSERT INTO counts (name, n) VALUES (%s, %s) ON DUPLICATE KEY UPDATE n = n + VALUES(n)'
+            cursor.execute(upsert, ['a', 1])
+            assert connection.in_transaction
+            cursor.executemany(upsert, [('A', 2), ('b', 3)])
+            connection.commit()
+            cursor.execute('SELECT name, n FROM counts ORDER BY name')
+            assert cursor.fetchall() == [{'name': 'a', 'n': 3}, {'name': 'b', 'n': 3}]
+            cursor.execute('DELETE FROM counts')
+            connection.rollback()
+            cursor.execute('SELECT COUNT(*) AS count FROM counts')
+            assert cursor.fetchone() == {'count': 2}
@@ -0,0 +1,26 @@
+import json
+import subprocess
+import sys
+
+from maintenance import _STARTUP_TIMER
+from tests.conftest import CONFIG_OVERRIDES
+from config import STARTUP_BUDGET, WARM_UP_BUDGET
+
+
+def test_importing_and_creating_the_app_is_within_budget_and_opens_no_connections():
+    runs = []
+    for _ in range(3):
+        result = subprocess.run([sys.executable, '-c', CONFIG_OVERRIDES + _STARTUP_TIMER], capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+        runs.append(json.loads(result.stdout.splitlines()[-1]))
+    assert max(run['startup_connections'] for run in runs) == 0
+    assert min(run['startup_seconds'] for run in runs) <= STARTUP_BUDGET
+    assert min(run['warm_up_seconds'] for run in runs) <= WARM_UP_BUDGET
+
+
+def test_create_app_opens_no_connections():
+    from app import create_app
+    from db_management import get_db_pool_stats
+    connects = get_db_pool_stats()['connects']
+    create_app({'TESTING': True})
+    assert get_db_pool_stats()['connects'] == connects
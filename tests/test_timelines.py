@@ -0,0 +1,71 @@
+from time import sleep
+
+import timeline_management
+from db_management import get_db_connection
+from rating_management import add_rating, get_recent_followed_user_ratings, remove_rating
+from timeline_management import rebuild_timelines
+
+
+def get_timeline(owner_user_id):
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("""SELECT t.rater_user_id, t.book_id
+                                FROM timeline_entries AS t
+                               WHERE t.owner_user_id = %s
+                            ORDER BY t.rated_at DESC, t.rater_user_id DESC, t.book_id DESC""", [owner_user_id])
+            return cursor.fetchall()
+
+
+def get_followed_user_ratings(user_id):
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("""SELECT r.user_id, r.book_id
+                                FROM followers AS f
+                                JOIN book_ratings AS r
+                                  ON r.user_id = f.followed_user_id
+                               WHERE f.follower_user_id = %s
+                            ORDER BY r.rated_at DESC, r.user_id DESC, r.book_id DESC""", [user_id])
+            return cursor.fetchall()
+
+
+def read_feed(user_id, page_size):
+    ratings, page_token = get_recent_followed_user_ratings(user_id, page_size=page_size)
+    while page_token is not None:
+        page, page_token = get_recent_followed_user_ratings(user_id, page_token, page_size)
+        ratings += page
+    return [(rating['user_id'], rating['book_id']) for rating in ratings]
+
+
+def test_pushes_keep_timelines_capped(monkeypatch):
+    monkeypatch.setattr(timeline_management, 'TIMELINE_LENGTH', 2)
+    monkeypatch.setattr(timeline_management, 'TIMELINE_TRIM_SLACK', 1)
+    timeline_lengths = []
+    try:
+        for book_id in (1, 2, 3, 5):
+            sleep(0.002)    # Ratings made in the same millisecond on SQLite would tie, and be kept together
+            add_rating(3, book_id, 4, 'Another one')  # User 1 follows user 3
+            timeline_lengths.append(len(get_timeline(1)))
+        assert timeline_lengths == [4, 2, 3, 2]     # The sample ratings share a timestamp, so they go together
+        assert get_timeline(1) == [(3, 5), (3, 3)]
+        assert read_feed(1, page_size=2) == get_followed_user_ratings(1)
+    finally:
+        for book_id in (1, 2, 3, 5):
+            remove_rating(3, book_id)
+        monkeypatch.undo()
+        rebuild_timelines()
+
+
+def test_rebuild_recreates_the_pushed_timelines():
+    add_rating(3, 1, 4, 'Rocks, but good ones')
+    try:
+        with get_db_connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("""DELETE
+                                    FROM timeline_entries
+                                   WHERE owner_user_id = 2""")
+                connection.commit()
+        assert rebuild_timelines(batch_size=3) == 8
+        for user_id in range(1, 9):
+            assert get_timeline(user_id) == get_followed_user_ratings(user_id)
+    finally:
+        remove_rating(3, 1)
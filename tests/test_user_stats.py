@@ -0,0 +1,50 @@
+from time import monotonic, sleep
+
+from db_management import get_db_connection
+from follower_management import add_follower_pair, remove_follower_pair
+from rating_management import add_rating, remove_rating
+from user_management import get_user_page, reconcile_user_stats, start_user_stats_reconciler
+
+
+def get_counts(user_id):
+    return get_user_page(user_id, user_id)['user_stats']
+
+
+def drift(user_id):
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("""UPDATE user_stats
+                                 SET follower_count = follower_count + 5
+                               WHERE user_id = %s""", [user_id])
+            connection.commit()
+
+
+def test_writes_keep_the_counts_up_to_date():
+    assert get_counts(8) == {'follower_count': 2, 'following_count': 2, 'rating_count': 2}
+    add_follower_pair(8, 3)
+    add_rating(8, 1, 5, 'Rocks rock')
+    assert get_counts(8) == {'follower_count': 2, 'following_count': 3, 'rating_count': 3}
+    assert get_counts(3)['follower_count'] == 3
+    remove_follower_pair(8, 3)
+    remove_rating(8, 1)
+    assert get_counts(8) == {'follower_count': 2, 'following_count': 2, 'rating_count': 2}
+    assert get_counts(3)['follower_count'] == 2
+
+
+def test_reconcile_fixes_drifted_counts():
+    drift(7)
+    assert reconcile_user_stats(batch_size=3) == [7]
+    assert get_counts(7)['follower_count'] == 2
+    assert reconcile_user_stats() == []
+
+
+def test_reconciler_runs_in_the_background():
+    drift(6)
+    stop = start_user_stats_reconciler(interval=0.01)
+    try:
+        deadline = monotonic() + 5
+        while get_counts(6)['follower_count'] != 2 and monotonic() < deadline:
+            sleep(0.01)
+    finally:
+        stop.set()
+    assert get_counts(6)['follower_count'] == 2
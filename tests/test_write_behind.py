@@ -0,0 +1,105 @@
+import json
+
+import rating_management
+from db_management import Error
+from write_behind import WriteBehindLog
+
+
+def create_log(tmp_path):
+    applied = []
+    return WriteBehindLog(str(tmp_path / 'writes.log'), applied.append, delay=3600), applied
+
+
+def test_flush_applies_the_last_write_to_each_key(tmp_path):
+    log, applied = create_log(tmp_path)
+    log.append((1, 2), {'score': 3})
+    log.append((1, 3), {'score': 4})
+    log.append((1, 2), {'score': 5})
+    assert log.get_pending((1, 2)) == {'score': 5}
+    assert log.flush() == 2
+    assert applied == [[((1, 2), {'score': 5}), ((1, 3), {'score': 4})]]
+    assert log.get_pending((1, 2)) is None
+    assert log.flush() == 0
+
+
+def test_segment_left_by_a_crash_is_replayed_before_newer_writes(tmp_path):
+    log, applied = create_log(tmp_path)
+    with open(log.path + '.flushing', 'w', encoding='utf-8') as segment:
+        segment.write(json.dumps([[1, 2], 'old']) + '\n' + json.dumps([[4, 5], 'kept']) + '\n')
+        segment.write('[[6, 7], "cut off')     # Never acknowledged, so never applied
+    log.append((1, 2), 'new')
+    assert log.get_pending((1, 2)) == 'new'
+    assert log.get_pending((4, 5)) == 'kept'
+    assert log.get_pending((6, 7), 'none') == 'none'
+    assert log.flush() == 2
+    assert applied == [[((1, 2), 'new'), ((4, 5), 'kept')]]
+
+
+def test_failed_flush_leaves_the_segment_to_replay(tmp_path):
+    attempts = []
+
+    def apply(writes):
+        attempts.append(writes)
+        if len(attempts) == 1:
+            raise RuntimeError('database went away')
+
+    log = WriteBehindLog(str(tmp_path / 'writes.log'), apply, delay=3600)
+    log.append((1, 2), 'value')
+    try:
+        log.flush()
+    except RuntimeError:
+        pass
+    assert log.get_pending((1, 2)) == 'value'
+    assert log.flush() == 1
+    assert attempts == [[((1, 2), 'value')], [((1, 2), 'value')]]
+
+
+def test_writes_that_fail_stay_logged_until_they_are_applied(tmp_path):
+    attempts = []
+
+    def apply(writes):
+        attempts.append(writes)
+        return [(key, value) for key, value in writes if value == 'bad' and len(attempts) < 3]
+
+    log = WriteBehindLog(str(tmp_path / 'writes.log'), apply, delay=3600)
+    log.append((1, 2), 'bad')
+    log.append((3, 4), 'good')
+    assert log.flush() == 1
+    assert log.has_failed_writes()
+    assert (log.get_pending((1, 2)), log.get_pending((3, 4))) == ('bad', None)
+    log.append((5, 6), 'newer')
+    assert log.flush() == 1
+    assert log.flush() == 1
+    assert not log.has_failed_writes()
+    assert log.get_pending((1, 2)) is None
+    assert attempts == [[((1, 2), 'bad'), ((3, 4), 'good')], [((1, 2), 'bad'), ((5, 6), 'newer')], [((1, 2), 'bad')]]
+
+
+def test_newer_write_replaces_a_failed_one(tmp_path):
+    def apply(writes):
+        applied.append(writes)
+        return [(key, value) for key, value in writes if value == 'bad']
+
+    applied = []
+    log = WriteBehindLog(str(tmp_path / 'writes.log'), apply, delay=3600)
+    log.append((1, 2), 'bad')
+    assert log.flush() == 0
+    log.append((1, 2), 'fixed')
+    assert log.flush() == 1
+    assert not log.has_failed_writes()
+    assert applied == [[((1, 2), 'bad')], [((1, 2), 'fixed')]]
+
+
+def test_buffered_ratings_that_cannot_be_written_are_handed_back(monkeypatch):
+    written = []
+
+    def apply_rating_batch(batch):
+        if any(book_id == 404 for (_, book_id), _ in batch):
+            raise Error('no such book')
+        written.extend(batch)
+
+    monkeypatch.setattr(rating_management, '_apply_rating_batch', apply_rating_batch)
+    monkeypatch.setattr(rating_management, 'RATING_WRITE_BEHIND_BATCH_SIZE', 2)
+    writes = [((1, 2), None), ((1, 404), {'score': 5, 'review': ''}), ((1, 3), None)]
+    assert rating_management._apply_buffered_ratings(writes) == [((1, 404), {'score': 5, 'review': ''})]
+    assert written == [((1, 2), None), ((1, 3), None)]
@@ -0,0 +1,246 @@
+from db_management import get_db_connection
+from config import TIMELINE_LENGTH, TIMELINE_FANOUT_LIMIT
+
+# Timelines may grow this far past TIMELINE_LENGTH before a push cuts them back down
+TIMELINE_TRIM_SLACK = TIMELINE_LENGTH // 4
+
+
+def push_rating(connection, user_id, book_id):
+    """
+    Pushes a new or updated rating into the timelines of the rater's followers.
+
+    Ratings from users with more than <code>TIMELINE_FANOUT_LIMIT</code> followers are not pushed.
+    Their followers read those ratings straight from <code>book_ratings</code> instead. Timelines that grow past
+    <code>TIMELINE_LENGTH + TIMELINE_TRIM_SLACK</code> entries are cut back to their <code>TIMELINE_LENGTH</code>
+    most recent ones, so each push only trims about one in <code>TIMELINE_TRIM_SLACK</code> of them.
+
+    *(Tables involved: followers f, book_ratings r, timeline_entries t, timeline_pull_accounts p, user_stats c)*
+
+    :param connection: the connection the rating was written with
+    :param user_id: the id of the user who rated the book
+    :type user_id: int
+    :param book_id: the id of the rated book
+    :type book_id: int
+    :rtype: None
+    """
+    with connection.cursor() as cursor:
+        if _is_pull_account(cursor, user_id):
+            return
+        cursor.execute("""INSERT
+                            INTO timeline_entries (owner_user_id, rater_user_id, book_id, rated_at)
+                          SELECT f.follower_user_id, r.user_id, r.book_id, r.rated_at
+                            FROM followers AS f
+                            JOIN book_ratings AS r
+                              ON r.user_id = f.followed_user_id
+                           WHERE f.followed_user_id = %s
+                             AND r.book_id = %s
+                              ON DUPLICATE KEY UPDATE rated_at = VALUES(rated_at)""", [user_id, book_id])
+        cursor.execute("""SELECT x.owner_user_id
+                            FROM (SELECT f.follower_user_id AS owner_user_id,
+                                         (SELECT t.rated_at
+                                            FROM timeline_entries AS t
+                                           WHERE t.owner_user_id = f.follower_user_id
+                                        ORDER BY t.rated_at DESC
+                                           LIMIT 1 OFFSET %s) AS overflowing_rated_at
+                                    FROM followers AS f
+                                   WHERE f.followed_user_id = %s) AS x
+                           WHERE x.overflowing_rated_at IS NOT NULL""", [TIMELINE_LENGTH + TIMELINE_TRIM_SLACK, user_id])
+        for (owner_user_id,) in cursor.fetchall():
+            _trim_timeline(cursor, owner_user_id)
+
+
+def retract_rating(connection, user_id, book_id):
+    """
+    Removes a deleted rating from every timeline it was pushed into.
+
+    *(Tables involved: timeline_entries t)*
+
+    :param connection: the connection the rating was removed with
+    :param user_id: the id of the user who rated the book
+    :type user_id: int
+    :param book_id: the id of the rated book
+    :type book_id: int
+    :rtype: None
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("""DELETE
+                            FROM timeline_entries
+                           WHERE rater_user_id = %s
+                             AND book_id = %s""", [user_id, book_id])
+
+
+def backfill_followed_user(connection, follower_user_id, followed_user_id):
+    """
+    Copies the recent ratings of a newly followed user into their new follower's timeline.
+
+    *(Tables involved: book_ratings r, timeline_entries t, timeline_pull_accounts p, user_stats c)*
+
+    :param connection: the connection the follower pair was added with
+    :param follower_user_id: the user id of the new follower
+    :type follower_user_id: int
+    :param followed_user_id: the user id of the newly followed user
+    :type followed_user_id: int
+    :rtype: None
+    """
+    with connection.cursor() as cursor:
+        if _is_pull_account(cursor, followed_user_id):
+            return
+        cursor.execute("""INSERT
+                            INTO timeline_entries (owner_user_id, rater_user_id, book_id, rated_at)
+                          SELECT %s, r.user_id, r.book_id, r.rated_at
+                            FROM book_ratings AS r
+                           WHERE r.user_id = %s
+                        ORDER BY r.rated_at DESC
+                           LIMIT %s
+                              ON DUPLICATE KEY UPDATE rated_at = VALUES(rated_at)""",
+                       [follower_user_id, followed_user_id, TIMELINE_LENGTH])
+        _trim_timeline(cursor, follower_user_id)
+
+
+def prune_followed_user(connection, follower_user_id, followed_user_id):
+    """
+    Removes the ratings of a formerly followed user from their former follower's timeline.
+
+    *(Tables involved: timeline_entries t)*
+
+    :param connection: the connection the follower pair was removed with
+    :param follower_user_id: the user id of the former follower
+    :type follower_user_id: int
+    :param followed_user_id: the user id of the formerly followed user
+    :type followed_user_id: int
+    :rtype: None
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("""DELETE
+                            FROM timeline_entries
+                           WHERE owner_user_id = %s
+                             AND rater_user_id = %s""", [follower_user_id, followed_user_id])
+
+
+def trim_timelines(batch_size=1000):
+    """
+    Cuts every timeline that has grown past <code>TIMELINE_LENGTH + TIMELINE_TRIM_SLACK</code> entries back down
+    to its <code>TIMELINE_LENGTH</code> most recent entries. Pushes already do this for the timelines they grow,
+    so it is only needed after writing timeline entries some other way.
+
+    *(Tables involved: timeline_entries t)*
+
+    :param batch_size: the number of timelines trimmed per transaction
+    :type batch_size: int
+    :return: the number of timelines trimmed
+    :rtype: int
+    """
+    trimmed_count = last_owner_user_id = 0
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            while True:
+                cursor.execute("""SELECT t.owner_user_id
+                                    FROM timeline_entries AS t
+                                   WHERE t.owner_user_id > %s
+                                GROUP BY t.owner_user_id
+                                  HAVING COUNT(*) > %s
+                                ORDER BY t.owner_user_id
+                                   LIMIT %s""", [last_owner_user_id, TIMELINE_LENGTH + TIMELINE_TRIM_SLACK, batch_size])
+                owner_user_ids = [owner_user_id for (owner_user_id,) in cursor.fetchall()]
+                for owner_user_id in owner_user_ids:
+                    _trim_timeline(cursor, owner_user_id)
+                connection.commit()
+                trimmed_count += len(owner_user_ids)
+                if len(owner_user_ids) < batch_size:
+                    return trimmed_count
+                last_owner_user_id = owner_user_ids[-1]
+
+
+def rebuild_timelines(batch_size=1000):
+    """
+    Recreates every timeline and the list of pull accounts from scratch, for example after bulk loading data.
+
+    Each timeline is emptied in the same transaction that refills it, so feeds keep showing the old timeline until
+    the rebuild reaches it.
+
+    *(Tables involved: users u, followers f, book_ratings r, timeline_entries t, timeline_pull_accounts p)*
+
+    :param batch_size: the number of timelines rebuilt per transaction
+    :type batch_size: int
+    :return: the number of timelines rebuilt
+    :rtype: int
+    """
+    rebuilt_count = last_owner_user_id = 0
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("""DELETE
+                                FROM timeline_pull_accounts""")
+            cursor.execute("""INSERT
+                                INTO timeline_pull_accounts (user_id)
+                              SELECT f.followed_user_id
+                                FROM followers AS f
+                            GROUP BY f.followed_user_id
+                              HAVING COUNT(*) > %s""", [TIMELINE_FANOUT_LIMIT])
+            cursor.execute("""DELETE
+                                FROM timeline_entries
+                               WHERE rater_user_id IN (SELECT p.user_id
+                                                         FROM timeline_pull_accounts AS p)""")
+            connection.commit()
+            while True:
+                cursor.execute("""SELECT u.id
+                                    FROM users AS u
+                                   WHERE u.id > %s
+                                ORDER BY u.id
+                                   LIMIT %s""", [last_owner_user_id, batch_size])
+                owner_user_ids = [owner_user_id for (owner_user_id,) in cursor.fetchall()]
+                for owner_user_id in owner_user_ids:
+                    cursor.execute("""DELETE
+                                        FROM timeline_entries
+                                       WHERE owner_user_id = %s""", [owner_user_id])
+                    cursor.execute("""INSERT
+                                        INTO timeline_entries (owner_user_id, rater_user_id, book_id, rated_at)
+                                      SELECT %s, r.user_id, r.book_id, r.rated_at
+                                        FROM followers AS f
+                                        JOIN book_ratings AS r
+                                          ON r.user_id = f.followed_user_id
+                                       WHERE f.follower_user_id = %s
+                                         AND NOT EXISTS (SELECT *
+                                                           FROM timeline_pull_accounts AS p
+                                                          WHERE p.user_id = f.followed_user_id)
+                                    ORDER BY r.rated_at DESC
+                                       LIMIT %s""", [owner_user_id, owner_user_id, TIMELINE_LENGTH])
+                connection.commit()
+                rebuilt_count += len(owner_user_ids)
+                if len(owner_user_ids) < batch_size:
+                    return rebuilt_count
+                last_owner_user_id = owner_user_ids[-1]
+
+
+def _is_pull_account(cursor, user_id):
+    """Finds whether a user's ratings are read on demand, and switches them over once they have too many followers."""
+    cursor.execute("""SELECT EXISTS (SELECT *
+                                       FROM timeline_pull_accounts AS p
+                                      WHERE p.user_id = %s) AS is_pull_account,
+                             (SELECT c.follower_count
+                                FROM user_stats AS c
+                               WHERE c.user_id = %s) AS follower_count""", [user_id, user_id])
+    is_pull_account, follower_count = cursor.fetchone()
+    if is_pull_account:
+        return True
+    if (follower_count or 0) <= TIMELINE_FANOUT_LIMIT:
+        return False
+    cursor.execute("""INSERT
+                        INTO timeline_pull_accounts (user_id)
+                      VALUES (%s)""", [user_id])
+    cursor.execute("""DELETE
+                        FROM timeline_entries
+                       WHERE rater_user_id = %s""", [user_id])  # Their ratings are merged in at read time from now on
+    return True
+
+
+def _trim_timeline(cursor, owner_user_id):
+    cursor.execute("""DELETE
+                        FROM timeline_entries
+                       WHERE owner_user_id = %s
+                         AND rated_at < (SELECT x.rated_at
+                                           FROM (SELECT t.rated_at
+                                                   FROM timeline_entries AS t
+                                                  WHERE t.owner_user_id = %s
+                                               ORDER BY t.rated_at DESC
+                                                  LIMIT 1 OFFSET %s) AS x)""",
+                   [owner_user_id, owner_user_id, TIMELINE_LENGTH - 1])
@@ -1,11 +1,32 @@
-from db_management import get_db_connection
+from threading import Event, Thread
+import logging
+
+from db_management import READ, Error, get_db_connection, is_duplicate_key_error
+from cache_management import cached, invalidate
+from membership_management import might_contain, record_false_positive, remember
+from pagination import decode_page_token, get_page, get_recency_condition
+from search_management import index_user, get_search_matches_query
+from config import PAGE_SIZE, SESSION_IDENTITY_TTL, SESSION_ROLE_TTL, USER_STATS_RECONCILE_INTERVAL
+
+_STATS_COLUMNS = ['follower_count', 'following_count', 'rating_count']
+_USER_COUNTS = """(SELECT COUNT(*)
+                     FROM followers AS f
+                    WHERE f.followed_user_id = u.id) AS follower_count,
+                  (SELECT COUNT(*)
+                     FROM followers AS f
+                    WHERE f.follower_user_id = u.id) AS following_count,
+                  (SELECT COUNT(*)
+                     FROM book_ratings AS r
+                    WHERE r.user_id = u.id) AS rating_count"""
+
+_logger = logging.getLogger('instabook.user_stats')
 
 
 def add_user(username, display_name, pin):
     """
-    Adds a new user to the database.
+    Adds a new user to the database and to the search index.
 
-    *(Tables involved: users u)*
+    *(Tables involved: users u, user_search_tokens t)*
 
     :param username: the username of the user to add
     :type username: str
@@ -13,19 +34,32 @@ def add_user(username, display_name, pin):
     :type display_name: str
     :param pin: the pin of the user to add
     :type pin: str
-    :rtype: None
+    :return: the id of the newly added user, or <code>None</code> if the username was taken in the meantime
+    :rtype: int or None
     """
     with get_db_connection() as connection:  # updated during the review session
         with connection.cursor(dictionary=True) as cursor:
-            cursor.execute(f"""INSERT
-                                INTO users (username, display_name, pin)
-                                VALUES (%s, %s, %s)""", [username, display_name, pin])
+            try:
+                cursor.execute(f"""INSERT
+                                    INTO users (username, display_name, pin)
+                                    VALUES (%s, %s, %s)""", [username, display_name, pin])
+            except Error as error:
+                if not is_duplicate_key_error(error):
+                    raise
+                remember('usernames', username)
+                return None
+            new_user_id = cursor.lastrowid
+            remember('usernames', username)
+            index_user(cursor, new_user_id, username, display_name)
             connection.commit()
+            invalidate('user_details', new_user_id)
+            return new_user_id
 
 
 def username_available(username):
     """
-    Finds whether a particular username already exists in the database.
+    Finds whether a particular username already exists in the database. Usernames that are definitely free
+    are answered from an in-memory filter without a query.
 
     *(Tables involved: users u)*
 
@@ -34,16 +68,22 @@ def username_available(username):
     :return: <code>True</code> if the username is available, or <code>False</code> otherwise
     :rtype: bool
     """
+    if not might_contain('usernames', username):
+        return True
     with get_db_connection() as connection:
         with connection.cursor(dictionary=True) as cursor:
-            # Temporary code
-            user = None
+            cursor.execute("""SELECT u.id
+                                FROM users AS u
+                               WHERE u.username = %s""", [username])
+            user = cursor.fetchone()
+            if user is None:
+                record_false_positive('usernames')
             return True if user is None else False
 
 
 def get_user_with_credentials(username, pin):
     """
-    Finds the id of the user with a specific username and pin combination.
+    Finds the user with a specific username and pin combination.
 
     *(Tables involved: users u)*
 
@@ -51,47 +91,64 @@ def get_user_with_credentials(username, pin):
     :type username: str
     :param pin: the pin of the user
     :type pin: str
-    :return: the id of the user, if found
-    :rtype: int or None
+    :return: a dictionary of the form
+        <code>{'id': u.id, 'is_admin': u.is_admin}</code>
+        representing the user, if found
+    :rtype: dict or None
     """
     with get_db_connection() as connection:
         with connection.cursor(dictionary=True) as cursor:
-            cursor.execute("""SELECT *
-                              FROM users
-                              WHERE username = %s""", [username])  # don't use {}. Sql injection attack
+            cursor.execute("""SELECT u.id,
+                                     u.is_admin
+                                FROM users AS u
+                               WHERE u.username = %s
+                                 AND u.pin = %s""", [username, pin])  # don't use {}. Sql injection attack
             user = cursor.fetchone()  # use fetchone because never two users with the same username.
-            return True if user is None else False
+            return user
 
 
-def search_users(name): # updated during the review session
+def search_users(query, page_token=None, page_size=PAGE_SIZE):
     """
-    Finds all users whose username or display name is like a particular name.
+    Finds a page of the users whose username or display name best match a search query, best matches first.
 
-    *(Tables involved: users u)*
+    *(Tables involved: users u, user_search_tokens t)*
 
-    :param name: the name to search for
-    :type name: str
+    :param query: the words to search for
+    :type query: str
+    :param page_token: the token of the page to get, or <code>None</code> for the first page
+    :type page_token: str or None
+    :param page_size: the maximum number of users on a page
+    :type page_size: int
     :return: a list of dictionaries of the form
         <code>{'id': u.id, 'username': u.username, 'display_name': u.display_name, 'is_admin': u.is_admin}</code>
-        representing users
-    :rtype: list[dict]
+        representing users, and the token of the next page, or <code>None</code> if there are no more users
+    :rtype: tuple[list[dict], str or None]
+    :raises pagination.InvalidPageToken: if the page token is malformed
     """
-    with get_db_connection() as connection:
+    after = decode_page_token(page_token, 3)
+    with get_db_connection(READ) as connection:
+        if (matches := get_search_matches_query(connection, 'users', query, after, page_size + 1)) is None:
+            return [], None
+        matches_sql, params = matches
         with connection.cursor(dictionary=True) as cursor:
-            cursor.execute("""SELECT u.id,
-                                     u.username,
-                                     u.display_name,
-                                     u.is_admin
-                                FROM users AS u
-                               WHERE u.username LIKE CONCAT('%', %s, '%')
-                                  OR u.display_name LIKE CONCAT('%', %s, '%')""", [name, name])
+            cursor.execute(f"""SELECT u.id,
+                                      u.username,
+                                      u.display_name,
+                                      u.is_admin,
+                                      m.matched_terms,
+                                      m.exact_terms
+                                 FROM ({matches_sql}) AS m
+                                 JOIN users AS u
+                                   ON u.id = m.id
+                             ORDER BY m.matched_terms DESC, m.exact_terms DESC, u.id""", params)
             users = cursor.fetchall()
-            return users
+            return get_page(users, page_size, ['matched_terms', 'exact_terms', 'id'])
 
 
+@cached('user_details', ttl=SESSION_IDENTITY_TTL)
 def get_user_details(user_id):
     """
-    Gets details of a specific user.
+    Gets details of a specific user. Results are cached for <code>SESSION_IDENTITY_TTL</code> seconds.
 
     *(Tables involved: users u)*
 
@@ -115,9 +172,117 @@ def get_user_details(user_id):
             return user
 
 
+def get_users_details(user_ids):
+    """
+    Gets details of several users in one query, such as the users suggested to follow.
+
+    *(Tables involved: users u)*
+
+    :param user_ids: the ids of the users to get details for
+    :type user_ids: list[int]
+    :return: a list of dictionaries in the same form as <code>get_user_details</code>, in the order of
+        <code>user_ids</code>, without the users that do not exist
+    :rtype: list[dict]
+    """
+    if not user_ids:
+        return []
+    with get_db_connection(READ) as connection:
+        with connection.cursor(dictionary=True) as cursor:
+            cursor.execute(f"""SELECT u.id,
+                                      u.username,
+                                      u.display_name,
+                                      u.is_admin
+                                 FROM users AS u
+                                WHERE u.id IN ({', '.join(['%s'] * len(user_ids))})""", list(user_ids))
+            users_by_id = {user['id']: user for user in cursor.fetchall()}
+            return [users_by_id[user_id] for user_id in user_ids if user_id in users_by_id]
+
+
+def get_user_page(user_id, current_user_id, page_token=None, page_size=PAGE_SIZE):
+    """
+    Gets everything the page of a specific user shows, in a single query: the user's details and counts,
+    whether the current user follows them, and a page of their most recent ratings.
+
+    *(Tables involved: users u, user_stats c, followers f, book_ratings r, books b)*
+
+    :param user_id: the id of the user to get the page for
+    :type user_id: int
+    :param current_user_id: the id of the user viewing the page
+    :type current_user_id: int
+    :param page_token: the token of the page of ratings to get, or <code>None</code> for the first page
+    :type page_token: str or None
+    :param page_size: the maximum number of ratings on a page
+    :type page_size: int
+    :return: a dictionary of the form
+        <code>{'user_details': {...}, 'user_stats': {'follower_count': ..., 'following_count': ..., 'rating_count': ...},
+        'current_user_follows_user': ..., 'user_ratings': [...], 'next_page_token': ...}</code>
+        in the same shapes as <code>get_user_details</code>, <code>follower_pair_exists</code> and
+        <code>get_recent_user_ratings</code>, or <code>None</code> if the user does not exist
+    :rtype: dict or None
+    :raises pagination.InvalidPageToken: if the page token is malformed
+    """
+    after, after_params = get_recency_condition(decode_page_token(page_token, 2), 'r.rated_at', 'r.book_id')
+    with get_db_connection(READ) as connection:
+        with connection.cursor(dictionary=True) as cursor:
+            cursor.execute(f"""SELECT u.id,
+                                      u.username,
+                                      u.display_name,
+                                      u.is_admin,
+                                      COALESCE(c.follower_count, 0) AS follower_count,
+                                      COALESCE(c.following_count, 0) AS following_count,
+                                      COALESCE(c.rating_count, 0) AS rating_count,
+                                      EXISTS (SELECT *
+                                                FROM followers AS f
+                                               WHERE f.follower_user_id = %s
+                                                 AND f.followed_user_id = u.id) AS current_user_follows_user,
+                                      x.book_id,
+                                      x.title,
+                                      x.author,
+                                      x.score,
+                                      x.review,
+                                      x.rated_at
+                                 FROM users AS u
+                            LEFT JOIN user_stats AS c
+                                   ON c.user_id = u.id
+                            LEFT JOIN (SELECT r.book_id,
+                                              b.title,
+                                              b.author,
+                                              r.score,
+                                              r.review,
+                                              r.rated_at
+                                         FROM book_ratings AS r
+                                         JOIN books AS b
+                                           ON b.id = r.book_id
+                                        WHERE r.user_id = %s
+                                          AND {after}
+                                     ORDER BY r.rated_at DESC, r.book_id DESC
+                                        LIMIT %s) AS x
+                                   ON TRUE
+                                WHERE u.id = %s
+                             ORDER BY x.rated_at DESC, x.book_id DESC""",
+                           [current_user_id, user_id, *after_params, page_size + 1, user_id])
+            rows = cursor.fetchall()
+    if not rows:
+        return None
+    first_row = rows[0]
+    user_ratings, next_page_token = get_page(
+        [{column: row[column] for column in ('book_id', 'title', 'author', 'score', 'review', 'rated_at')}
+         for row in rows if row['book_id'] is not None],
+        page_size, ['rated_at', 'book_id'])
+    return {
+        'user_details': {column: first_row[column] for column in ('id', 'username', 'display_name', 'is_admin')},
+        'user_stats': {column: first_row[column] for column in _STATS_COLUMNS},
+        'current_user_follows_user': bool(first_row['current_user_follows_user']),
+        'user_ratings': user_ratings,
+        'next_page_token': next_page_token,
+    }
+
+
+@cached('admin_role', ttl=SESSION_ROLE_TTL)
 def is_admin_user(user_id):
     """
-    Finds whether a particular user is an admin user.
+    Finds whether a particular user is an admin user. Results are cached for <code>SESSION_ROLE_TTL</code> seconds,
+    much shorter than other user details, as other workers keep granting a revoked role until their copy expires.
 
     *(Tables involved: users u)*
 
@@ -126,5 +291,146 @@ def is_admin_user(user_id):
     :return: <code>True</code> if the user is an admin user, or <code>False</code> otherwise
     :rtype: bool
     """
-    user = get_user_details(user_id)
-    return user['is_admin']
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("""SELECT u.is_admin
+                                FROM users AS u
+                               WHERE u.id = %s""", [user_id])
+            row = cursor.fetchone()
+            return row is not None and bool(row[0])
+
+
+def set_user_admin(user_id, is_admin):
+    """
+    Grants or revokes a user's admin rights.
+
+    *(Tables involved: users u)*
+
+    :param user_id: the id of the user to update
+    :type user_id: int
+    :param is_admin: whether the user should be an admin user
+    :type is_admin: bool
+    :return: <code>True</code> if the user exists, or <code>False</code> otherwise
+    :rtype: bool
+    """
+    with get_db_connection() as connection:
+        with connection.cursor(dictionary=True) as cursor:
+            cursor.execute("""UPDATE users
+                                 SET is_admin = %s
+                               WHERE id = %s""", [is_admin, user_id])
+            user_exists = cursor.rowcount == 1
+            connection.commit()
+            invalidate('user_details', user_id)
+            invalidate('admin_role', user_id)
+            return user_exists
+
+
+def update_user_stats(connection, user_id, follower_delta=0, following_delta=0, rating_delta=0):
+    """
+    Applies a change in a user's follower, following or rating count to their stored counts,
+    in the same transaction as the write that changed it.
+
+    *(Tables involved: user_stats c)*
+
+    :param connection: the connection the write was made with
+    :param user_id: the id of the user whose counts changed
+    :type user_id: int
+    :param follower_delta: the change in the number of users following the user
+    :type follower_delta: int
+    :param following_delta: the change in the number of users the user follows
+    :type following_delta: int
+    :param rating_delta: the change in the number of books the user rated
+    :type rating_delta: int
+    :rtype: None
+    """
+    deltas = [follower_delta, following_delta, rating_delta]
+    with connection.cursor() as cursor:
+        if any(delta < 0 for delta in deltas):  # A row being inserted must pass the checks, so only update existing counts
+            increments = ', '.join(f'{column} = {column} + %s' for column in _STATS_COLUMNS)
+            cursor.execute(f"""UPDATE user_stats
+                                  SET {increments}
+                                WHERE user_id = %s""", [*deltas, user_id])
+            return
+        increments = ', '.join(f'{column} = {column} + VALUES({column})' for column in _STATS_COLUMNS)
+        cursor.execute(f"""INSERT
+                             INTO user_stats (user_id, {', '.join(_STATS_COLUMNS)})
+                           VALUES (%s, %s, %s, %s)
+                               ON DUPLICATE KEY UPDATE {increments}""", [user_id, *deltas])
+
+
+def reconcile_user_stats(batch_size=1000):
+    """
+    Recounts the followers, followed users and ratings of every user, and fixes the stored counts that drifted.
+
+    Each batch of users is compared and fixed in its own transaction, so it can run while the site is in use.
+
+    *(Tables involved: users u, user_stats c, followers f, book_ratings r)*
+
+    :param batch_size: the number of users checked per transaction
+    :type batch_size: int
+    :return: the ids of the users whose counts were fixed
+    :rtype: list[int]
+    """
+    fixed_user_ids = []
+    last_user_id = 0
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            while True:
+                cursor.execute("""SELECT MAX(x.id)
+                                    FROM (SELECT u.id
+                                            FROM users AS u
+                                           WHERE u.id > %s
+                                        ORDER BY u.id
+                                           LIMIT %s) AS x""", [last_user_id, batch_size])
+                (batch_end_user_id,) = cursor.fetchone()
+                if batch_end_user_id is None:
+                    return fixed_user_ids
+                cursor.execute(f"""SELECT x.id
+                                     FROM (SELECT u.id,
+                                                  {_USER_COUNTS}
+                                             FROM users AS u
+                                            WHERE u.id > %s
+                                              AND u.id <= %s) AS x
+                                LEFT JOIN user_stats AS c
+                                       ON c.user_id = x.id
+                                    WHERE COALESCE(c.follower_count, 0) <> x.follower_count
+                                       OR COALESCE(c.following_count, 0) <> x.following_count
+                                       OR COALESCE(c.rating_count, 0) <> x.rating_count""",
+                               [last_user_id, batch_end_user_id])
+                drifted_user_ids = [user_id for (user_id,) in cursor.fetchall()]
+                if drifted_user_ids:
+                    recounts = ', '.join(f'{column} = VALUES({column})' for column in _STATS_COLUMNS)
+                    cursor.execute(f"""INSERT
+                                         INTO user_stats (user_id, {', '.join(_STATS_COLUMNS)})
+                                       SELECT u.id,
+                                              {_USER_COUNTS}
+                                         FROM users AS u
+                                        WHERE u.id IN ({', '.join(['%s'] * len(drifted_user_ids))})
+                                           ON DUPLICATE KEY UPDATE {recounts}""", drifted_user_ids)
+                    connection.commit()
+                    fixed_user_ids += drifted_user_ids
+                last_user_id = batch_end_user_id
+
+
+def start_user_stats_reconciler(interval=USER_STATS_RECONCILE_INTERVAL):
+    """
+    Runs :func:`reconcile_user_stats` every <code>interval</code> seconds on a background thread. Started by the
+    process that forks the workers, so that the counts are recounted once per server rather than once per worker.
+
+    :param interval: the number of seconds between runs
+    :type interval: float
+    :return: an event that stops the reconciler once set
+    :rtype: threading.Event
+    """
+    stopped = Event()
+    Thread(target=_reconcile_periodically, args=(interval, stopped), name='user-stats', daemon=True).start()
+    return stopped
+
+
+def _reconcile_periodically(interval, stopped):
+    while not stopped.wait(interval):
+        try:
+            if fixed_user_ids := reconcile_user_stats():
+                _logger.warning('Fixed the drifted counts of %s user(s)', len(fixed_user_ids))
+        except Exception:
+            _logger.exception('Could not reconcile user stats, retrying in %ss', interval)
@@ -1,13 +1,30 @@
 # To install flask, run `pip install flask`
-from flask import request, redirect
+from datetime import datetime
+from hashlib import blake2b
+
+from flask import g, make_response, request, redirect, url_for
 
 from user_management import username_available, is_admin_user
 from book_management import book_exists
+from session_management import SESSION_COOKIE_NAME, get_session_user_id
+from version_management import get_entity_version
+
+
+def get_current_user_id():
+    """
+    Gets the id of the signed in user from their session token.
+
+    :return: the id of the user, or <code>None</code> if nobody is signed in
+    :rtype: int or None
+    """
+    if 'current_user_id' not in g:
+        g.current_user_id = get_session_user_id(request.cookies.get(SESSION_COOKIE_NAME))
+    return g.current_user_id
 
 
 def should_be_signed_in(route_func):
     def decorated_route_func(*args, **kwargs):
-        if request.cookies.get('user_id') is None:
+        if get_current_user_id() is None:
             return redirect('/signin')
         return route_func(*args, **kwargs)
     decorated_route_func.__name__ = route_func.__name__
@@ -16,9 +33,8 @@ def should_be_signed_in(route_func):
 
 def should_be_signed_in_as_admin(route_func):
     def decorated_route_func(*args, **kwargs):
-        if request.cookies.get('user_id') is None:
+        if (user_id := get_current_user_id()) is None:
             return redirect('/signin')
-        user_id = int(request.cookies.get('user_id'))
         if not is_admin_user(user_id):
             return redirect('/')
         return route_func(*args, **kwargs)
@@ -28,13 +44,55 @@ def should_be_signed_in_as_admin(route_func):
 
 def should_be_signed_out(route_func):
     def decorated_route_func(*args, **kwargs):
-        if request.cookies.get('user_id') is not None:
+        if get_current_user_id() is not None:
             return redirect('/')
         return route_func(*args, **kwargs)
     decorated_route_func.__name__ = route_func.__name__
     return decorated_route_func
 
 
+def should_be_revalidated(entity, id_arg, get_unversioned_state=None):
+    """
+    Lets browsers reuse their copy of an entity's page until its version changes.
+
+    The page's ETag covers the entity's version, the signed in user and the query values, since the page
+    shows the user's own rating or follow. A request whose <code>If-None-Match</code> still matches is
+    answered with <code>304 Not Modified</code> before the route runs any of its queries.
+
+    :param entity: the kind of entity the page shows, such as <code>BOOK</code>
+    :type entity: str
+    :param id_arg: the name of the route argument holding the entity's id
+    :type id_arg: str
+    :param get_unversioned_state: a function of the signed in user's id and the entity's id, for what the page
+        shows that can change without a new version, such as <code>get_buffered_rating</code>
+    :type get_unversioned_state: callable or None
+    """
+    def decorate(route_func):
+        def decorated_route_func(*args, **kwargs):
+            current_user_id = get_current_user_id()
+            unversioned_state = get_unversioned_state(current_user_id, kwargs[id_arg]) if get_unversioned_state else None
+            version, updated_at = get_entity_version(entity, kwargs[id_arg])
+            tag_source = f'{entity}:{kwargs[id_arg]}:{version}:{current_user_id}:{request.query_string.decode()}'
+            if unversioned_state is not None:
+                tag_source += f':{unversioned_state}'
+            etag = blake2b(tag_source.encode(), digest_size=12).hexdigest()
+            if request.if_none_match.contains_weak(etag):
+                response = make_response('', 304)
+            else:
+                response = make_response(route_func(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            if updated_at is not None:
+                response.last_modified = datetime.fromisoformat(updated_at) if isinstance(updated_at, str) else updated_at
+            response.cache_control.private = response.cache_control.no_cache = True
+            response.vary.add('Cookie')
+            return response
+        decorated_route_func.__name__ = route_func.__name__
+        return decorated_route_func
+    return decorate
+
+
 def get_query_values(*keys):
     if len(keys) == 1:
         return request.args.get(keys[0])
@@ -47,6 +105,20 @@ def get_form_values(*keys):
     return map(request.form.get, keys)
 
 
+def get_next_page_url(next_page_token):
+    """
+    Gets the url of the next page of the current route, keeping its other query values.
+
+    :param next_page_token: the token of the next page, or <code>None</code> if there is no next page
+    :type next_page_token: str or None
+    :rtype: str or None
+    """
+    if next_page_token is None:
+        return None
+    query_values = {**request.args.to_dict(), 'page': next_page_token}
+    return url_for(request.endpoint, **request.view_args, **query_values)
+
+
 def get_account_creation_error(username, display_name, pin):
     if not 1 <= len(username) <= 20:
         return 'Username must be between 1 and 20 characters long'
@@ -57,18 +129,38 @@ def get_account_creation_error(username, display_name, pin):
     if not pin.isdigit() or len(pin) != 4:
         return 'Pin must consist of 4 digits'
     if not username_available(username):
-        return f'Username {username} is already taken'
+        return get_username_taken_error(username)
+
+
+def get_username_taken_error(username):
+    return f'Username {username} is already taken'
 
 
 def get_book_creation_error(title, author, isbn):
+    if error := get_book_format_error(title, author, isbn):
+        return error
+    if isbn and book_exists(isbn):
+        return get_isbn_taken_error(isbn)
+
+
+def get_isbn_taken_error(isbn):
+    return f'A book with ISBN {isbn} already exists in the database'
+
+
+def get_book_format_error(title, author, isbn):
+    """
+    Checks a new book's details without touching the database, so that bulk imports can check
+    whether isbns are taken in batches instead.
+
+    :return: the error message, or <code>None</code> if the details are valid
+    :rtype: str or None
+    """
     if not 1 <= len(title) <= 255:
         return 'Title must be between 1 and 255 characters long'
     if author and len(author) > 255:
         return 'Author must be at most 255 characters long'
     if isbn and len(isbn) not in (10, 13):
         return 'ISBN must consist of exactly 10 or 13 digits'
-    if isbn and book_exists(isbn):
-        return f'A book with ISBN {isbn} already exists in the database'
 
 
 def get_rating_creation_error(score, review):
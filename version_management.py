@@ -0,0 +1,68 @@
+from db_management import READ, get_db_connection
+
+BOOK = 'book'
+USER = 'user'
+ALL_PAGES = 'all'   # A version every page depends on, for changes that touch many entities at once
+
+
+def bump_version(connection, entity, entity_id):
+    """
+    Records that what is shown on an entity's page changed, so that browsers holding a copy fetch it again.
+
+    Call it with the connection that made the change, so that the new version is committed along with it.
+
+    *(Tables involved: entity_versions v)*
+
+    :param connection: the connection the change was made with
+    :param entity: the kind of entity, such as <code>BOOK</code> or <code>USER</code>
+    :type entity: str
+    :param entity_id: the id of the entity
+    :type entity_id: int
+    :rtype: None
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("""INSERT
+                            INTO entity_versions (entity, entity_id, version)
+                          VALUES (%s, %s, 1)
+                              ON DUPLICATE KEY UPDATE version = version + 1,
+                                                      updated_at = CURRENT_TIMESTAMP(6)""", [entity, entity_id])
+
+
+def expire_all_versions():
+    """
+    Makes every page count as changed, such as after rebuilding derived data or deploying new templates.
+
+    *(Tables involved: entity_versions v)*
+
+    :rtype: None
+    """
+    with get_db_connection() as connection:
+        bump_version(connection, ALL_PAGES, 0)
+        connection.commit()
+
+
+def get_entity_version(entity, entity_id):
+    """
+    Gets the current version of an entity's page, without loading the page itself.
+
+    *(Tables involved: entity_versions v)*
+
+    :param entity: the kind of entity, such as <code>BOOK</code> or <code>USER</code>
+    :type entity: str
+    :param entity_id: the id of the entity
+    :type entity_id: int
+    :return: the version, as a string that changes whenever the page may have, and when it last changed,
+        or <code>None</code> if it never has
+    :rtype: tuple[str, datetime.datetime or str or None]
+    """
+    with get_db_connection(READ) as connection:
+        with connection.cursor(dictionary=True) as cursor:
+            cursor.execute("""SELECT v.entity, v.version, v.updated_at
+                                FROM entity_versions AS v
+                               WHERE (v.entity = %s AND v.entity_id = %s)
+                                  OR (v.entity = %s AND v.entity_id = 0)""", [entity, entity_id, ALL_PAGES])
+            versions = {row['entity']: row for row in cursor.fetchall()}
+    version = f'{versions[entity]["version"] if entity in versions else 0}.' \
+              f'{versions[ALL_PAGES]["version"] if ALL_PAGES in versions else 0}'
+    updated_at = max((row['updated_at'] for row in versions.values()), default=None)
+    return version, updated_at
@@ -0,0 +1,189 @@
+"""
+A durable write-behind log, so that writes can be acknowledged before they reach the database.
+Applying a logged write twice must have the same effect as applying it once, since a crash can replay it.
+"""
+from contextlib import contextmanager
+from threading import Lock, Timer
+import fcntl
+import json
+import logging
+import os
+
+_logger = logging.getLogger('instabook.write_behind')
+
+
+class WriteBehindLog:
+    """
+    An append-only log of keyed writes, flushed to the database in the background.
+
+    :param path: the file writes are logged to
+    :type path: str
+    :param apply: the function that writes to the database, called with a list of <code>(key, value)</code> pairs
+        holding the last value logged for each key. It returns the pairs it could not write, if any, which stay logged and are
+        tried again by the next flush
+    :type apply: callable
+    :param delay: seconds between a write being logged and the flush that applies it
+    :type delay: float
+    """
+
+    def __init__(self, path, apply, delay):
+        self.path = path
+        self._segment_path = path + '.flushing'
+        self._append_lock_path = path + '.lock'
+        self._flush_lock_path = path + '.flush.lock'
+        self._apply = apply
+        self._delay = delay
+        self._tails = {}    # Path -> (inode, offset read up to, {key: value})
+        self._tails_lock = Lock()
+        self._flush_timer = None
+        self._timer_lock = Lock()
+        os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def append(self, key, value):
+        """
+        Logs a write, and schedules a flush.
+
+        :param key: what the write is to, such as <code>(user_id, book_id)</code>
+        :type key: tuple
+        :param value: what is written, which must be JSON serializable
+        :rtype: None
+        """
+        line = json.dumps([list(key), value]) + '\n'
+        with _file_lock(self._append_lock_path, fcntl.LOCK_EX):
+            with open(self.path, 'a', encoding='utf-8') as log:
+                log.write(line)
+                log.flush()
+                os.fsync(log.fileno())
+        self.schedule_flush()
+
+    def get_pending(self, key, default=None):
+        """
+        Gets the last value logged for a key that has not been flushed yet, by any process.
+
+        :param key: the key of the write
+        :type key: tuple
+        :param default: what to return if there is no pending write to the key
+        :return: the value, or <code>default</code>
+        """
+        with self._tails_lock:
+            for path in (self.path, self._segment_path):   # Writes in the log are newer than those in the segment
+                pending = self._read_tail(path)
+                if key in pending:
+                    return pending[key]
+        return default
+
+    def schedule_flush(self):
+        """Flushes the log after the delay, unless a flush is already scheduled."""
+        with self._timer_lock:
+            if self._flush_timer is not None:
+                return
+            self._flush_timer = Timer(self._delay, self._flush_in_background)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def flush(self):
+        """
+        Applies every logged write, including those of a flush that was cut short or could not write them all.
+
+        :return: the number of writes applied after collapsing, or <code>None</code> if another process is flushing
+        :rtype: int or None
+        """
+        with _file_lock(self._flush_lock_path, fcntl.LOCK_EX | fcntl.LOCK_NB) as is_locked:
+            if not is_locked:
+                return None
+            with _file_lock(self._append_lock_path, fcntl.LOCK_EX):
+                self._move_log_to_segment()
+            if not os.path.exists(self._segment_path):
+                return 0
+            with open(self._segment_path, encoding='utf-8') as segment:
+                writes = _parse_lines(segment.read())
+            failed_writes = (self._apply(list(writes.items())) if writes else None) or []
+            if failed_writes:
+                self._write_segment(failed_writes)
+            else:
+                os.remove(self._segment_path)
+            return len(writes) - len(failed_writes)
+
+    def has_failed_writes(self):
+        """Tells whether the last flush left writes it could not apply in the log."""
+        return os.path.exists(self._segment_path)
+
+    def _move_log_to_segment(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return
+        if not os.path.exists(self._segment_path):
+            os.replace(self.path, self._segment_path)
+            return
+        # Writes left in the segment must be applied together with newer ones, or a retry could overwrite them
+        with open(self._segment_path, encoding='utf-8') as segment, open(self.path, encoding='utf-8') as log:
+            writes = {**_parse_lines(segment.read()), **_parse_lines(log.read())}
+        self._write_segment(writes.items())
+        os.remove(self.path)
+
+    def _write_segment(self, writes):
+        with open(self._segment_path + '.new', 'w', encoding='utf-8') as segment:
+            segment.writelines(json.dumps([list(key), value]) + '\n' for key, value in writes)
+            segment.flush()
+            os.fsync(segment.fileno())
+        os.replace(self._segment_path + '.new', self._segment_path)
+
+    def _flush_in_background(self):
+        with self._timer_lock:
+            self._flush_timer = None    # Writes logged from now on are picked up by this flush or the next one
+        try:
+            if self.flush() is None:
+                self.schedule_flush()   # Another process is flushing, and may have moved the log aside before our write
+            elif self.has_failed_writes():
+                _logger.warning('Could not apply every write in %s, retrying later', self._segment_path)
+                self.schedule_flush()
+        except Exception:
+            _logger.exception('Could not flush %s, retrying later', self._segment_path)
+            self.schedule_flush()
+
+    def _reset_after_fork(self):
+        self._flush_timer = None    # Its thread was not copied into the forked process
+        self._timer_lock = Lock()
+        self._tails_lock = Lock()
+
+    def _read_tail(self, path):
+        try:
+            status = os.stat(path)
+        except FileNotFoundError:
+            self._tails.pop(path, None)
+            return {}
+        inode, offset, pending = self._tails.get(path, (None, 0, {}))
+        if inode != status.st_ino or status.st_size < offset:
+            offset, pending = 0, {}     # The file was moved aside or replaced since it was last read
+        if status.st_size > offset:
+            with open(path, 'rb') as log:
+                log.seek(offset)
+                data = log.read(status.st_size - offset)
+            complete_size = data.rfind(b'\n') + 1     # Leave a line that is still being written for the next read
+            pending = {**pending, **_parse_lines(data[:complete_size].decode('utf-8'))}
+            offset += complete_size
+        self._tails[path] = (status.st_ino, offset, pending)
+        return pending
+
+
+def _parse_lines(text):
+    """Collapses the lines of a log into the last value written to each key."""
+    writes = {}
+    complete_size = text.rfind('\n') + 1    # A line without its newline was cut off by a crash before it was acknowledged
+    for line in text[:complete_size].splitlines():
+        key, value = json.loads(line)
+        writes[tuple(key)] = value
+    return writes
+
+
+@contextmanager
+def _file_lock(path, operation):
+    with open(path, 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, operation)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)